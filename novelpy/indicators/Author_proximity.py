@@ -2,6 +2,8 @@
 import itertools
 import numpy as np
 from novelpy.utils.run_indicator_tools import Dataset
+from novelpy.utils.io_tools import iter_docs, find_by_ids, MONGO_BATCH_SIZE
+from novelpy.utils.backends import require_mongo
 import pymongo
 from pymongo import UpdateOne
 import tqdm
@@ -136,6 +138,8 @@ class Author_proximity(Dataset):
         self.windows_size = windows_size 
         self.distance_type = distance_type
         self.output_name = 'output_Author_proximity'
+        # The documents are read in a session, refreshed while the authors are processed
+        require_mongo(client_name, "Author_proximity")
         Dataset.__init__(
             self,
             client_name = client_name,
@@ -171,9 +175,11 @@ class Author_proximity(Dataset):
             self.docs = self.collection.find({
                 self.aut_list_variable:{'$ne':None},
                 self.year_variable:self.focal_year
-                },no_cursor_timeout  = True, session=self.session)
+                },
+                {self.id_variable:1, self.aut_list_variable:1, self.year_variable:1, "_id":0},
+                no_cursor_timeout  = True, session=self.session).batch_size(MONGO_BATCH_SIZE)
         else:
-            self.docs = json.load(open("Data/docs/{}/{}.json".format(self.collection_name,self.focal_year)))
+            self.docs = iter_docs("Data/docs/{}/{}".format(self.collection_name,self.focal_year))
             
     def slip_cell(self,
                 score_info,
@@ -559,10 +565,20 @@ class Author_proximity(Dataset):
          
         self.i = 1 
         if list_of_ids:
-            for id_ in tqdm.tqdm(list_of_ids):
+            # The documents are read by chunks of ids with the fields used only
+            projection = {self.id_variable:1, self.aut_list_variable:1, self.year_variable:1, "_id":0}
+            list_of_ids = list(list_of_ids)
+            chunk = dict()
+            for position, id_ in enumerate(tqdm.tqdm(list_of_ids)):
                 if self.i > self.last_i:
-                    self.session = self.client.start_session()
-                    doc = self.collection.find_one({self.id_variable:id_})
+                    if id_ not in chunk:
+                        ids = list_of_ids[position:position+10000]
+                        chunk = {doc[self.id_variable]:doc for doc in find_by_ids(self.collection,
+                                                                                  self.id_variable,
+                                                                                  ids,
+                                                                                  projection = projection)}
+                        chunk.update({missing:None for missing in ids if missing not in chunk})
+                    doc = chunk[id_]
                     if doc:
                         self.focal_year = doc[self.year_variable]
                         if self.aut_list_variable in doc:
@@ -10,6 +10,7 @@ from packaging import version
 from collections import defaultdict
 from scipy.sparse import lil_matrix
 import community as community_louvain
+from novelpy.utils.cooc_utils import dump_matrix
 from novelpy.utils.run_indicator_tools import create_output
 
 
@@ -29,7 +30,10 @@ class Foster2015(create_output):
              client_name = None,
              db_name = None,
              density = False,
-             list_ids = None):
+             list_ids = None,
+             ragged = False,
+             n_jobs = 1,
+             output_format = "json"):
         
         '''
         Description
@@ -62,6 +66,12 @@ class Foster2015(create_output):
             The name of the community algorithm to be used.
         density: bool 
             If True, save an array where each cell is the score of a combination. If False, save only the percentile of this array
+        ragged: bool
+            If True, store the items of the documents as integer arrays instead of lists of names.
+        n_jobs: int
+            Number of processes scoring the documents. Default is 1.
+        output_format: str
+            "json" or "parquet" (one row per document and one column per score, needs pyarrow). Default is "json".
 
         '''
         
@@ -79,7 +89,10 @@ class Foster2015(create_output):
                                focal_year = focal_year,
                                starting_year = starting_year,
                                density = density,
-                               list_ids = list_ids)
+                               list_ids = list_ids,
+                               ragged = ragged,
+                               n_jobs = n_jobs,
+                               output_format = output_format)
 
         self.path_score = "Data/score/foster/{}".format(self.variable)
         
@@ -87,7 +100,7 @@ class Foster2015(create_output):
             os.makedirs(self.path_score)
         
     def save_score_matrix(self):
-        pickle.dump(self.df, open(self.path_score + "/{}.p".format(self.focal_year),"wb" ) )
+        dump_matrix(self.df, self.path_score + "/{}".format(self.focal_year), self.matrix_format)
         
     def Louvain_based(self):
         '''
@@ -161,21 +174,24 @@ class Foster2015(create_output):
         None
 
         '''
+        self.check_score()
         self.get_data()
-        if version.parse(nx.__version__) < version.parse("3.0"):
-            self.g = nx.from_scipy_sparse_matrix(self.current_adj, edge_attribute='weight') 
-        else:
-            self.g = nx.from_scipy_sparse_array(self.current_adj, edge_attribute='weight') 
-            
-        print("Create empty df ...")
-        self.generate_commu_adj_matrix()
-        print("Empty df created !")  
-        print("Compute community and community appartenance for starting year {}- and focal year {}".format(self.starting_year, self.focal_year))
-        self.run_iteration()
-        print("Done !")
-        print('Getting the {} novelty score for combination of items in {} ...'.format(self.indicator, self.focal_year))  
-        self.save_score_matrix()
-        print("Done !")
+        if not self.score_fresh:
+            if version.parse(nx.__version__) < version.parse("3.0"):
+                self.g = nx.from_scipy_sparse_matrix(self.current_adj, edge_attribute='weight') 
+            else:
+                self.g = nx.from_scipy_sparse_array(self.current_adj, edge_attribute='weight') 
+                
+            print("Create empty df ...")
+            self.generate_commu_adj_matrix()
+            print("Empty df created !")  
+            print("Compute community and community appartenance for starting year {}- and focal year {}".format(self.starting_year, self.focal_year))
+            self.run_iteration()
+            print("Done !")
+            print('Getting the {} novelty score for combination of items in {} ...'.format(self.indicator, self.focal_year))  
+            self.save_score_matrix()
+            self.save_score_meta()
+            print("Done !")
         print('Attributing the {} novelty indicator for {}  papers ...'.format(self.indicator, self.focal_year))         
         self.update_paper_values()
         print("Done !")
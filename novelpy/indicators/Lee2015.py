@@ -5,6 +5,7 @@ import pickle
 import numpy as np
 import scipy.sparse as sp
 from scipy.sparse import csr_matrix, triu
+from novelpy.utils.cooc_utils import compact_matrix, dump_matrix
 from novelpy.utils.run_indicator_tools import create_output
 
 # np.seterr(divide='ignore', invalid='ignore')
@@ -22,7 +23,11 @@ class Lee2015(create_output):
              db_name = None,
              density = False,
              list_ids = None,
-             ram_efficient= False):
+             ram_efficient= False,
+             score_dtype = None,
+             ragged = False,
+             n_jobs = 1,
+             output_format = "json"):
         """
         Description
         -----------
@@ -50,6 +55,14 @@ class Lee2015(create_output):
             Name of the MongoDB.
         density: bool 
             If True, save an array where each cell is the score of a combination. If False, save only the percentile of this array
+        score_dtype: np.dtype
+            Type of the saved score matrix, e.g np.float32 to halve its size. Default is None (float64).
+        ragged: bool
+            If True, store the items of the documents as integer arrays instead of lists of names.
+        n_jobs: int
+            Number of processes scoring the documents. Default is 1.
+        output_format: str
+            "json" or "parquet" (one row per document and one column per score, needs pyarrow). Default is "json".
 
 
         Returns
@@ -70,7 +83,11 @@ class Lee2015(create_output):
                                sub_variable = sub_variable,
                                focal_year = focal_year,
                                density = density,
-                               list_ids = list_ids) 
+                               list_ids = list_ids,
+                               score_dtype = score_dtype,
+                               ragged = ragged,
+                               n_jobs = n_jobs,
+                               output_format = output_format)
         
         self.ram_efficient = ram_efficient
         self.path_score = "Data/score/lee/{}".format(variable)
@@ -117,16 +134,19 @@ class Lee2015(create_output):
             comb_scores.data[np.isnan(comb_scores.data)] =  0
             comb_scores = triu(comb_scores,format='csr')
 
-        print("pickle dump")
-        pickle.dump(comb_scores, open(self.path_score + "/{}.p".format(self.focal_year), "wb" ) )
+        print("save score matrix")
+        dump_matrix(compact_matrix(comb_scores, self.score_dtype), self.path_score + "/{}".format(self.focal_year), self.matrix_format)
         
 
     def get_indicator(self):
 
+        self.check_score()
         self.get_data()      
-        print('Getting the {} novelty score for combination of items in {} ...'.format(self.indicator, self.focal_year))  
-        self.compute_comb_score()
-        print("Matrice done !")  
+        if not self.score_fresh:
+            print('Getting the {} novelty score for combination of items in {} ...'.format(self.indicator, self.focal_year))  
+            self.compute_comb_score()
+            self.save_score_meta()
+            print("Matrice done !")  
         print('Attributing the {} novelty indicator for {}  papers ...'.format(self.indicator, self.focal_year))        
         self.update_paper_values()
         print("Done !")        
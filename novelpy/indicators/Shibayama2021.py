@@ -2,7 +2,8 @@
 import itertools
 import numpy as np
 from novelpy.utils.run_indicator_tools import Dataset
-import pymongo
+from novelpy.utils.io_tools import iter_docs, get_doc_years
+from novelpy.utils.backends import get_backend
 import tqdm
 #from sklearn.metrics.pairwise import cosine_similarity
 import json
@@ -207,37 +208,40 @@ class Shibayama2021(Dataset):
                                  doc):
         refs_embedding = []
         refs_ids = doc[self.ref_variable]
+        if self.client_name:
+            # One query for all the references, reading only the embeddings
+            found = {ref_embedding[self.id_variable]: ref_embedding
+                     for ref_embedding in self.embedding_backend.read_by_ids(set(refs_ids),
+                                                                             projection = self.embedding_projection)}
+        else:
+            found = self.collection_embedding
         for ref in refs_ids:
-            if self.client_name:
-                ref_embedding = self.collection_embedding.find_one({self.id_variable: ref})
-            else:
-                try:
-                    ref_embedding = self.collection_embedding[ref]
-                except:
-                    continue
+            try:
+                ref_embedding = found[ref]
+            except:
+                continue
             if ref_embedding:
-                if self.client_name:
-                    ref_embedding.pop('_id')
-                    ref_embedding.pop('year')
                 refs_embedding.append(ref_embedding)
         return refs_embedding
 
     def load_data(self):
 
         if self.client_name:
-            self.docs = self.collection.find({
-                self.ref_variable:{'$ne':None},
-                self.year_variable:self.focal_year
-                },
-                no_cursor_timeout=True)
+            self.docs = self.backend.read_year(self.focal_year,
+                                               {self.ref_variable:{'$ne':None}},
+                                               {self.id_variable:1, self.ref_variable:1, "year":1, "_id":0},
+                                               no_cursor_timeout=True)
+            self.embedding_projection = {self.id_variable:1, "title_embedding":1, "abstract_embedding":1, "_id":0}
             self.processed = []
-            self.collection_embedding = self.db[self.collection_embedding_name]
+            # Index id_variable of the embedding collection (MongoDB or SQLite) for these lookups
+            self.embedding_backend = get_backend(self.client_name, self.db_name, self.collection_embedding_name,
+                                                 self.id_variable)
         else:
-            self.docs = json.load(open("Data/docs/{}/{}.json".format(self.collection_name,self.focal_year)))
+            self.docs = iter_docs("Data/docs/{}/{}".format(self.collection_name,self.focal_year))
             collection_embedding_acc = []
-            all_years = [int(re.sub('.json','',file)) for file in os.listdir("Data/docs/{}/".format(self.collection_embedding_name))]
+            all_years = get_doc_years("Data/docs/{}/".format(self.collection_embedding_name))
             for year in all_years:
-                collection_embedding_acc += json.load(open("Data/docs/{}/{}.json".format(self.collection_embedding_name,year)))
+                collection_embedding_acc += iter_docs("Data/docs/{}/{}".format(self.collection_embedding_name,year))
             self.collection_embedding = {doc[self.id_variable]:{self.id_variable:doc[self.id_variable],
                                                            "title_embedding":doc["title_embedding"],
                                                            "abstract_embedding":doc["abstract_embedding"]} for doc in collection_embedding_acc}
@@ -277,15 +281,13 @@ class Shibayama2021(Dataset):
                         self.list_of_insertion.append({self.id_variable: doc[self.id_variable],'shibayama': self.infos})
 
         if self.client_name:
-            if "output_shibayama" not in self.db.list_collection_names():
-                print("Init output collection with index on id_variable ...")
-                self.collection_output = self.db["output_shibayama"]
-                self.collection_output.create_index([ (self.id_variable,1) ])
-                self.collection_output.create_index([ (self.year_variable,1) ])
-            else:
-                self.collection_output = self.db["output_shibayama"]
+            # MongoDB or SQLite file, the indexes are created once
+            self.output_backend = get_backend(self.client_name, self.db_name, "output_shibayama",
+                                              self.id_variable, self.year_variable)
+            self.output_backend.create_index(self.id_variable)
+            self.output_backend.create_index(self.year_variable)
             if self.list_of_insertion:
-                self.collection_output.insert_many(self.list_of_insertion)
+                self.output_backend.bulk_write(self.list_of_insertion)
         else:
             if self.list_of_insertion:
                 with open(self.path_score + "/{}.json".format(self.focal_year), 'w') as outfile:
@@ -1,14 +1,14 @@
 import os
-import re
 import tqdm
 import pickle
 import numpy as np
 import pandas as pd
-from random import sample
+from random import sample, Random
 from sklearn import preprocessing
-from itertools import combinations
 from scipy.sparse import triu, lil_matrix
+from novelpy.utils.cooc_utils import compact_matrix, dump_matrix, load_matrix, get_matrix_file, incidence_from_indices, cooc_from_incidence
 from novelpy.utils.run_indicator_tools import create_output
+from novelpy.utils.cache import get_artifact_key, get_signatures, is_fresh, load_meta, save_meta, hash_ids
 
 pd.options.mode.chained_assignment = None
 
@@ -45,15 +45,12 @@ def get_adjacency_matrix(unique_items,
         dtm_mat = lil_matrix(lb.fit_transform(items_list))
         adj_mat = dtm_mat.T.dot(dtm_mat)
     else:
-        adj_mat = lil_matrix((len(unique_items.keys()),len(unique_items.keys())), dtype = np.uint32)
-        for item in items_list:
-            for combi in list(combinations(item, r=2)):
-                combi = sorted(combi)
-                ind_1 = unique_items[combi[0]]
-                ind_2 = unique_items[combi[1]]
-                adj_mat[ind_1,ind_2] += 1
-                if ind_1 != ind_2:
-                    adj_mat[ind_2,ind_1] += 1          
+        # Pairs counted with multiplicity from the document x item incidence matrix, triu(X'X)
+        X = incidence_from_indices([unique_items[item] for items in items_list for item in items],
+                                   [len(items) for items in items_list],
+                                   len(unique_items),
+                                   np.uint32)
+        return cooc_from_incidence(X, weighted_network = True, self_loop = keep_diag)
     adj_mat = lil_matrix(adj_mat)
     if keep_diag == False:
         adj_mat.setdiag(0)
@@ -62,7 +59,7 @@ def get_adjacency_matrix(unique_items,
     adj_mat.eliminate_zeros()
     return adj_mat
 
-def shuffle_network(current_items):
+def shuffle_network(current_items, rng = None):
     """
     
     Description
@@ -73,6 +70,8 @@ def shuffle_network(current_items):
     ----------
     current_items : list
         list of list of items
+    rng : random.Random, optional
+        generator used to resample, the global one of the random module if None
 
     Returns
     -------
@@ -91,11 +90,41 @@ def shuffle_network(current_items):
     years = set(df.year)
     for year in  years:
         journals_y = list(df.item[df.year == year])
-        df.item[df.year == year] = sample(journals_y,k = len(journals_y))
+        df.item[df.year == year] = (rng.sample if rng else sample)(journals_y,k = len(journals_y))
 
     random_network = list(df.groupby('idx')['item'].apply(list))
 
     return random_network
+
+def shuffle_ragged(papers_ragged, rng = None):
+    """
+    
+    Description
+    -----------
+    Same as shuffle_network on the integer arrays of a RaggedItems: the items of a given year are permuted between the documents
+
+    Parameters
+    ----------
+    papers_ragged : novelpy.utils.ragged.RaggedItems
+        items of the documents with their year
+    rng : np.random.Generator, optional
+        generator used to permute, the global one of numpy if None
+
+    Returns
+    -------
+    indices : np.array
+        index of the items of the resampled documents, with the offsets of papers_ragged
+
+    """
+    indices = papers_ragged.indices.copy()
+    order = np.argsort(papers_ragged.years, kind = "stable")
+    sorted_years = papers_ragged.years[order]
+    starts = np.flatnonzero(np.r_[True, sorted_years[1:] != sorted_years[:-1]])
+    ends = np.r_[starts[1:], len(order)]
+    for start, end in zip(starts, ends):
+        positions = order[start:end]
+        indices[positions] = indices[(rng if rng is not None else np.random).permutation(positions)]
+    return indices
         
 def get_unique_value_used(all_sampled_adj_freq):
     """
@@ -244,7 +273,12 @@ class Uzzi2013(create_output):
              db_name = None,
              nb_sample = 20,
              density = False,
-             list_ids = None):
+             list_ids = None,
+             score_dtype = None,
+             ragged = False,
+             seed = None,
+             n_jobs = 1,
+             output_format = "json"):
         """
         Description
         -----------
@@ -274,6 +308,16 @@ class Uzzi2013(create_output):
             Number of resample of the co-occurence matrix.
         density: bool 
             If True, save an array where each cell is the score of a combination. If False, save only the percentiles of this array
+        score_dtype: np.dtype
+            Type of the saved score matrix, e.g np.float32 to halve its size. Default is None (float64).
+        ragged: bool
+            If True, store the items of the documents as integer arrays instead of dicts of names and shuffle these arrays.
+        seed: int
+            If given, the i-th sample is drawn from a generator seeded with (seed, i) so that the samples can be rebuilt identically.
+        n_jobs: int
+            Number of processes scoring the documents. Default is 1.
+        output_format: str
+            "json" or "parquet" (one row per document and one column per score, needs pyarrow). Default is "json".
 
         Returns
         -------
@@ -282,6 +326,7 @@ class Uzzi2013(create_output):
         """
 
         self.nb_sample = nb_sample
+        self.seed = seed
         self.indicator = "uzzi"
         
         create_output.__init__(self,
@@ -294,7 +339,11 @@ class Uzzi2013(create_output):
                                sub_variable = sub_variable,
                                focal_year = focal_year,
                                density = density,
-                               list_ids = list_ids) 
+                               list_ids = list_ids,
+                               score_dtype = score_dtype,
+                               ragged = ragged,
+                               n_jobs = n_jobs,
+                               output_format = output_format) 
         
         
         self.path_sample = "Data/cooc_sample/{}/".format(self.variable)
@@ -309,47 +358,85 @@ class Uzzi2013(create_output):
     def sample_network(self):
         """
         
+        Description
+        -----------
+        Create nb_sample resampled coocurence matrices of focal_year. A sample is kept if it was computed
+        from the same documents, vocabulary and parameters (see novelpy.utils.cache), otherwise it is built again
 
         Parameters
         ----------
-        nb_sample : int
-            number of sample to create.
 
         Returns
         -------
         None.
 
         """
-        already_computed = [
-            f for f in os.listdir(self.path_sample) 
-                             if re.match(r'sample_[0-9]+_{}'.format(self.focal_year), f)
-                             ]
-        if already_computed:
-            print("""Some of the sample are already computed, we skip the recomputation. 
-                If this is not a wanted behavior delete the samples here {}""".format(self.path_sample))
-
+        meta = load_meta(self.path_sample + "sample_0_{}".format(self.focal_year))
+        previous = meta["inputs"] if meta else None
+        # The inputs are the same for every sample: the vocabulary and the documents of focal_year (file or database)
+        signatures = get_signatures([self.path_input + "/name2index.p"], previous)
+        signatures.update(self.backend.get_year_signatures(self.focal_year, previous))
+        inputs = list(signatures)
+        n_fresh = 0
         for i in tqdm.tqdm(range(self.nb_sample),desc = 'Create sample network'):
-            filename =  "sample_{}_{}.p".format(i,self.focal_year)
-            if filename not in already_computed:
+            filename =  "sample_{}_{}".format(i,self.focal_year)
+            params = dict(variable = self.variable,
+                          sub_variable = self.sub_variable,
+                          focal_year = self.focal_year,
+                          sample = i,
+                          seed = self.seed,
+                          list_ids = hash_ids(self.list_ids))
+            key, signatures = get_artifact_key(self.path_sample + filename, params, inputs, signatures)
+            if is_fresh(self.path_sample + filename, key):
+                n_fresh += 1
+                continue
+            if self.ragged:
+                rng = np.random.default_rng([self.seed, i]) if self.seed is not None else None
+                # Shuffle the indices and count their pairs without going back to the names
+                X = incidence_from_indices(shuffle_ragged(self.papers_ragged, rng),
+                                           self.papers_ragged.lengths,
+                                           len(self.name2index),
+                                           np.uint32)
+                sampled_current_adj = cooc_from_incidence(X, weighted_network = True, self_loop = True)
+            else:
+                rng = Random("{}_{}".format(self.seed, i)) if self.seed is not None else None
                 # Shuffle Network
-                sampled_current_items = shuffle_network(self.papers_items)
+                sampled_current_items = shuffle_network(self.papers_items, rng)
                 # Get Adjacency matrix
                 sampled_current_adj = get_adjacency_matrix(self.name2index,
                                                            sampled_current_items,
                                                            unique_pairwise = False,
                                                            keep_diag = True)
-                pickle.dump(
-                    sampled_current_adj,
-                    open(self.path_sample + filename,
-                         "wb" ) )
+            dump_matrix(sampled_current_adj,
+                        self.path_sample + filename,
+                        self.matrix_format)
+            save_meta(self.path_sample + filename, get_matrix_file(self.path_sample + filename), key, params, signatures)
+        if n_fresh:
+            print("{} samples are up to date and were not computed again".format(n_fresh))
+
+    def remove_iterations(self):
+        """
+        
+        Description
+        -----------
+        Remove the checkpoints of get_comb_mean_sd for focal_year, left by a computation on other samples
+
+        Returns
+        -------
+        None.
+
+        """
+        for file in ["mean_info_{}_{}.p", "sd_info_{}_{}.p", "mean_sd_last_i_{}_{}.txt"]:
+            file = self.path_score + "/iteration/" + file.format('uzzi', self.focal_year)
+            if os.path.exists(file):
+                os.remove(file)
 
     def get_all_adj(self):
 	# Get nb_sample networks
         self.all_sampled_adj_freq = []
         for i in tqdm.tqdm(range(self.nb_sample),desc = 'Get sample network'):
-            sampled_current_adj_freq = pickle.load(
-                open(self.path_sample + "sample_{}_{}.p".format(i,self.focal_year),
-                "rb" ) )
+            sampled_current_adj_freq = load_matrix(
+                self.path_sample + "sample_{}_{}".format(i,self.focal_year))
             
             self.all_sampled_adj_freq.append(sampled_current_adj_freq)
         
@@ -382,8 +469,9 @@ class Uzzi2013(create_output):
         comb_scores = triu(comb_scores,format='csr')
         comb_scores.eliminate_zeros()
             
-        pickle.dump(comb_scores,
-                    open(self.path_score + "/{}.p".format(self.focal_year),"wb" ) )
+        dump_matrix(compact_matrix(comb_scores, self.score_dtype),
+                    self.path_score + "/{}".format(self.focal_year),
+                    self.matrix_format)
         
 
     def get_indicator(self):
@@ -391,9 +479,15 @@ class Uzzi2013(create_output):
         print("Creating sample for Uzzi et al. (2013) ...")
         self.sample_network()
         print("Done ! Saved in {}".format(self.path_sample))
-        print('Getting the {} novelty score for combination of items in {} ...'.format(self.indicator, self.focal_year))  
-        self.compute_comb_score()
-        print("Matrice done !")  
+        self.check_score()
+        if not self.score_fresh:
+            if self.score_meta is not None:
+                # The score matrix was computed from other samples or inputs
+                self.remove_iterations()
+            print('Getting the {} novelty score for combination of items in {} ...'.format(self.indicator, self.focal_year))  
+            self.compute_comb_score()
+            self.save_score_meta()
+            print("Matrice done !")  
         print('Attributing the {} novelty indicator for {}  papers ...'.format(self.indicator, self.focal_year))        
         self.update_paper_values()
         print("Done !")       
@@ -3,6 +3,7 @@ import pickle
 import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
 from scipy.sparse import csr_matrix, lil_matrix, triu, tril
+from novelpy.utils.cooc_utils import compact_matrix, dump_matrix
 from novelpy.utils.run_indicator_tools import create_output
 
 
@@ -46,7 +47,11 @@ class Wang2017(create_output):
                  db_name = None,
                  keep_item_percentile = 50,
                  density = False,
-                 list_ids = None):
+                 list_ids = None,
+                 score_dtype = None,
+                 ragged = False,
+                 n_jobs = 1,
+                 output_format = "json"):
         """
         
         Description
@@ -75,6 +80,14 @@ class Wang2017(create_output):
             Name of the MongoDB.
         density: bool 
             If True, save an array where each cell is the score of a combination. If False, save only the percentiles of this array
+        score_dtype: np.dtype
+            Type of the saved score matrix, e.g np.float32 to halve its size. Default is None (float64).
+        ragged: bool
+            If True, store the items of the documents as integer arrays instead of lists of names.
+        n_jobs: int
+            Number of processes scoring the documents. Default is 1.
+        output_format: str
+            "json" or "parquet" (one row per document and one column per score, needs pyarrow). Default is "json".
         time_window_cooc : int
             time window to compute the difficulty in the past and the reutilisation in the futur.
         n_reutilisation : int
@@ -102,7 +115,11 @@ class Wang2017(create_output):
                                starting_year = starting_year,
                                density = density,
                                keep_item_percentile = keep_item_percentile,
-                               list_ids = list_ids)        
+                               list_ids = list_ids,
+                               score_dtype = score_dtype,
+                               ragged = ragged,
+                               n_jobs = n_jobs,
+                               output_format = output_format)
 
         self.path_score = "Data/score/wang/{}/".format(self.variable + "_" + str(self.time_window_cooc) + "_" + str(self.n_reutilisation)+ self.restricted )
        
@@ -139,18 +156,23 @@ class Wang2017(create_output):
 
         self.cos_sim = get_difficulty_cos_sim(self.difficulty_adj)
 
-        comb_scores = self.futur_adj.multiply(self.nbd_adj).multiply(self.cos_sim)
-        comb_scores[comb_scores.nonzero()] = 1 - comb_scores[comb_scores.nonzero()]   
+        comb_scores = csr_matrix(self.futur_adj.multiply(self.nbd_adj).multiply(self.cos_sim))
+        comb_scores.eliminate_zeros()
+        # 1 - cosine similarity of the stored pairs, scipy does not subtract a sparse matrix from a scalar
+        comb_scores.data = 1 - comb_scores.data
                     
-        pickle.dump(comb_scores, open(self.path_score + "{}.p".format(self.focal_year), "wb" ) )
+        dump_matrix(compact_matrix(comb_scores, self.score_dtype), self.path_score + "{}".format(self.focal_year), self.matrix_format)
         
 
     def get_indicator(self):
         self.get_q_journal_list()
+        self.check_score()
         self.get_data()      
-        print('Getting the {} novelty score for combination of items in {} ...'.format(self.indicator, self.focal_year))  
-        self.compute_comb_score()
-        print("Matrice done !")  
+        if not self.score_fresh:
+            print('Getting the {} novelty score for combination of items in {} ...'.format(self.indicator, self.focal_year))  
+            self.compute_comb_score()
+            self.save_score_meta()
+            print("Matrice done !")  
         print('Attributing the {} novelty indicator for {}  papers ...'.format(self.indicator, self.focal_year))        
         self.update_paper_values()
         print("Done !")      
\ No newline at end of file
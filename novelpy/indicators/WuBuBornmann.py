@@ -1,7 +1,7 @@
-import pymongo
 import numpy as np 
 import pandas as pd
 from novelpy.utils.run_indicator_tools import create_output
+from novelpy.utils.backends import get_database, require_mongo
 import tqdm
 import os
 import glob
@@ -71,6 +71,8 @@ class Disruptiveness(create_output):
             self.variable = "citations"
         else:
             self.variable = variable
+        # The citations are looked up and the scores upserted one document at a time in MongoDB
+        require_mongo(client_name, "Disruptiveness")
 
         create_output.__init__(
             self,
@@ -115,10 +117,12 @@ class Disruptiveness(create_output):
 
         """
         if self.tomongo:
-            docs = self.collection.find({self.year_variable:self.focal_year}, no_cursor_timeout=True)
+            projection = {self.id_variable:1, self.variable:1, "_id":0}
             if self.list_ids:
-                self.papers_items = {doc[self.id_variable]: doc[self.variable] for doc in tqdm.tqdm(docs) if doc[self.id_variable] in self.list_ids}
+                docs = self.backend.read_by_ids(set(self.list_ids), {self.year_variable:self.focal_year}, projection)
+                self.papers_items = {doc[self.id_variable]: doc[self.variable] for doc in tqdm.tqdm(docs)}
             else:
+                docs = self.backend.read_year(self.focal_year, projection = projection, no_cursor_timeout=True)
                 self.papers_items = {doc[self.id_variable]:doc[self.variable] for doc in tqdm.tqdm(docs)}
         else:
             self.citation_network = pickle.load(open('Data/docs/{}.pkl'.format(self.collection_name),'rb'))
@@ -155,8 +159,7 @@ class Disruptiveness(create_output):
         """
   
         if self.tomongo:
-            client = pymongo.MongoClient(kwargs['client_name'])
-            db = client[kwargs['db_name']]
+            db = get_database(kwargs['client_name'], kwargs['db_name'])
             collection = db[kwargs['collection_name']]
             focal_paper_id = focal_paper_id
             
@@ -314,8 +317,7 @@ class Disruptiveness(create_output):
 
             """
 
-            client = pymongo.MongoClient(kwargs['client_name'])
-            db = client[kwargs['db_name']]
+            db = get_database(kwargs['client_name'], kwargs['db_name'])
             collection = db[kwargs['collection_name']]
             focal_paper_id = focal_paper_id
             
@@ -398,7 +400,6 @@ class Disruptiveness(create_output):
                     query = { id_variable: focal_paper_id}
                     newvalue =  { '$set': disruptiveness_indicators}
                     db[kwargs['collection2update']].update_one(query,newvalue,upsert = True)
-                    client.close()
                 except Exception as e:
                     print(e)
             else:
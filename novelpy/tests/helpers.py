@@ -0,0 +1,109 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import itertools
+import numpy as np
+from novelpy.utils.cooc_utils import create_cooc, load_matrix
+
+
+#%% Documents of the tests
+
+paper_1 = {"id": 1, "Ref_journals": [{"item": "1"},{"item": "2"}], "year": 1990}
+paper_2 = {"id": 1, "Ref_journals": [{"item": "1"},{"item": "2"},{"item": "3"}], "year": 1991}
+paper_3 = {"id": 1, "Ref_journals": [{"item": "2"}], "year": 1991}
+paper_4 = {"id": 1, "Ref_journals": [{"item": "4"},{"item": "3"}], "year": 1992}
+paper_5 = {"id": 1, "Ref_journals": [{"item": "1"},{"item": "2"},{"item": "3"},{"item": "2"}], "year": 1992}
+docs = [paper_1, paper_2, paper_3, paper_4, paper_5]
+paper_6 = {"id": 1, "Ref_journals": [{"item": "5"},{"item": "1"},{"item": "5"}], "year": 1993}
+
+# create_cooc parameters of the documents written by write_docs_by_year("cooc_test", ...)
+COOC_PARAMS = dict(var = "cooc_test",
+                   sub_var = "item",
+                   year_var = "year",
+                   collection_name = "cooc_test")
+
+
+def matrix_by_name(x, index2name):
+    x = x.tocoo()
+    return {tuple(sorted((index2name[i], index2name[j]))): v for i, j, v in zip(x.row, x.col, x.data) if v}
+
+def is_memory_mapped(array):
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return True
+        array = getattr(array, "base", None)
+    return False
+
+def write_docs_by_year(collection_name, docs):
+    path = "Data/docs/{}".format(collection_name)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    for year in set(doc["year"] for doc in docs):
+        json.dump([{"id": doc["id"], "year": doc["year"], "cooc_test": doc["Ref_journals"]}
+                   for doc in docs if doc["year"] == year],
+                  open(path + "/{}.json".format(year), "w"))
+
+def build_matrices(params, **options):
+    # Matrices built from scratch, {variant: {year: {pair of names: value}}}
+    if os.path.exists("Data/cooc"):
+        shutil.rmtree("Data/cooc")
+    instance = create_cooc(**params, **options)
+    instance.main()
+    matrices = {variant: {year: matrix_by_name(load_matrix(path + "/{}".format(year)), instance.index2name)
+                          for year in params["time_window"]}
+                for variant, path in instance.paths_output.items()}
+    return instance, matrices
+
+def paper_scores(indicator, items, comb_scores, name2index, restricted = None):
+    # Scores of a document computed one pair at a time
+    if indicator == "wang":
+        items = set(items)
+    pairs = [(i, j) for i, j in itertools.combinations(items, 2) if indicator != "wang" or i != j]
+    if indicator == "wang":
+        # No pair is scored without restricted items
+        pairs = [(i, j) for i, j in pairs if i in (restricted or []) and j in (restricted or [])]
+    scores = np.array([float(comb_scores[tuple(sorted((name2index[i], name2index[j])))]) for i, j in pairs])
+    if indicator == "wang":
+        score = {"novelty": sum(scores)}
+    elif indicator == "uzzi":
+        score = {"conventionality": np.median(scores), "novelty": np.quantile(scores, 0.1)}
+    elif indicator == "lee":
+        # Infinite when a pair was never used, as in create_output.get_batch_scores
+        with np.errstate(divide = "ignore"):
+            score = {"novelty": -np.log(np.quantile(scores, 0.1))}
+    elif indicator == "foster":
+        scores = 1 - scores
+        score = {"novelty": float(np.mean(scores))}
+    return {"scores_array": list(scores), "score": score}
+
+
+class TmpDirTest(unittest.TestCase):
+
+    def setUp(self):
+        # The classes write in Data/ and Result/ under the working directory
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def assert_same_matrices(self, params, options, expected = None, check = None):
+        # The matrices built from scratch with each options are the expected ones, those of the default options if None.
+        # check(instance) is called on the files of each build before the next one removes them
+        if expected is None:
+            expected = build_matrices(params)[1]
+        instances = []
+        for option in options:
+            with self.subTest(**option):
+                instance, matrices = build_matrices(params, **option)
+                for variant, by_year in matrices.items():
+                    self.assertDictEqual(by_year, expected[variant])
+                if check is not None:
+                    check(instance)
+                instances.append(instance)
+        return instances
@@ -0,0 +1,79 @@
+import novelpy
+from novelpy.utils.io_tools import ResultWriter
+from novelpy.utils.run_indicator_tools import Dataset
+from helpers import TmpDirTest
+
+
+class TestBackends(TmpDirTest):
+
+    def test_backends(self):
+        items = [{"item": str(i)} for i in range(6)]
+        backend_docs = [{"id": i, "year": 1990 + i % 3, "cooc_test": items[i % 4:i % 4 + 3], "title": "t"} for i in range(1200)]
+        source = novelpy.utils.get_backend(None, None, "backend_test", "id", "year")
+        source.bulk_write(backend_docs)
+        self.assertListEqual(source.get_years(), [1990, 1991, 1992])
+        target = novelpy.utils.get_backend("sqlite:///Data/backend_test.db", "test", "backend_test", "id", "year")
+        novelpy.utils.copy_docs(source, target, indexes = ["id", "year"])
+        self.assertEqual(sum(len(list(target.read_year(year))) for year in target.get_years()), 1200)
+        self.assertListEqual(target.get_years(), [1990, 1991, 1992])
+        self.assertListEqual(sorted(doc["id"] for doc in target.read_year(1991)),
+                             sorted(doc["id"] for doc in source.read_year(1991)))
+        # More ids than one IN query of SQLite
+        ids = set(range(0, 1200, 2))
+        query = {"year": 1990, "cooc_test": {"$exists": True}}
+        self.assertListEqual(sorted(doc["id"] for doc in target.read_by_ids(ids, query, {"id": 1, "_id": 0})),
+                             sorted(doc["id"] for doc in source.read_by_ids(ids, query, {"id": 1})))
+        self.assertListEqual(list(target.read_by_ids([5], projection = {"cooc_test.item": 1, "_id": 0})),
+                             [{"cooc_test": items[1:4]}])
+        target.bulk_write([{"id": 1200, "year": 1990, "cooc_test": None}])
+        self.assertEqual(len(list(target.read_year(1990, {"cooc_test": {"$exists": True}}))), 401)
+        self.assertEqual(len(list(target.read_year(1990, {"cooc_test": {"$ne": None}}))), 400)
+        self.assertEqual(len(list(target.read_year(1990, {"title": {"$exists": False}}))), 1)
+        # The ids and the years are read from their indexes
+        plan = target.connection.execute("EXPLAIN QUERY PLAN SELECT doc FROM {} WHERE doc_id IN (?, ?)".format(
+            target.quote(target.table)), [1, 2]).fetchall()
+        self.assertIn("INDEX", str(plan))
+        # Queries MongoDB would answer differently are not silently ignored
+        for backend in [source, target]:
+            for query in [{"id": {"$gt": 5}}, {"cooc_test.item": "1"}, {"title": "t"}]:
+                with self.assertRaises(NotImplementedError):
+                    list(backend.read_year(1990, query))
+            with self.assertRaises(NotImplementedError):
+                list(backend.read_year(1990, projection = {"title": 0}))
+        output = novelpy.utils.get_backend("sqlite:///Data/backend_test.db", "test", "output_test", "id", "year")
+        self.assertListEqual(output.get_years(), [])
+        with ResultWriter(backend = output, chunk_size = 2, verbose = False) as writer:
+            for i in range(3):
+                writer.write({"id": i, "year": 1991, "score": i})
+        self.assertListEqual(list(output.read_by_ids([2])), [{"id": 2, "year": 1991, "score": 2}])
+        # The error raised while writing is not hidden
+        with self.assertRaises(KeyError):
+            with ResultWriter(backend = output, verbose = False) as writer:
+                writer.write({"id": 3, "year": 1991})
+                raise KeyError("score")
+        # The indicators read the same documents from SQLite and from the JSON files
+        papers = []
+        for client_name in [None, "sqlite:///Data/backend_test.db"]:
+            dataset = Dataset(client_name = client_name, db_name = "test", collection_name = "backend_test",
+                              id_variable = "id", variable = "cooc_test", sub_variable = "item",
+                              year_variable = "year", focal_year = 1991)
+            dataset.indicator = "kscores"
+            dataset.get_item_paper()
+            papers.append(dataset.papers_items)
+        self.assertEqual(len(papers[0]), 400)
+        self.assertDictEqual(papers[0], papers[1])
+
+    def test_sqlite_requires_mongo(self):
+        client_name = "sqlite:///Data/mongo_only.db"
+        with self.assertRaisesRegex(ValueError, "not supported with the sqlite backend"):
+            novelpy.utils.get_database(client_name, "test")
+        with self.assertRaisesRegex(ValueError, "Author_proximity"):
+            novelpy.indicators.Author_proximity(client_name = client_name, db_name = "test", collection_name = "test",
+                                                id_variable = "id", year_variable = "year", focal_year = 1991)
+        with self.assertRaisesRegex(ValueError, "Embedding"):
+            novelpy.utils.Embedding(year_variable = "year", id_variable = "id", pretrain_path = None,
+                                    client_name = client_name, db_name = "test")
+        with self.assertRaisesRegex(ValueError, "Disruptiveness"):
+            novelpy.indicators.Disruptiveness(client_name = client_name, db_name = "test", collection_name = "test",
+                                              id_variable = "id", year_variable = "year", focal_year = 1991,
+                                              refs_list_variable = "refs", cits_list_variable = "cits")
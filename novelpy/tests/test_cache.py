@@ -0,0 +1,104 @@
+import os
+import time
+import novelpy
+import numpy as np
+from novelpy.utils.cooc_utils import *
+from novelpy.utils.cache import *
+from helpers import *
+
+
+class TestCache(TmpDirTest):
+
+    def test_artifact_cache(self):
+        write_docs_by_year("cache_test", docs + [paper_6])
+        params = dict(COOC_PARAMS, collection_name = "cache_test", time_window = range(1990,1994),
+                      weighted_network = True, self_loop = True)
+        instance = create_cooc(**params)
+        instance.main()
+        self.assertListEqual(instance.updated_years, [1990, 1991, 1992, 1993])
+        artifact = instance.path_output + "/1991"
+        key, signatures = get_artifact_key(artifact, dict(a = 1), ["Data/docs/cache_test/1991.json"])
+        self.assertNotEqual(key, get_artifact_key(artifact, dict(a = 2), ["Data/docs/cache_test/1991.json"])[0])
+        artifact, matrix_params, key, signatures = instance.get_matrix_key(1991, (True, True))
+        self.assertTrue(is_fresh(artifact, key))
+        # Every parameter changing the matrices changes their key
+        for changed in [dict(dtype = np.uint16), dict(dtype = "auto"), dict(rare_item = "rare"), dict(matrix_format = "npz")]:
+            other = create_cooc(**params, **changed)
+            other.name2index = instance.name2index
+            self.assertNotEqual(other.get_matrix_key(1991, (True, True))[2], key)
+        # Nothing changed, no matrix is built again
+        instance = create_cooc(**params)
+        instance.main()
+        self.assertListEqual(instance.updated_years, [])
+        # Touching a file does not change its key, changing its content does
+        time.sleep(0.01)
+        os.utime("Data/docs/cache_test/1990.json")
+        changed = [dict(doc, Ref_journals = doc["Ref_journals"][:1]) if doc is paper_2 else doc for doc in docs + [paper_6]]
+        write_docs_by_year("cache_test", changed)
+        instance = create_cooc(**params)
+        instance.main()
+        self.assertListEqual(instance.updated_years, [1991])
+        # A new item changes the vocabulary of every matrix
+        write_docs_by_year("cache_test", changed + [dict(paper_6, Ref_journals = [{"item": "0"}, {"item": "1"}])])
+        instance = create_cooc(**params)
+        instance.main()
+        self.assertListEqual(instance.updated_years, [1990, 1991, 1992, 1993])
+        # but not of the matrices built before in append mode
+        write_docs_by_year("cache_test", changed + [dict(paper_6, Ref_journals = [{"item": "6"}, {"item": "1"}])])
+        instance_append = create_cooc(**params, append = True)
+        self.assertListEqual(instance_append.get_years_to_update(), [1993])
+        instance_append.main()
+        self.assertListEqual(instance_append.get_years_to_update(), [])
+        # Matrices saved without meta file fall back on the modification time
+        os.remove(instance.path_output + "/1993.meta.json")
+        self.assertListEqual(instance_append.get_years_to_update(), [])
+        os.remove(instance.path_output + "/1991.meta.json")
+        self.assertListEqual(instance_append.get_years_to_update(), [1991])
+        # The documents of a database are signed by their number and their largest id, or by their items with full_signature
+        target = novelpy.utils.get_backend("sqlite:///Data/cache_test.db", "test", "cache_test", "id", "year")
+        target.bulk_write([{"id": i, "year": doc["year"], "cooc_test": doc["Ref_journals"]} for i, doc in enumerate(docs)])
+        params = dict(params, client_name = "sqlite:///Data/cache_test.db", db_name = "test", time_window = range(1990,1993))
+        create_cooc(**params).main()
+        instance = create_cooc(**params)
+        instance.main()
+        self.assertListEqual(instance.updated_years, [])
+        target.bulk_write([{"id": 10, "year": 1992, "cooc_test": [{"item": "1"}, {"item": "2"}]}])
+        instance = create_cooc(**params)
+        instance.main()
+        self.assertListEqual(instance.updated_years, [1992])
+        self.assertEqual(instance.signatures[1992]["test.cache_test/1992"]["count"], 3)
+        params["full_signature"] = True
+        instance = create_cooc(**params)
+        instance.main()
+        self.assertListEqual(instance.updated_years, [1990, 1991, 1992])
+        self.assertNotIn("count", instance.signatures[1992]["test.cache_test/1992"])
+        instance = create_cooc(**dict(params, n_jobs = 2))
+        instance.main()
+        self.assertListEqual(instance.updated_years, [])
+
+    def test_uzzi_sample_cache(self):
+        client_name = "sqlite:///Data/sample_test.db"
+        backend = novelpy.utils.get_backend(client_name, "test", "sample_test", "id", "year")
+        # Uzzi et al. (2013) needs the year of each item
+        backend.bulk_write([{"id": i, "year": doc["year"], "cooc_test": [dict(item, year = 1980) for item in doc["Ref_journals"]]}
+                            for i, doc in enumerate(docs)])
+        create_cooc(var = "cooc_test", sub_var = "item", year_var = "year", collection_name = "sample_test",
+                    client_name = client_name, db_name = "test", weighted_network = True, self_loop = True).main()
+        params = dict(client_name = client_name, db_name = "test", collection_name = "sample_test", id_variable = "id",
+                      year_variable = "year", variable = "cooc_test", sub_variable = "item", focal_year = 1991,
+                      nb_sample = 2, seed = 0)
+        uzzi = novelpy.indicators.Uzzi2013(**params)
+        uzzi.get_data()
+        uzzi.sample_network()
+        file = get_matrix_file(uzzi.path_sample + "sample_0_1991")
+        mtime = os.stat(file).st_mtime_ns
+        uzzi = novelpy.indicators.Uzzi2013(**params)
+        uzzi.get_data()
+        uzzi.sample_network()
+        self.assertEqual(os.stat(file).st_mtime_ns, mtime)
+        # The samples are drawn again once the documents of the year change in the database
+        backend.bulk_write([{"id": 10, "year": 1991, "cooc_test": [{"item": "1", "year": 1980}, {"item": "3", "year": 1980}]}])
+        uzzi = novelpy.indicators.Uzzi2013(**params)
+        uzzi.get_data()
+        uzzi.sample_network()
+        self.assertNotEqual(os.stat(file).st_mtime_ns, mtime)
@@ -0,0 +1,285 @@
+import os
+import time
+import json
+import shutil
+import pickle
+import itertools
+import numpy as np
+from scipy.sparse import csr_matrix
+from novelpy.utils.cooc_utils import *
+from helpers import *
+
+
+class TestCooc(TmpDirTest):
+
+    def test_populate_matrix_vectorized(self):
+        for weighted_network, self_loop in [(True, True), (False, False)]:
+            instance = create_cooc(var = "Ref_journals",
+                                   sub_var = "item",
+                                   year_var = "year",
+                                   collection_name = "no_need",
+                                   time_window = range(1990,1996),
+                                   weighted_network = weighted_network,
+                                   self_loop = self_loop,
+                                   dtype = np.uint16)
+            instance.item_list = ["1","2","3","4"]
+            instance.name2index = {"1":0,"2":1,"3":2,"4":3}
+            instance.create_matrix()
+            instance.get_combi(docs)
+            instance_vectorized = create_cooc(var = "Ref_journals",
+                                              sub_var = "item",
+                                              year_var = "year",
+                                              collection_name = "no_need",
+                                              time_window = range(1990,1996),
+                                              weighted_network = weighted_network,
+                                              self_loop = self_loop,
+                                              dtype = np.uint16,
+                                              vectorized = True,
+                                              batch_size = 2)
+            instance_vectorized.item_list = ["1","2","3","4"]
+            instance_vectorized.name2index = {"1":0,"2":1,"3":2,"4":3}
+            instance_vectorized.create_matrix()
+            instance_vectorized.get_combi(docs)
+            np.testing.assert_array_equal(instance_vectorized.x.toarray(),
+                                          instance.x.toarray())
+
+    def test_get_pairs(self):
+        seg, left, right = get_pairs([3, 1, 2])
+        self.assertListEqual(list(zip(seg, left, right)),
+                             [(0, 0, 1), (0, 0, 2), (0, 1, 2), (2, 4, 5)])
+
+    def test_build_options(self):
+        # The options changing how the documents are read and counted do not change the matrices
+        write_docs_by_year("cooc_test", docs + [paper_6])
+        for weighted_network, self_loop in [(True, True), (False, False)]:
+            params = dict(COOC_PARAMS, time_window = range(1990,1994), weighted_network = weighted_network, self_loop = self_loop)
+            self.assert_same_matrices(params, [dict(vectorized = True, batch_size = 2),
+                                               dict(n_jobs = 2),
+                                               dict(prefetch = 2)])
+
+    def test_single_pass(self):
+        write_docs_by_year("cooc_test", docs)
+        params = dict(COOC_PARAMS, time_window = range(1990,1993), weighted_network = True, self_loop = True)
+        instance, expected = build_matrices(params)
+        instance_single_pass, = self.assert_same_matrices(params, [dict(single_pass = True)], expected)
+        self.assertEqual(instance_single_pass.name2index, instance.name2index)
+
+    def test_append(self):
+        write_docs_by_year("cooc_test", docs + [paper_6])
+        params = dict(COOC_PARAMS, weighted_network = True, self_loop = True)
+        instance, expected = build_matrices(dict(params, time_window = range(1990,1994)))
+        shutil.rmtree(instance.path_output)
+        create_cooc(**params, time_window = range(1990,1992)).main()
+        instance_append = create_cooc(**params, time_window = range(1990,1994), append = True)
+        self.assertListEqual(instance_append.get_years_to_update(), [1992, 1993])
+        instance_append.main()
+        self.assertEqual(len(instance_append.name2index), 5)
+        shape = (5, 5)
+        for year in range(1990,1994):
+            x = load_matrix(instance.path_output + "/{}.p".format(year), shape)
+            self.assertEqual(x.shape, shape)
+            self.assertDictEqual(matrix_by_name(x, instance_append.index2name), expected[(True, True)][year])
+
+    def test_matrix_format(self):
+        write_docs_by_year("cooc_test", docs)
+        params = dict(COOC_PARAMS, time_window = range(1990,1993), weighted_network = True, self_loop = True)
+        instance, expected = build_matrices(params)
+        expected = expected[(True, True)]
+        # Written over the pickle files
+        create_cooc(**params, matrix_format = "npz").main()
+        for year in range(1990,1993):
+            self.assertEqual(get_matrix_file(instance.path_output + "/{}".format(year)),
+                             instance.path_output + "/{}.npz".format(year))
+            x = load_matrix(instance.path_output + "/{}.p".format(year))
+            self.assertTrue(is_memory_mapped(x.data))
+            self.assertTrue(is_memory_mapped(x.indices))
+            self.assertDictEqual(matrix_by_name(x, instance.index2name), expected[year])
+        x = load_matrix(instance.path_output + "/1992", (6, 6))
+        self.assertEqual(x.shape, (6, 6))
+        self.assertDictEqual(matrix_by_name(x, instance.index2name), expected[1992])
+
+    def test_cumulative(self):
+        write_docs_by_year("cooc_test", docs + [paper_6])
+        params = dict(COOC_PARAMS, weighted_network = True, self_loop = True)
+        instance = create_cooc(**params, time_window = range(1990,1993), cumulative = True)
+        instance.main()
+        create_cooc(**params, time_window = range(1990,1994), append = True, cumulative = True).main()
+        path = instance.path_output
+        shape = (5, 5)
+        for window in [range(1990,1994), range(1991,1993), range(1993,1994)]:
+            expected = sum(load_matrix(path + "/{}".format(year), shape).toarray() for year in window)
+            np.testing.assert_array_equal(load_window_sum(path, window, shape).toarray(), expected)
+        self.assertIsNone(load_window_sum(path, range(1992,1995), shape))
+        # A yearly matrix rebuilt without the cumulative option makes the cumulative matrices stale
+        time.sleep(0.01)
+        instance.x = load_matrix(path + "/1991")
+        instance.save_matrix(1991)
+        self.assertIsNone(load_window_sum(path, range(1991,1993), shape))
+
+    def test_variants(self):
+        write_docs_by_year("cooc_test", docs)
+        params = dict(COOC_PARAMS, time_window = range(1990,1993))
+        expected = dict()
+        for weighted_network, self_loop in itertools.product([True, False], repeat = 2):
+            expected.update(build_matrices(dict(params, weighted_network = weighted_network, self_loop = self_loop))[1])
+        def check(instance):
+            for path_output in instance.paths_output.values():
+                self.assertEqual(pickle.load(open(path_output + "/name2index.p", "rb")), instance.name2index)
+        instances = self.assert_same_matrices(dict(params, batch_size = 2),
+                                              [dict(variants = variants, single_pass = single_pass)
+                                               for variants in ["all", [(False, False), (True, True)]]
+                                               for single_pass in [False, True]],
+                                              expected, check)
+        self.assertListEqual([len(instance.paths_output) for instance in instances], [4, 4, 2, 2])
+
+    def test_auto_dtype(self):
+        write_docs_by_year("cooc_test", docs)
+        params = dict(COOC_PARAMS, time_window = range(1990,1993), weighted_network = True, self_loop = True)
+        def check(instance):
+            for year in range(1990,1993):
+                x = load_matrix(instance.path_output + "/{}".format(year))
+                self.assertEqual(x.dtype, np.uint8)
+                self.assertEqual(x.indices.dtype, np.int32)
+                self.assertEqual(x.indptr.dtype, np.int32)
+        self.assert_same_matrices(params, [dict(dtype = "auto", vectorized = vectorized) for vectorized in [False, True]],
+                                  check = check)
+
+    def test_compact_matrix(self):
+        x = csr_matrix(np.array([[0, 300], [70000, 0]], dtype = np.int64))
+        self.assertEqual(compact_matrix(x).dtype, np.uint32)
+        self.assertEqual(compact_matrix(-x).dtype, np.int32)
+        scores = csr_matrix(np.array([[0, 0.5], [0, 0]]))
+        self.assertEqual(compact_matrix(scores).dtype, np.float64)
+        self.assertEqual(compact_matrix(scores, np.float32).dtype, np.float32)
+        # The sum of two uint8 matrices is promoted instead of wrapping around
+        x = csr_matrix(np.array([[0, 200], [0, 0]], dtype = np.uint8))
+        total = add_matrices(x, x)
+        self.assertEqual(total.dtype, np.uint16)
+        self.assertEqual(total[0, 1], 400)
+        self.assertEqual(add_matrices(x, csr_matrix(np.eye(2, dtype = np.uint8))).dtype, np.uint8)
+
+    def test_item_stats(self):
+        instance = create_cooc(var = "Ref_journals",
+                               sub_var = "item",
+                               year_var = "year",
+                               collection_name = "no_need",
+                               time_window = range(1990,1996),
+                               item_stats = True)
+        instance.get_item_list(docs + [paper_6])
+        self.assertEqual(instance.item_list, ["1","2","3","4","5"])
+        self.assertDictEqual(instance.item_count, {"1": 4, "2": 5, "3": 3, "4": 1, "5": 2})
+        self.assertDictEqual(instance.item_first_year, {"1": 1990, "2": 1990, "3": 1991, "4": 1992, "5": 1993})
+        pipeline = instance.get_item_pipeline()
+        self.assertEqual(pipeline[1]["$project"]["items"], "$Ref_journals.item")
+        self.assertEqual(pipeline[-1]["$group"]["first_year"], {"$min": "$year"})
+
+    def test_pruning(self):
+        write_docs_by_year("cooc_test", docs + [paper_6])
+        params = dict(COOC_PARAMS, time_window = range(1990,1994), weighted_network = True, self_loop = True)
+        # Occurrences: "1": 4, "2": 5, "3": 3, "4": 1, "5": 2
+        instance = create_cooc(**params, min_count = 2)
+        instance.main()
+        self.assertEqual(instance.item_list, ["1","2","3","5"])
+        stats = json.load(open(instance.path_output + "/pruning.json"))
+        self.assertEqual((stats["n_dropped"], stats["n_occurrences_dropped"]), (1, 1))
+        self.assertDictEqual(matrix_by_name(load_matrix(instance.path_output + "/1992"), instance.index2name),
+                             {("1","2"): 2, ("1","3"): 1, ("2","3"): 2, ("2","2"): 1})
+        instance = create_cooc(**params, max_vocab = 2, rare_item = "rare")
+        instance.main()
+        self.assertEqual(instance.item_list, ["1","2","rare"])
+        self.assertDictEqual(matrix_by_name(load_matrix(instance.path_output + "/1993"), instance.index2name),
+                             {("1","rare"): 2, ("rare","rare"): 1})
+        for vectorized in [False, True]:
+            instance = create_cooc(**params, max_vocab = 2, rare_item = "rare", vectorized = vectorized)
+            instance.item_list = ["1","2","rare"]
+            instance.name2index = {"1": 0, "2": 1, "rare": 2}
+            instance.create_matrix()
+            instance.get_combi([{"cooc_test": paper_6["Ref_journals"]}])
+            self.assertDictEqual(matrix_by_name(instance.x, {0: "1", 1: "2", 2: "rare"}),
+                                 {("1","rare"): 2, ("rare","rare"): 1})
+        create_cooc(**params).main()
+        self.assertFalse(os.path.exists(instance.path_output + "/pruning.json"))
+        with self.assertRaises(ValueError):
+            create_cooc(**params, min_count = 2, single_pass = True)
+
+    def test_block_size(self):
+        write_docs_by_year("cooc_test", docs + [paper_6])
+        params = dict(COOC_PARAMS, time_window = range(1990,1994))
+        expected = dict()
+        for weighted_network, self_loop in itertools.product([True, False], repeat = 2):
+            expected.update(build_matrices(dict(params, weighted_network = weighted_network, self_loop = self_loop))[1])
+        def check(instance):
+            for path_output in instance.paths_output.values():
+                self.assertListEqual([file for file in os.listdir(path_output) if file.startswith("spill_")], [])
+                for year in range(1990,1994):
+                    x = load_matrix(path_output + "/{}".format(year))
+                    self.assertTrue(is_memory_mapped(x.data))
+                    self.assertEqual(x.dtype, np.uint8 if instance.auto_dtype else np.uint32)
+                    block = load_matrix_block(path_output + "/{}".format(year), 2, 4)
+                    np.testing.assert_array_equal(block.toarray(), x.toarray()[2:4])
+                    block = load_matrix_block(path_output + "/{}".format(year), 4, 6, (6, 6))
+                    self.assertEqual(block.shape, (2, 6))
+        self.assert_same_matrices(dict(params, variants = "all", block_size = 2, batch_size = 1),
+                                  [dict(dtype = dtype) for dtype in [np.uint32, "auto"]], expected, check)
+
+    def test_block_size_single_pass(self):
+        # Items first seen in reverse order so that the remapping moves rows across blocks
+        paper_0 = {"id": 1, "Ref_journals": [{"item": "5"},{"item": "4"},{"item": "3"},{"item": "3"}], "year": 1989}
+        write_docs_by_year("cooc_test", [paper_0] + docs + [paper_6])
+        params = dict(COOC_PARAMS, time_window = range(1989,1994), single_pass = True, variants = "all")
+        def check(instance):
+            self.assertListEqual(instance.item_list, ["1", "2", "3", "4", "5"])
+            for path_output in instance.paths_output.values():
+                self.assertListEqual([file for file in os.listdir(path_output) if file.startswith("spill_")], [])
+                for year in range(1989,1994):
+                    self.assertTrue(is_memory_mapped(load_matrix(path_output + "/{}".format(year)).data))
+        self.assert_same_matrices(params, [dict(block_size = 2, batch_size = 1)], check = check)
+
+    def test_first_year(self):
+        # Items used alone: 4 in 1990 before being combined in 1992, 6 never combined
+        alone = [{"id": 7, "Ref_journals": [{"item": "4"}], "year": 1990},
+                 {"id": 8, "Ref_journals": [{"item": "6"}], "year": 1991}]
+        write_docs_by_year("cooc_test", docs + [paper_6] + alone)
+        params = dict(COOC_PARAMS, time_window = range(1990,1994), weighted_network = False, self_loop = False)
+        expected_pairs = {("1","2"): 1990, ("1","3"): 1991, ("2","3"): 1991, ("3","4"): 1992, ("1","5"): 1993}
+        for options in [dict(), dict(vectorized = True), dict(n_jobs = 2), dict(block_size = 2), dict(single_pass = True),
+                        dict(incidence = True, id_var = "id")]:
+            with self.subTest(**options):
+                instance = build_matrices(params, **options, first_year = True)[0]
+                path = instance.path_output
+                first = load_first_year(path)
+                self.assertDictEqual(matrix_by_name(first, instance.index2name), expected_pairs)
+                np.testing.assert_array_equal(np.load(path + "/first_year_items.npy"), [1990, 1990, 1991, 1990, 1993, 1991])
+        shape = (6, 6)
+        past = sum(load_matrix(path + "/{}".format(year), shape) for year in range(1990,1992))
+        np.testing.assert_array_equal(load_past_pairs(path, 1992).toarray(), past.toarray() != 0)
+        # Only the new year is read, the first years of the others come from the previous ones
+        build_matrices(dict(params, time_window = range(1990,1993)), first_year = True)
+        instance = create_cooc(**params, first_year = True)
+        instance.main()
+        self.assertListEqual(instance.updated_years, [1993])
+        self.assertEqual(instance.first_years, {1993})
+        self.assertDictEqual(matrix_by_name(load_first_year(path), instance.index2name), expected_pairs)
+        # A year built again: the first years of its pairs and items are the new ones
+        write_docs_by_year("cooc_test", docs + [paper_6] + alone[1:])
+        instance = create_cooc(**params, first_year = True)
+        instance.main()
+        self.assertListEqual(instance.updated_years, [1990])
+        self.assertDictEqual(matrix_by_name(load_first_year(path), instance.index2name), expected_pairs)
+        np.testing.assert_array_equal(np.load(path + "/first_year_items.npy"), [1990, 1990, 1991, 1992, 1993, 1991])
+        # A yearly matrix rebuilt without first_year makes the first years stale
+        time.sleep(0.01)
+        instance.x = load_matrix(path + "/1991")
+        instance.save_matrix(1991)
+        self.assertIsNone(load_past_pairs(path, 1992))
+
+    def test_incidence(self):
+        write_docs_by_year("cooc_test", docs + [paper_6])
+        params = dict(COOC_PARAMS, time_window = range(1990,1994), variants = "all")
+        instance, = self.assert_same_matrices(params, [dict(incidence = True, id_var = "id")])
+        X, ids = load_incidence(instance.path_output, 1992)
+        np.testing.assert_array_equal(X.toarray(), [[0, 0, 1, 1, 0],
+                                                    [1, 2, 1, 0, 0]])
+        np.testing.assert_array_equal(ids, [1, 1])
+        with self.assertRaises(ValueError):
+            create_cooc(**params, incidence = True)
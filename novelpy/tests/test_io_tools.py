@@ -0,0 +1,171 @@
+import os
+import time
+import json
+import unittest
+import novelpy
+from novelpy.utils.io_tools import *
+from helpers import *
+
+
+class TestIoTools(TmpDirTest):
+
+    def test_iter_docs(self):
+        write_docs_by_year("cooc_test", docs)
+        tricky = [{"id": 12345, "title": "a [b], {c}", "score": -1.5e-3, "refs": [[], {}, None, True]},
+                  {"id": 678901234567, "title": "\"quoted\" \\ ] ,"}]
+        path = "Data/docs/cooc_test/"
+        with open(path + "1995.json", "w") as f:
+            f.write(" [\n" + ",\n ".join(json.dumps(doc) for doc in tricky) + " ]\n")
+        json.dump([], open(path + "1996.json", "w"))
+        self.assertListEqual(get_doc_years(path), [1990, 1991, 1992, 1995, 1996])
+        for chunk_size in [1, 3, 2**20]:
+            self.assertListEqual(list(iter_docs(path + "1995", chunk_size = chunk_size)), tricky)
+            self.assertListEqual(list(iter_docs(path + "1996", chunk_size = chunk_size)), [])
+        with self.assertRaises(FileNotFoundError):
+            iter_docs(path + "1997")
+        params = dict(COOC_PARAMS, time_window = range(1990,1993), weighted_network = True, self_loop = True)
+        expected = build_matrices(params)[1]
+        convert_to_jsonl(path, remove_json = True)
+        self.assertEqual(get_doc_file(path + "1995"), path + "1995.jsonl")
+        self.assertListEqual(list(iter_docs(path + "1995")), tricky)
+        self.assertListEqual(get_doc_years(path), [1990, 1991, 1992, 1995, 1996])
+        # The matrices built from the JSON Lines files are the same
+        self.assert_same_matrices(params, [dict()], expected)
+
+    def test_prefetch(self):
+        for buffer_size in [0, 1, 3]:
+            self.assertListEqual(list(prefetch(range(5), lambda key: key**2, buffer_size)),
+                                 [(key, key**2) for key in range(5)])
+        def load(key):
+            if key == 2:
+                raise KeyError(key)
+            return key
+        loaded = []
+        with self.assertRaises(KeyError):
+            for key, value in prefetch(range(5), load):
+                loaded.append(value)
+        self.assertListEqual(loaded, [0, 1])
+        # Leaving early stops the thread
+        for key, value in prefetch(range(100), lambda key: key):
+            break
+
+    def test_find_by_ids(self):
+        class Cursor(list):
+            def batch_size(self, batch_size):
+                return self
+        class Collection:
+            def __init__(self, docs):
+                self.docs = docs
+                self.queries = []
+            def find(self, query, projection = None):
+                self.queries.append(query)
+                return Cursor({key: doc[key] for key in projection or doc}
+                              for doc in self.docs
+                              if doc["id"] in query["id"]["$in"] and doc["year"] == query.get("year", doc["year"]))
+        collection = Collection([{"id": i, "year": 1990 + i % 2, "title": "title"} for i in range(10)])
+        found = list(find_by_ids(collection, "id", [1, 2, 3, 5, 8], {"year": 1991}, {"id": 1}, chunk_size = 2))
+        self.assertListEqual(found, [{"id": 1}, {"id": 3}, {"id": 5}])
+        self.assertEqual(len(collection.queries), 3)
+        self.assertDictEqual(collection.queries[0], {"year": 1991, "id": {"$in": [1, 2]}})
+
+    def test_result_writer(self):
+        class Collection:
+            def __init__(self):
+                self.requests = []
+                self.ordered = []
+            def bulk_write(self, requests, ordered = True):
+                self.ordered.append(ordered)
+                self.requests.append(requests)
+        collection = Collection()
+        docs = [{"id": i, "score": i / 2} for i in range(25)]
+        with ResultWriter(collection = collection, chunk_size = 10, verbose = False) as writer:
+            for doc in docs:
+                writer.write(doc)
+        self.assertListEqual([len(requests) for requests in collection.requests], [10, 10, 5])
+        self.assertFalse(any(collection.ordered))
+        self.assertListEqual([stats["n_docs"] for stats in writer.stats], [10, 10, 5])
+        os.makedirs("Result/writer_test")
+        file = "Result/writer_test/1990.jsonl"
+        with ResultWriter(file = file, chunk_size = 10, verbose = False) as writer:
+            for doc in docs[:15]:
+                writer.write(doc)
+            # Nothing is moved to the final file before close
+            self.assertFalse(os.path.exists(file))
+            self.assertEqual(len(list(iter_jsonl(file + ".tmp"))), 10)
+        self.assertListEqual(list(iter_docs(file)), docs[:15])
+        # An interrupted write leaves the previous file
+        with self.assertRaises(KeyError):
+            with ResultWriter(file = file, chunk_size = 10, verbose = False) as writer:
+                writer.write(docs[0])
+                raise KeyError
+        self.assertListEqual(list(iter_docs(file)), docs[:15])
+        self.assertFalse(os.path.exists(file + ".tmp"))
+        # A .json file holds a JSON array
+        file = "Result/writer_test/1990.json"
+        with ResultWriter(file = file, chunk_size = 10, verbose = False) as writer:
+            for doc in docs:
+                writer.write(doc)
+        self.assertListEqual(json.load(open(file, "r")), docs)
+        with ResultWriter(file = file, verbose = False) as writer:
+            pass
+        self.assertListEqual(json.load(open(file, "r")), [])
+
+    def test_read_results(self):
+        docs = [{"id": i, "v_lee": {"scores_array": [i, i / 2], "score": {"novelty": i / 4}}, "year": 1990} for i in range(5)]
+        self.assertDictEqual(flatten_doc(docs[1]), {"id": 1, "v_lee.scores_array": [1, 0.5], "v_lee.score.novelty": 0.25, "year": 1990})
+        os.makedirs("Result/writer_test")
+        with ResultWriter(file = "Result/writer_test/1991.jsonl", chunk_size = 2, verbose = False) as writer:
+            for doc in docs:
+                writer.write(doc)
+        df = read_results("Result/writer_test/1991", ["v_lee.score.novelty", "v_lee.score.conventionality"])
+        self.assertListEqual(list(df.columns), ["v_lee.score.novelty", "v_lee.score.conventionality"])
+        self.assertListEqual(df["v_lee.score.novelty"].tolist(), [0, 0.25, 0.5, 0.75, 1])
+        self.assertTrue(df["v_lee.score.conventionality"].isna().all())
+        df = read_results("Result/writer_test/1991", ["v_lee.scores_array"], filters = [("id", "==", 3)])
+        self.assertListEqual(list(df["v_lee.scores_array"].iloc[0]), [3, 1.5])
+        # Results written again in another format are read instead of the previous ones, which are kept
+        time.sleep(0.01)
+        with ResultWriter(file = "Result/writer_test/1991.json", verbose = False) as writer:
+            writer.write(docs[0])
+        self.assertEqual(get_result_file("Result/writer_test/1991"), "Result/writer_test/1991.json")
+        self.assertEqual(len(read_results("Result/writer_test/1991")), 1)
+        self.assertTrue(os.path.exists("Result/writer_test/1991.jsonl"))
+
+    @unittest.skipIf(novelpy.utils.io_tools.pa is None, "pyarrow is not installed")
+    def test_parquet_results(self):
+        docs = [{"id": i, "v_uzzi": {"scores_array": [i / 2] * i, "score": {"novelty": i / 4, "conventionality": -i}}, "year": 1990}
+                for i in range(25)]
+        os.makedirs("Result/writer_test")
+        with ResultWriter(file = "Result/writer_test/1992.parquet", chunk_size = 10, verbose = False) as writer:
+            for doc in docs:
+                writer.write(doc)
+        df = read_results("Result/writer_test/1992")
+        self.assertEqual(len(df), 25)
+        self.assertEqual(str(df["v_uzzi.score.novelty"].dtype), "float64")
+        df = read_results("Result/writer_test/1992", ["v_uzzi.score.novelty", "v_uzzi.scores_array"], filters = [("id", "==", 4)])
+        self.assertListEqual(list(df.columns), ["v_uzzi.score.novelty", "v_uzzi.scores_array"])
+        self.assertEqual(df["v_uzzi.score.novelty"].iloc[0], 1)
+        self.assertListEqual(list(df["v_uzzi.scores_array"].iloc[0]), [2, 2, 2, 2])
+        # Fields first seen in a later chunk, null then float, int then float and empty then filled lists
+        docs = [{"id": i, "v_lee": {"score": {"novelty": None if i < 10 else i / 2}, "scores_array": [] if i < 10 else [i / 2],
+                                    "n_pairs": i if i < 20 else i + 0.5}} for i in range(25)]
+        docs[24]["v_lee"]["score"]["conventionality"] = 1.5
+        with ResultWriter(file = "Result/writer_test/1993.parquet", chunk_size = 10, verbose = False) as writer:
+            for doc in docs:
+                writer.write(doc)
+        self.assertFalse(os.path.exists("Result/writer_test/1993.parquet.tmp.old"))
+        df = read_results("Result/writer_test/1993")
+        self.assertEqual(len(df), 25)
+        self.assertEqual(pq.ParquetFile("Result/writer_test/1993.parquet").num_row_groups, 3)
+        self.assertEqual(str(df["v_lee.score.novelty"].dtype), "float64")
+        self.assertTrue(df["v_lee.score.novelty"].iloc[:10].isna().all())
+        self.assertListEqual(df["v_lee.score.novelty"].iloc[10:].tolist(), [i / 2 for i in range(10, 25)])
+        self.assertListEqual(df["v_lee.n_pairs"].tolist(), [i if i < 20 else i + 0.5 for i in range(25)])
+        self.assertListEqual(list(df["v_lee.scores_array"].iloc[12]), [6])
+        self.assertEqual(df["v_lee.score.conventionality"].iloc[24], 1.5)
+        self.assertTrue(df["v_lee.score.conventionality"].iloc[:24].isna().all())
+        with self.assertRaises(TypeError):
+            with ResultWriter(file = "Result/writer_test/1994.parquet", chunk_size = 1, verbose = False) as writer:
+                writer.write({"id": 1})
+                writer.write({"id": "a"})
+        self.assertListEqual(sorted(os.listdir("Result/writer_test")), ["1992.parquet", "1993.parquet"])
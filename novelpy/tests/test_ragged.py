@@ -0,0 +1,54 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from novelpy.utils.ragged import *
+from helpers import TmpDirTest
+
+
+class TestRagged(TmpDirTest):
+
+    def test_ragged_items(self):
+        papers = [{"id": 5, "refs": [{"item": "A", "year": 3}, {"item": "C", "year": 1}, {"item": "E", "year": 1}]},
+                  {"id": 6, "refs": []},
+                  {"id": 7, "refs": [{"item": "B", "year": 0}, {"item": "C"}, {"item": "B", "year": 0}]}]
+        name2index = {"A": 0, "B": 1, "C": 2, "D": 3}
+        index2name = {index: name for name, index in name2index.items()}
+        with self.assertRaises(KeyError):
+            RaggedItems.from_docs(papers, "id", "refs", "item", name2index)
+        # E was pruned from the vocabulary without rare item
+        map_item = lambda item: item if item in name2index else None
+        ragged = RaggedItems.from_docs(papers, "id", "refs", "item", name2index, map_item = map_item)
+        np.testing.assert_array_equal(ragged.ids, [5, 6, 7])
+        np.testing.assert_array_equal(ragged.offsets, [0, 2, 2, 5])
+        self.assertEqual(ragged.indices.dtype, np.int32)
+        self.assertDictEqual(ragged.to_dict(index2name), {5: ["A", "C"], 6: [], 7: ["B", "C", "B"]})
+        ragged = RaggedItems.from_docs(papers, "id", "refs", "item", name2index, map_item = map_item,
+                                       with_years = True, list_ids = {5, 7})
+        self.assertDictEqual(ragged.to_dict(index2name), {5: [{"item": "A", "year": 3}, {"item": "C", "year": 1}],
+                                                          7: [{"item": "B", "year": 0}, {"item": "B", "year": 0}]})
+        self.assertDictEqual(ragged.subset(np.array([False, True])).to_dict(index2name),
+                             {7: [{"item": "B", "year": 0}, {"item": "B", "year": 0}]})
+        X = csr_matrix(np.array([[1, 0, 1, 0], [0, 0, 0, 0], [0, 2, 1, 0]]))
+        ragged = RaggedItems.from_incidence(X, np.array([5, 6, 7]))
+        self.assertDictEqual(ragged.to_dict(index2name), {5: ["A", "C"], 6: [], 7: ["B", "B", "C"]})
+
+    def test_save(self):
+        ragged = RaggedItems(np.array([1, 2]), np.array([0, 2, 3]), np.array([0, 1, 1], dtype = np.int32),
+                             np.array([1990, 1991, 1991], dtype = np.int32))
+        ragged.save("ragged.npz")
+        loaded = RaggedItems.load("ragged.npz")
+        for name in ["ids", "offsets", "indices", "years"]:
+            np.testing.assert_array_equal(getattr(loaded, name), getattr(ragged, name))
+
+    def test_segment_statistics(self):
+        rng = np.random.default_rng(0)
+        lengths = rng.integers(0, 6, 40)
+        seg = np.repeat(np.arange(len(lengths)), lengths)
+        values = rng.random(len(seg))
+        values[seg == 3] = np.nan
+        for q in [0, 0.1, 0.5, 1]:
+            found = segment_quantile(values, seg, len(lengths), q)
+            expected = [np.quantile(values[seg == i], q) if lengths[i] else np.nan for i in range(len(lengths))]
+            np.testing.assert_array_equal(found, expected)
+        found = segment_median(values, seg, len(lengths))
+        expected = [np.median(values[seg == i]) if lengths[i] else np.nan for i in range(len(lengths))]
+        np.testing.assert_array_equal(found, expected)
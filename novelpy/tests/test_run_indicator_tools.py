@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import novelpy
+import numpy as np
+from scipy.sparse import csr_matrix, triu
+from novelpy.utils.cooc_utils import *
+from novelpy.utils.io_tools import iter_docs
+from novelpy.utils.run_indicator_tools import Dataset, create_output, WindowCache
+from helpers import *
+
+
+# Indicator classes and their own parameters
+INDICATORS = {"lee": (novelpy.indicators.Lee2015, dict()),
+              "foster": (novelpy.indicators.Foster2015, dict()),
+              "wang": (novelpy.indicators.Wang2017, dict(time_window_cooc = 2, n_reutilisation = 1)),
+              "uzzi": (novelpy.indicators.Uzzi2013, dict(nb_sample = 3, seed = 0))}
+
+def write_random_docs(collection_name, years, n_docs = 30, n_items = 15, seed = 0):
+    # Documents using 1 to 7 items, each one with the year of the cited document for Uzzi et al. (2013)
+    rng = np.random.default_rng(seed)
+    path = "Data/docs/{}".format(collection_name)
+    os.makedirs(path)
+    id_ = 0
+    for year in years:
+        year_docs = []
+        for _ in range(n_docs):
+            items = rng.integers(0, n_items, rng.integers(1, 8))
+            year_docs.append({"id": id_, "year": year,
+                              "refs": [{"item": str(item), "year": int(rng.integers(1980, 1990))} for item in items]})
+            id_ += 1
+        json.dump(year_docs, open(path + "/{}.json".format(year), "w"))
+
+
+class TestRunIndicatorTools(TmpDirTest):
+
+    def test_batch_scores(self):
+        rng = np.random.default_rng(0)
+        n_items = 30
+        name2index = {str(i): i for i in range(n_items)}
+        comb_scores = triu(csr_matrix(rng.random((n_items, n_items)) * (rng.random((n_items, n_items)) > 0.3)), format = "csr")
+        papers_items = {idx: [str(i) for i in rng.integers(0, n_items, rng.integers(3, 12))] for idx in range(50)}
+        for indicator in ["lee", "foster", "uzzi", "wang"]:
+            output = create_output(variable = "v", density = True, time_window_cooc = 3 if indicator == "wang" else None)
+            output.indicator = indicator
+            output.name2index = name2index
+            output.comb_scores = comb_scores
+            output.list_of_items_restricted = [str(i) for i in range(20)] if indicator == "wang" else None
+            output.papers_items = {idx: [{"item": item} for item in items] for idx, items in papers_items.items()} if indicator == "uzzi" else papers_items
+            expected = [paper_scores(indicator, items, comb_scores, name2index, output.list_of_items_restricted)
+                        for items in papers_items.values()]
+            output.batch_pairs = 40
+            papers = output.papers_to_ragged()
+            found = []
+            for start in range(0, len(papers), 7):
+                found += output.get_batch_scores(papers.slice(start, min(start + 7, len(papers))))
+            for doc_expected, doc_found in zip(expected, found):
+                for name, value in doc_expected["score"].items():
+                    self.assertAlmostEqual(value, doc_found["score"][name], places = 12)
+                if indicator == "wang":
+                    self.assertListEqual(sorted(doc_expected["scores_array"]), sorted(doc_found["scores_array"]))
+                else:
+                    np.testing.assert_allclose(doc_expected["scores_array"], doc_found["scores_array"])
+        # Wang et al. (2017) scores no pair when no item is restricted
+        output = create_output(variable = "v", density = True, time_window_cooc = 3)
+        output.indicator = "wang"
+        output.name2index = name2index
+        output.comb_scores = comb_scores
+        output.list_of_items_restricted = []
+        output.papers_items = papers_items
+        output.batch_pairs = 40
+        found = output.get_batch_scores(output.papers_to_ragged())
+        self.assertListEqual(found, [{"scores_array": [], "score": {"novelty": 0.0}}] * len(papers_items))
+
+    def test_n_jobs_scores(self):
+        rng = np.random.default_rng(1)
+        n_items = 30
+        name2index = {str(i): i for i in range(n_items)}
+        comb_scores = triu(csr_matrix(rng.random((n_items, n_items)) * (rng.random((n_items, n_items)) > 0.3)), format = "csr")
+        papers_items = {idx: [str(i) for i in rng.integers(0, n_items, rng.integers(3, 12))] for idx in range(50)}
+        os.makedirs("Data/score_test")
+        dump_matrix(comb_scores, "Data/score_test/comb_scores", "npz")
+        for indicator, file in [("lee", None), ("wang", None), ("uzzi", "Data/score_test/comb_scores.npz")]:
+            output = create_output(variable = "v", density = True, n_jobs = 2)
+            output.indicator = indicator
+            output.name2index = name2index
+            output.comb_scores = comb_scores
+            output.comb_scores_file = file
+            output.list_of_items_restricted = [str(i) for i in range(20)] if indicator == "wang" else None
+            output.papers_items = {idx: [{"item": item} for item in items] for idx, items in papers_items.items()} if indicator == "uzzi" else papers_items
+            papers = output.papers_to_ragged()
+            batches = [papers.slice(start, min(start + 7, len(papers))) for start in range(0, len(papers), 7)]
+            expected = [output.get_batch_scores(batch) for batch in batches]
+            self.assertListEqual(list(output.iter_batch_scores(batches)), expected)
+
+    def test_window_cache(self):
+        write_docs_by_year("cooc_test", docs + [paper_6])
+        instance = create_cooc(var = "cooc_test",
+                               sub_var = "item",
+                               year_var = "year",
+                               collection_name = "cooc_test",
+                               time_window = range(1990,1994),
+                               weighted_network = True,
+                               self_loop = True)
+        instance.main()
+        path = instance.path_output
+        shape = (5, 5)
+        loaded = []
+        def load_sum(years, shape):
+            loaded.extend(years)
+            return sum(load_matrix(path + "/{}".format(year), shape) for year in years).tocsr()
+        window_cache = WindowCache()
+        self.assertIs(window_cache.get_name2index(path), window_cache.get_name2index(path))
+        for years in [[1990, 1991, 1992], [1991, 1992, 1993], [1991, 1992], [1993], [1990, 1991, 1992]]:
+            expected = sum(load_matrix(path + "/{}".format(year), shape) for year in years).toarray()
+            cooc = window_cache.get_sum(path, years, shape, load_sum)
+            np.testing.assert_array_equal(cooc.toarray(), expected)
+            self.assertEqual(cooc.nnz, np.count_nonzero(expected))
+            # The cached sum is not modified by the caller
+            cooc.data[:] = 0
+        # 1993 in and 1990 out, 1990 out, 1993 read again as it is cheaper than updating, the first sum is cached
+        self.assertListEqual(loaded, [1990, 1991, 1992, 1993, 1990, 1990, 1993])
+
+    def test_item_counts(self):
+        write_docs_by_year("cooc_test", docs + [paper_6])
+        create_cooc(var = "cooc_test",
+                    sub_var = "item",
+                    year_var = "year",
+                    collection_name = "cooc_test",
+                    time_window = range(1990,1993),
+                    weighted_network = False,
+                    self_loop = False).main()
+        dataset = Dataset(collection_name = "cooc_test",
+                          variable = "cooc_test",
+                          sub_variable = "item",
+                          year_variable = "year",
+                          focal_year = 1994,
+                          keep_item_percentile = 50)
+        dataset.indicator = "wang"
+        dataset.get_q_journal_list()
+        # 1991-1993: 1 and 3 used 3 times, 2: 4 times, 4: once, 5: twice
+        self.assertListEqual(sorted(dataset.list_of_items_restricted), ["1", "2", "3"])
+        np.testing.assert_array_equal(dataset.restricted_mask, [True, True, True, False, False])
+        counts, oov_counts = dataset.get_item_counts(1993)
+        np.testing.assert_array_equal(counts, [1, 0, 0, 0, 2])
+        self.assertDictEqual(oov_counts, {})
+        # The items missing from the vocabulary are counted apart and still used by the percentile
+        other = Dataset(collection_name = "cooc_test", variable = "cooc_test", sub_variable = "item",
+                        year_variable = "year", focal_year = 1994, keep_item_percentile = 50)
+        other.path_input = None
+        other.path_item_counts = dataset.path_input + "/item_counts_other"
+        other.name2index = {"1": 0, "2": 1, "3": 2}
+        other.get_q_journal_list()
+        self.assertListEqual(sorted(other.list_of_items_restricted), ["1", "2", "3"])
+        self.assertDictEqual(other.get_item_counts(1993)[1], {"5": 2})
+        # The saved counts are used while the documents do not change
+        file = dataset.path_input + "/item_counts/1993.npy"
+        mtime = os.stat(file).st_mtime_ns
+        time.sleep(0.01)
+        os.utime("Data/docs/cooc_test/1993.json")
+        np.testing.assert_array_equal(dataset.get_item_counts(1993)[0], [1, 0, 0, 0, 2])
+        self.assertEqual(os.stat(file).st_mtime_ns, mtime)
+        write_docs_by_year("cooc_test", docs + [dict(paper_6, Ref_journals = [{"item": "2"}])])
+        np.testing.assert_array_equal(dataset.get_item_counts(1993)[0], [0, 1, 0, 0, 0])
+        # The counts of a database are saved too, until documents of the year are inserted
+        backend = novelpy.utils.get_backend("sqlite:///Data/counts_test.db", "test", "cooc_test", "id", "year")
+        backend.bulk_write([{"id": 1, "year": 1993, "cooc_test": paper_6["Ref_journals"]}])
+        other = Dataset(client_name = "sqlite:///Data/counts_test.db", db_name = "test", collection_name = "cooc_test",
+                        variable = "cooc_test", sub_variable = "item", year_variable = "year", focal_year = 1994)
+        other.path_input = None
+        other.path_item_counts = "Data/counts_test"
+        other.name2index = dataset.name2index
+        np.testing.assert_array_equal(other.get_item_counts(1993)[0], [1, 0, 0, 0, 2])
+        mtime = os.stat("Data/counts_test/1993.npy").st_mtime_ns
+        np.testing.assert_array_equal(other.get_item_counts(1993)[0], [1, 0, 0, 0, 2])
+        self.assertEqual(os.stat("Data/counts_test/1993.npy").st_mtime_ns, mtime)
+        backend.bulk_write([{"id": 2, "year": 1993, "cooc_test": [{"item": "1"}]}])
+        np.testing.assert_array_equal(other.get_item_counts(1993)[0], [2, 0, 0, 0, 2])
+
+
+class TestGetIndicator(TmpDirTest):
+
+    def setUp(self):
+        super().setUp()
+        write_random_docs("indicator_test", range(1990, 1997))
+        self.cooc_params = dict(var = "refs", sub_var = "item", year_var = "year", collection_name = "indicator_test",
+                                variants = "all")
+        create_cooc(**self.cooc_params).main()
+
+    def run_indicator(self, indicator, batch_pairs = None, **options):
+        indicator_class, params = INDICATORS[indicator]
+        instance = indicator_class(collection_name = "indicator_test", id_variable = "id", year_variable = "year",
+                                   variable = "refs", sub_variable = "item", focal_year = 1993, density = True,
+                                   **params, **options)
+        if batch_pairs is not None:
+            instance.batch_pairs = batch_pairs
+        instance.get_indicator()
+        return instance
+
+    def assert_scores(self, instance):
+        # The scores written for each document are the ones computed one pair at a time from the score matrix
+        key = instance.get_score_key()
+        found = {doc["id"]: doc[key] for doc in iter_docs(instance.path_output + "/1993")}
+        restricted = instance.list_of_items_restricted if instance.indicator == "wang" else None
+        expected = dict()
+        for doc in iter_docs("Data/docs/indicator_test/1993"):
+            items = [item["item"] for item in doc["refs"]]
+            # No score without at least 3 items
+            if len(items) > 2:
+                expected[doc["id"]] = paper_scores(instance.indicator, items, instance.comb_scores, instance.name2index, restricted)
+        self.assertListEqual(sorted(found), sorted(expected))
+        for id_, doc_expected in expected.items():
+            for name, value in doc_expected["score"].items():
+                # NaN for Uzzi et al. (2013) when a pair has the same count in every sample
+                np.testing.assert_allclose(found[id_]["score"][name], value, rtol = 1e-12)
+            # The items read from the incidence matrices come in the order of the vocabulary
+            np.testing.assert_allclose(sorted(doc_expected["scores_array"]), sorted(found[id_]["scores_array"]))
+
+    def test_get_indicator(self):
+        for indicator in INDICATORS:
+            for options in [dict(), dict(batch_pairs = 5), dict(ragged = True), dict(n_jobs = 2),
+                            dict(ragged = True, n_jobs = 2)]:
+                with self.subTest(indicator = indicator, **options):
+                    instance = self.run_indicator(indicator, **options)
+                    self.assertEqual(instance.papers_items is None, options.get("ragged", False))
+                    self.assert_scores(instance)
+
+    def test_get_indicator_incidence(self):
+        create_cooc(**self.cooc_params, incidence = True, id_var = "id").main()
+        # Uzzi et al. (2013) needs the year of the items, which are not in the incidence matrices
+        for indicator in ["lee", "foster", "wang"]:
+            for options in [dict(), dict(ragged = True)]:
+                with self.subTest(indicator = indicator, **options):
+                    instance = self.run_indicator(indicator, **options)
+                    self.assertTrue(instance.get_item_paper_from_incidence())
+                    self.assert_scores(instance)
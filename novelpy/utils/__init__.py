@@ -1,4 +1,8 @@
+from .io_tools import *
+from .cache import *
+from .backends import *
 from .cooc_utils import *
+from .ragged import *
 from .embedding import *
 from .get_sample import *
 from .references import *
@@ -0,0 +1,716 @@
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+import pymongo
+from pymongo import InsertOne
+from novelpy.utils.io_tools import iter_docs, get_doc_file, get_doc_years, find_by_ids, MONGO_BATCH_SIZE
+from novelpy.utils.cache import get_signatures, hash_docs
+
+SQLITE_PREFIX = "sqlite:///"
+# Number of values bound by one IN (...) query, under the default limit of SQLite (999 variables)
+SQLITE_IN_SIZE = 500
+
+# One client per process and per uri, pymongo clients cannot be used after a fork
+_mongo_clients = dict()
+# One connection per process, per thread and per file, sqlite3 connections cannot be shared between threads
+_sqlite_connections = dict()
+
+
+def get_mongo_client(client_name):
+    '''
+    Description
+    -----------
+    Client of a MongoDB server shared by every class of the process instead of one client per class or per document
+
+    Parameters
+    ----------
+    client_name : str
+        uri of the server, e.g mongodb://localhost:27017
+
+    Returns
+    -------
+    pymongo.MongoClient
+
+    '''
+    key = (os.getpid(), client_name)
+    if key not in _mongo_clients:
+        _mongo_clients[key] = pymongo.MongoClient(client_name)
+    return _mongo_clients[key]
+
+def get_sqlite_connection(file):
+    '''
+    Description
+    -----------
+    Connection to a SQLite file shared by the process (one per thread)
+
+    Parameters
+    ----------
+    file : str
+        path to the SQLite file, created if it does not exist
+
+    Returns
+    -------
+    sqlite3.Connection
+
+    '''
+    key = (os.getpid(), threading.get_ident(), os.path.abspath(file))
+    if key not in _sqlite_connections:
+        folder = os.path.dirname(file)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        connection = sqlite3.connect(file)
+        # Readers of other processes are not blocked by a writer
+        connection.execute("PRAGMA journal_mode=WAL")
+        _sqlite_connections[key] = connection
+    return _sqlite_connections[key]
+
+def require_mongo(client_name, feature):
+    '''
+    Description
+    -----------
+    Raise a clear error when a feature needing a MongoDB server (sessions, aggregations, updates of the documents, ...)
+    is used with a SQLite file, which only stores and reads documents (see SQLiteBackend)
+
+    Parameters
+    ----------
+    client_name : str
+        uri of the MongoDB server or of the SQLite file
+    feature : str
+        name of the feature, used in the message
+
+    Returns
+    -------
+
+    '''
+    if client_name and client_name.startswith(SQLITE_PREFIX):
+        raise ValueError("{} needs a MongoDB server, it is not supported with the sqlite backend ({})".format(
+            feature, client_name))
+
+def get_database(client_name, db_name):
+    '''
+    Description
+    -----------
+    MongoDB database, its client being shared by the process
+
+    Parameters
+    ----------
+    client_name : str
+        uri of the MongoDB server
+    db_name : str
+        name of the database
+
+    Returns
+    -------
+    pymongo.database.Database
+
+    '''
+    require_mongo(client_name, "This function")
+    return get_mongo_client(client_name)[db_name]
+
+def parse_query(query, year_variable = None):
+    '''
+    Description
+    -----------
+    Conditions of a query read by the backends without MongoDB. Only the queries of the indicators are supported:
+    {field: {"$exists": bool}} and {field: {"$ne": None}} on a top level field, and the year equal to a value.
+    Any other query raises a NotImplementedError instead of being ignored
+
+    Parameters
+    ----------
+    query : dict
+        MongoDB query, e.g {"c04":{"$exists":True}, "year":2000}
+    year_variable : str, optional
+        field of the year of the documents
+
+    Returns
+    -------
+    list
+        (field, operator, value) with the operators "exists", "not_null" and "year"
+
+    '''
+    conditions = []
+    for field, condition in (query or dict()).items():
+        if field == year_variable and isinstance(condition, (int, str)):
+            conditions.append((field, "year", condition))
+        elif "." in field or not isinstance(condition, dict) or len(condition) != 1:
+            raise NotImplementedError("Query {} on {} is not supported outside of MongoDB".format(condition, field))
+        elif "$exists" in condition:
+            conditions.append((field, "exists", bool(condition["$exists"])))
+        elif condition == {"$ne": None}:
+            conditions.append((field, "not_null", None))
+        else:
+            raise NotImplementedError("Query {} on {} is not supported outside of MongoDB".format(condition, field))
+    return conditions
+
+def match_conditions(doc, conditions):
+    '''
+    Description
+    -----------
+    True if a document satisfies the conditions given by parse_query
+
+    Parameters
+    ----------
+    doc : dict
+        document
+    conditions : list
+        conditions given by parse_query
+
+    Returns
+    -------
+    bool
+
+    '''
+    for field, operator, value in conditions:
+        if operator == "year" and doc.get(field) != value:
+            return False
+        if operator == "exists" and (field in doc) != value:
+            return False
+        if operator == "not_null" and doc.get(field) is None:
+            return False
+    return True
+
+def project_doc(doc, projection):
+    '''
+    Description
+    -----------
+    Top level fields of a document kept by a projection ({"c04":1, "year":1, "_id":0}).
+    A dotted field keeps its whole top level field, _id is ignored and excluding fields is not supported
+
+    Parameters
+    ----------
+    doc : dict
+        document
+    projection : dict or list
+        fields to keep
+
+    Returns
+    -------
+    dict
+
+    '''
+    if not projection:
+        return doc
+    if isinstance(projection, dict):
+        if not all(value for field, value in projection.items() if field != "_id"):
+            raise NotImplementedError("Excluding fields is not supported outside of MongoDB")
+        projection = [field for field in projection if field != "_id"]
+    fields = set(field.split(".")[0] for field in projection)
+    return {key: value for key, value in doc.items() if key in fields}
+
+
+class Backend:
+
+    # True if the collection answers MongoDB aggregation pipelines
+    supports_aggregation = False
+
+    def __init__(self, collection_name, id_variable = None, year_variable = None):
+        '''
+        Description
+        -----------
+        Source of the documents of a collection. The classes of novelpy read and write the documents through
+        this interface whatever they are stored in (MongoDB, JSON files or a SQLite file), see get_backend
+
+        Parameters
+        ----------
+        collection_name : str
+            name of the collection
+        id_variable : str, optional
+            field of the id of the documents, used by read_by_ids
+        year_variable : str, optional
+            field of the year of the documents, used by read_year
+
+        Returns
+        -------
+
+        '''
+        self.collection_name = collection_name
+        self.id_variable = id_variable
+        self.year_variable = year_variable
+
+    def read_year(self, year, query = None, projection = None, **kwargs):
+        '''
+        Description
+        -----------
+        Documents of a year
+
+        Parameters
+        ----------
+        year : int
+            year of the documents
+        query : dict, optional
+            other MongoDB conditions on the documents, see parse_query for the ones supported without MongoDB
+        projection : dict, optional
+            MongoDB projection, see project_doc for the ones supported without MongoDB
+
+        Returns
+        -------
+        iterable of dict
+
+        '''
+        raise NotImplementedError
+
+    def read_by_ids(self, ids, query = None, projection = None):
+        '''
+        Description
+        -----------
+        Documents whose id is in ids
+
+        Parameters
+        ----------
+        ids : iterable
+            ids of the documents
+        query : dict, optional
+            other MongoDB conditions on the documents, see parse_query for the ones supported without MongoDB
+        projection : dict, optional
+            MongoDB projection, see project_doc for the ones supported without MongoDB
+
+        Returns
+        -------
+        iterable of dict
+
+        '''
+        raise NotImplementedError
+
+    def bulk_write(self, docs):
+        '''
+        Description
+        -----------
+        Insert documents
+
+        Parameters
+        ----------
+        docs : iterable
+            documents to insert
+
+        Returns
+        -------
+
+        '''
+        raise NotImplementedError
+
+    def create_index(self, field):
+        '''
+        Description
+        -----------
+        Index a field so that read_year or read_by_ids do not scan the whole collection
+
+        Parameters
+        ----------
+        field : str
+            field to index, e.g id_variable
+
+        Returns
+        -------
+
+        '''
+        raise NotImplementedError
+
+    def get_years(self):
+        '''
+        Description
+        -----------
+        Years of the documents
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        list
+            sorted years
+
+        '''
+        raise NotImplementedError
+
+    def get_year_stats(self, year):
+        '''
+        Description
+        -----------
+        Number of documents of a year and largest id given by the storage to one of them (_id or row id),
+        answered by the index of the year without reading the documents
+
+        Parameters
+        ----------
+        year : int
+            year of the documents
+
+        Returns
+        -------
+        count : int
+        last_id : str
+            None if the year has no document
+
+        '''
+        raise NotImplementedError
+
+    def get_year_signatures(self, year, previous = None, full = False, projection = None):
+        '''
+        Description
+        -----------
+        Signature of the documents of a year, used in the keys of the artifacts computed from them (see novelpy.utils.cache).
+        By default it only changes when documents are inserted or deleted (see get_year_stats). With full the documents
+        are read and hashed, which also detects documents updated in place
+
+        Parameters
+        ----------
+        year : int
+            year of the documents
+        previous : dict, optional
+            signatures saved with the previous version of the artifact
+        full : bool
+            hash the documents
+        projection : dict, optional
+            fields hashed with full
+
+        Returns
+        -------
+        dict
+            signatures to give to get_artifact_key
+
+        '''
+        if full:
+            signature = {"sha1": hash_docs(self.read_year(year, projection = projection))}
+        else:
+            count, last_id = self.get_year_stats(year)
+            signature = {"count": count, "last_id": last_id}
+            signature["sha1"] = hashlib.sha1(json.dumps(signature).encode()).hexdigest()
+        return {"{}/{}".format(self.name, year): signature}
+
+
+class MongoBackend(Backend):
+
+    supports_aggregation = True
+
+    def __init__(self, client_name, db_name, collection_name, id_variable = None, year_variable = None):
+        '''
+        Description
+        -----------
+        Collection of a MongoDB server, the client being shared by the process
+
+        Parameters
+        ----------
+        client_name : str
+            uri of the server
+        db_name : str
+            name of the database
+        collection_name : str
+            name of the collection
+        id_variable : str, optional
+            field of the id of the documents
+        year_variable : str, optional
+            field of the year of the documents
+
+        Returns
+        -------
+
+        '''
+        Backend.__init__(self, collection_name, id_variable, year_variable)
+        self.client = get_mongo_client(client_name)
+        self.db = self.client[db_name]
+        self.collection = self.db[collection_name]
+        self.name = "{}.{}".format(db_name, collection_name)
+
+    def read_year(self, year, query = None, projection = None, **kwargs):
+        year_query = dict(query) if query else dict()
+        year_query[self.year_variable] = year
+        return self.collection.find(year_query, projection, **kwargs).batch_size(MONGO_BATCH_SIZE)
+
+    def read_by_ids(self, ids, query = None, projection = None):
+        return find_by_ids(self.collection, self.id_variable, ids, query, projection)
+
+    def bulk_write(self, docs, chunk_size = 10000):
+        chunk = []
+        for doc in docs:
+            chunk.append(InsertOne(doc))
+            if len(chunk) >= chunk_size:
+                self.collection.bulk_write(chunk, ordered = False)
+                chunk = []
+        if chunk:
+            self.collection.bulk_write(chunk, ordered = False)
+
+    def create_index(self, field):
+        self.collection.create_index([(field, 1)])
+
+    def get_years(self):
+        return sorted(self.collection.distinct(self.year_variable))
+
+    def get_year_stats(self, year):
+        query = {self.year_variable: year}
+        last = list(self.collection.find(query, {"_id": 1}).sort("_id", -1).limit(1))
+        return self.collection.count_documents(query), str(last[0]["_id"]) if last else None
+
+
+class SQLiteBackend(Backend):
+
+    def __init__(self, client_name, db_name, collection_name, id_variable = None, year_variable = None):
+        '''
+        Description
+        -----------
+        Collection stored in a local SQLite file given by client_name = "sqlite:///path/to/file.db", in the table
+        {db_name}.{collection_name}. The id and the year of each document are stored in indexed columns next to
+        the document (JSON text), so that read_by_ids and read_year are answered by the indexes without running a server.
+        Only the documents are stored and read: the features needing MongoDB (sessions, aggregations, updates) raise an error
+
+        Parameters
+        ----------
+        client_name : str
+            "sqlite:///" followed by the path to the SQLite file
+        db_name : str
+            name of the database
+        collection_name : str
+            name of the collection
+        id_variable : str, optional
+            field of the id of the documents
+        year_variable : str, optional
+            field of the year of the documents
+
+        Returns
+        -------
+
+        '''
+        Backend.__init__(self, collection_name, id_variable, year_variable)
+        self.file = client_name[len(SQLITE_PREFIX):]
+        self.table = "{}.{}".format(db_name, collection_name)
+        self.name = self.table
+
+    @property
+    def connection(self):
+        return get_sqlite_connection(self.file)
+
+    def quote(self, name):
+        return '"{}"'.format(name.replace('"', '""'))
+
+    def create_table(self):
+        table = self.quote(self.table)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS {} (id INTEGER PRIMARY KEY, doc_id, year, doc TEXT NOT NULL)".format(table))
+        for column in ["doc_id", "year"]:
+            self.connection.execute("CREATE INDEX IF NOT EXISTS {} ON {} ({})".format(
+                self.quote(self.table + "." + column), table, column))
+
+    def exists(self):
+        return self.connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                       (self.table,)).fetchone() is not None
+
+    def select(self, where, params, query, projection):
+        '''
+        Description
+        -----------
+        Documents of the rows matching a where clause and the conditions of a query, read by chunks
+
+        Parameters
+        ----------
+        where : list
+            SQL conditions on the doc_id and year columns
+        params : list
+            values bound by the conditions
+        query : dict
+            query supported by parse_query
+        projection : dict or list
+            fields to keep, see project_doc
+
+        Returns
+        -------
+        generator of dict
+
+        '''
+        where, params = list(where), list(params)
+        for field, operator, value in parse_query(query, self.year_variable):
+            path = '$."{}"'.format(field.replace('"', '\\"'))
+            if operator == "year":
+                where.append("year = ?")
+                params.append(value)
+            elif operator == "exists":
+                where.append("json_type(doc, ?) IS {}NULL".format("NOT " if value else ""))
+                params.append(path)
+            else:
+                where.append("json_type(doc, ?) != 'null'")
+                params.append(path)
+        if not self.exists():
+            return
+        sql = "SELECT doc FROM {}".format(self.quote(self.table))
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        cursor = self.connection.execute(sql + " ORDER BY id", params)
+        while True:
+            rows = cursor.fetchmany(MONGO_BATCH_SIZE)
+            if not rows:
+                break
+            for text, in rows:
+                yield project_doc(json.loads(text), projection)
+
+    def read_year(self, year, query = None, projection = None, **kwargs):
+        return self.select(["year = ?"], [year], query, projection)
+
+    def read_by_ids(self, ids, query = None, projection = None):
+        ids = list(ids)
+        # One query per chunk of ids, under the limit of SQLite on the number of bound values
+        for start in range(0, len(ids), SQLITE_IN_SIZE):
+            chunk = ids[start:start + SQLITE_IN_SIZE]
+            for doc in self.select(["doc_id IN ({})".format(",".join("?" * len(chunk)))], chunk, query, projection):
+                yield doc
+
+    def bulk_write(self, docs, chunk_size = 10000):
+        self.create_table()
+        sql = "INSERT INTO {} (doc_id, year, doc) VALUES (?, ?, ?)".format(self.quote(self.table))
+        chunk = []
+        for doc in docs:
+            chunk.append((doc.get(self.id_variable), doc.get(self.year_variable), json.dumps(doc, default = str)))
+            if len(chunk) >= chunk_size:
+                self.connection.executemany(sql, chunk)
+                chunk = []
+        if chunk:
+            self.connection.executemany(sql, chunk)
+        self.connection.commit()
+
+    def create_index(self, field):
+        # The id and the year are always indexed
+        pass
+
+    def get_years(self):
+        if not self.exists():
+            return []
+        rows = self.connection.execute("SELECT DISTINCT year FROM {} WHERE year IS NOT NULL ORDER BY year".format(
+            self.quote(self.table))).fetchall()
+        return [year for year, in rows]
+
+    def get_year_stats(self, year):
+        if not self.exists():
+            return 0, None
+        count, last_id = self.connection.execute("SELECT COUNT(*), MAX(id) FROM {} WHERE year = ?".format(
+            self.quote(self.table)), (year,)).fetchone()
+        return count, None if last_id is None else str(last_id)
+
+
+class JSONBackend(Backend):
+
+    def __init__(self, collection_name, id_variable = None, year_variable = None, path = "Data/docs"):
+        '''
+        Description
+        -----------
+        Collection stored as one JSON or JSON Lines file per year in {path}/{collection_name}/{year}.
+        There is no index, read_by_ids scans the files
+
+        Parameters
+        ----------
+        collection_name : str
+            name of the collection
+        id_variable : str, optional
+            field of the id of the documents
+        year_variable : str, optional
+            field of the year of the documents
+        path : str
+            folder of the collections
+
+        Returns
+        -------
+
+        '''
+        Backend.__init__(self, collection_name, id_variable, year_variable)
+        self.path = "{}/{}".format(path, collection_name)
+
+    def read_year(self, year, query = None, projection = None, **kwargs):
+        conditions = parse_query(query, self.year_variable)
+        if get_doc_file(self.path + "/{}".format(year)) is None:
+            return
+        for doc in iter_docs(self.path + "/{}".format(year)):
+            if match_conditions(doc, conditions):
+                yield project_doc(doc, projection)
+
+    def read_by_ids(self, ids, query = None, projection = None):
+        ids = set(ids)
+        # Only the file of the year is read when the query gives it
+        years = [value for field, operator, value in parse_query(query, self.year_variable) if operator == "year"]
+        for year in years[:1] or self.get_years():
+            for doc in self.read_year(year, query):
+                if doc.get(self.id_variable) in ids:
+                    yield project_doc(doc, projection)
+
+    def bulk_write(self, docs):
+        files = dict()
+        try:
+            for doc in docs:
+                year = doc[self.year_variable]
+                if year not in files:
+                    if get_doc_file(self.path + "/{}".format(year)) == self.path + "/{}.json".format(year):
+                        raise ValueError("{}/{}.json is a JSON array, convert it with convert_to_jsonl first".format(
+                            self.path, year))
+                    if not os.path.exists(self.path):
+                        os.makedirs(self.path)
+                    files[year] = open(self.path + "/{}.jsonl".format(year), "a")
+                files[year].write(json.dumps(doc, default = str) + "\n")
+        finally:
+            for file in files.values():
+                file.close()
+
+    def create_index(self, field):
+        pass
+
+    def get_years(self):
+        if not os.path.exists(self.path):
+            return []
+        return get_doc_years(self.path)
+
+    def get_year_signatures(self, year, previous = None, full = False, projection = None):
+        # The sha1 of the file is only computed again if it was written since previous
+        return get_signatures([get_doc_file(self.path + "/{}".format(year))], previous)
+
+
+def get_backend(client_name, db_name, collection_name, id_variable = None, year_variable = None, path = "Data/docs"):
+    '''
+    Description
+    -----------
+    Backend of a collection: SQLite for client_name = "sqlite:///path/to/file.db", MongoDB for any other
+    client_name and JSON files in {path}/{collection_name} without client_name
+
+    Parameters
+    ----------
+    client_name : str or None
+        uri of the MongoDB server or of the SQLite file
+    db_name : str
+        name of the database
+    collection_name : str
+        name of the collection
+    id_variable : str, optional
+        field of the id of the documents
+    year_variable : str, optional
+        field of the year of the documents
+    path : str
+        folder of the JSON collections
+
+    Returns
+    -------
+    Backend
+
+    '''
+    if not client_name:
+        return JSONBackend(collection_name, id_variable, year_variable, path)
+    if client_name.startswith(SQLITE_PREFIX):
+        return SQLiteBackend(client_name, db_name, collection_name, id_variable, year_variable)
+    return MongoBackend(client_name, db_name, collection_name, id_variable, year_variable)
+
+def copy_docs(source, target, indexes = None):
+    '''
+    Description
+    -----------
+    Copy the documents of every year of a backend into another one, e.g the JSON files of a collection
+    into a SQLite file for the nodes without MongoDB server. The indexes are created once the documents are written
+
+    Parameters
+    ----------
+    source : Backend
+        backend read
+    target : Backend
+        backend written
+    indexes : list, optional
+        fields indexed in target, e.g [id_variable, year_variable]
+
+    Returns
+    -------
+
+    '''
+    for year in source.get_years():
+        target.bulk_write(source.read_year(year))
+    for field in indexes or []:
+        target.create_index(field)
@@ -0,0 +1,246 @@
+import os
+import json
+import hashlib
+
+# Changed when the way an artifact is computed changes, so that the artifacts saved before are rebuilt
+CACHE_VERSION = 1
+
+
+def hash_file(file, chunk_size = 2**20):
+    '''
+    Description
+    -----------
+    sha1 of the content of a file, read by chunks
+
+    Parameters
+    ----------
+    file : str
+        path to the file
+    chunk_size : int
+        number of bytes read at once
+
+    Returns
+    -------
+    str
+        hexadecimal digest
+
+    '''
+    sha1 = hashlib.sha1()
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def hash_ids(ids):
+    '''
+    Description
+    -----------
+    sha1 of a list of ids whatever its order, e.g list_ids
+
+    Parameters
+    ----------
+    ids : iterable or None
+
+    Returns
+    -------
+    str
+        hexadecimal digest, None if ids is None
+
+    '''
+    if ids is None:
+        return None
+    return hashlib.sha1(json.dumps(sorted(map(str, ids))).encode()).hexdigest()
+
+def hash_docs(docs):
+    '''
+    Description
+    -----------
+    sha1 of a set of documents whatever their order, e.g the documents of a year in a database,
+    whose content cannot be signed by a file
+
+    Parameters
+    ----------
+    docs : iterable
+        documents serializable by json
+
+    Returns
+    -------
+    str
+        hexadecimal digest
+
+    '''
+    digests = sorted(hashlib.sha1(json.dumps(doc, sort_keys = True, default = str).encode()).hexdigest()
+                     for doc in docs)
+    return hashlib.sha1("".join(digests).encode()).hexdigest()
+
+def get_signatures(files, previous = None):
+    '''
+    Description
+    -----------
+    Size, modification time and sha1 of the content of the input files of an artifact.
+    The sha1 saved in the previous meta file is reused when the size and the modification time did not change,
+    so that only the files that were written again are read
+
+    Parameters
+    ----------
+    files : list
+        paths to the input files, a missing file gets None
+    previous : dict, optional
+        signatures saved with the previous version of the artifact
+
+    Returns
+    -------
+    dict
+        signature of each file
+
+    '''
+    previous = previous or dict()
+    signatures = dict()
+    for file in files:
+        if file is None:
+            continue
+        if not os.path.exists(file):
+            signatures[file] = None
+            continue
+        stat = os.stat(file)
+        signature = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        known = previous.get(file)
+        if known and known["size"] == signature["size"] and known["mtime_ns"] == signature["mtime_ns"]:
+            signature["sha1"] = known["sha1"]
+        else:
+            signature["sha1"] = hash_file(file)
+        signatures[file] = signature
+    return signatures
+
+def get_meta_file(artifact):
+    '''
+    Description
+    -----------
+    Meta file of an artifact, e.g Data/score/lee/{variable}/{year}.meta.json for Data/score/lee/{variable}/{year}
+
+    Parameters
+    ----------
+    artifact : str
+        path to the artifact without its extension
+
+    Returns
+    -------
+    str
+
+    '''
+    return artifact + ".meta.json"
+
+def load_meta(artifact):
+    '''
+    Description
+    -----------
+    Meta file saved with an artifact by save_meta
+
+    Parameters
+    ----------
+    artifact : str
+        path to the artifact without its extension
+
+    Returns
+    -------
+    dict
+        None if there is no meta file or if it cannot be read
+
+    '''
+    try:
+        with open(get_meta_file(artifact), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def get_artifact_key(artifact, params, inputs, signatures = None):
+    '''
+    Description
+    -----------
+    Key of an artifact: sha1 of the parameters used to compute it and of the content of its inputs
+
+    Parameters
+    ----------
+    artifact : str
+        path to the artifact without its extension
+    params : dict
+        parameters of the computation, values must be serializable by json
+    inputs : list
+        files read by the computation
+    signatures : dict, optional
+        signatures of the inputs already given by get_signatures, e.g for several artifacts computed from the same files
+
+    Returns
+    -------
+    key : str
+        hexadecimal digest
+    signatures : dict
+        signature of each input, to give to save_meta
+
+    '''
+    if signatures is None:
+        meta = load_meta(artifact)
+        signatures = get_signatures(inputs, meta["inputs"] if meta else None)
+    content = {"version": CACHE_VERSION,
+               "params": params,
+               "inputs": {file: signature["sha1"] if signature else None
+                          for file, signature in signatures.items()}}
+    key = hashlib.sha1(json.dumps(content, sort_keys = True, default = str).encode()).hexdigest()
+    return key, signatures
+
+def is_fresh(artifact, key):
+    '''
+    Description
+    -----------
+    True if the artifact exists, was computed from the parameters and the inputs of key
+    and was not written again since its meta file was saved
+
+    Parameters
+    ----------
+    artifact : str
+        path to the artifact without its extension
+    key : str
+        key given by get_artifact_key
+
+    Returns
+    -------
+    bool
+
+    '''
+    meta = load_meta(artifact)
+    if meta is None or meta["key"] != key:
+        return False
+    return os.path.exists(meta["file"]) and os.stat(meta["file"]).st_mtime_ns == meta["mtime_ns"]
+
+def save_meta(artifact, file, key, params, signatures):
+    '''
+    Description
+    -----------
+    Save the key of an artifact next to it once it is written
+
+    Parameters
+    ----------
+    artifact : str
+        path to the artifact without its extension
+    file : str
+        file written, with its extension
+    key : str
+        key given by get_artifact_key
+    params : dict
+        parameters of the computation
+    signatures : dict
+        signatures given by get_artifact_key
+
+    Returns
+    -------
+
+    '''
+    meta = {"key": key,
+            "file": file,
+            "mtime_ns": os.stat(file).st_mtime_ns,
+            "version": CACHE_VERSION,
+            "params": params,
+            "inputs": signatures}
+    with open(get_meta_file(artifact) + ".tmp", "w") as f:
+        json.dump(meta, f, default = str)
+    os.replace(get_meta_file(artifact) + ".tmp", get_meta_file(artifact))
@@ -2,13 +2,14 @@ import os
 import json
 import tqdm
 import math
-import pymongo
 import numpy as np
 import pandas as pd
 import seaborn as sns
 import matplotlib
 import matplotlib.pyplot as plt
 from collections import defaultdict
+from novelpy.utils.io_tools import iter_docs, read_results
+from novelpy.utils.backends import get_database
 import matplotlib.gridspec as gridspec
 
 
@@ -99,8 +100,7 @@ class plot_dist:
             self.get_info_json()
 
     def get_info_mongo(self):                
-        self.client = pymongo.MongoClient(self.client_name)
-        self.db = self.client[self.db_name]
+        self.db = get_database(self.client_name, self.db_name)
 
         
         self.line_position = []
@@ -171,8 +171,7 @@ class plot_dist:
             if indicator =="shibayama":
                 key_name = "shibayama"
                 self.path_doc= "Result/{}/{}".format(indicator,self.doc_year)
-                with open(self.path_doc + ".json", "r") as read_file:
-                    self.docs = json.load(read_file)
+                self.docs = list(iter_docs(self.path_doc))
                 try:
                     self.doc = [x for x in self.docs if x[self.id_variable] == self.doc_id][0]                    
                 except:
@@ -186,8 +185,7 @@ class plot_dist:
             elif indicator == "Author_proximity":
                 key_name = "Author_proximity"   
                 self.path_doc= "Result/{}/{}".format(indicator,self.doc_year)
-                with open(self.path_doc + ".json", "r") as read_file:
-                    self.docs = json.load(read_file)
+                self.docs = list(iter_docs(self.path_doc))
                 try:
                     self.doc = [x for x in self.docs if x[self.id_variable] == self.doc_id][0]                    
                 except:
@@ -208,27 +206,23 @@ class plot_dist:
                         for time, reu, perc in zip(self.time_window_cooc,self.n_reutilisation, self.keep_item_percentile):
                             key_name = variable + "_" + indicator + "_" + str(time) + "_" + str(reu) + "_restricted" + str(perc)
                             self.path_doc= "Result/{}/{}/{}".format(indicator, variable + "_" + str(time) + "_" + str(reu)  + "_restricted" + str(perc) ,self.doc_year)
-                            with open(self.path_doc + ".json", "r") as read_file:
-                                self.docs = json.load(read_file)
-                            try:
-                                self.doc = [doc for doc in self.docs if doc[self.id_variable] == self.doc_id][0]
-                            except:
+                            self.doc = read_results(self.path_doc, [key_name + ".score.novelty", key_name + ".scores_array"],
+                                                    filters = [(self.id_variable, "==", self.doc_id)])
+                            if not len(self.doc):
                                 raise Exception("No object with the ID {} or not enough combinations to have a score on entity {} and indicator {}".format(self.doc_id,variable,indicator))
-                            self.line_position.append(self.doc[key_name]["score"]["novelty"])
-                            df_temp = pd.DataFrame(self.doc[key_name]["scores_array"], columns=["Scores"])
+                            self.line_position.append(self.doc[key_name + ".score.novelty"].iloc[0])
+                            df_temp = pd.DataFrame(list(self.doc[key_name + ".scores_array"].iloc[0]), columns=["Scores"])
                             df_temp['Variable'], df_temp['Indicator'] = [variable, indicator + "_" + str(time) + "_" + str(reu) + "_restricted" + str(perc)]
                             self.df = pd.concat([self.df,df_temp], ignore_index=True)                           
                     else:                        
                         key_name = variable + "_" + indicator
                         self.path_doc= "Result/{}/{}/{}".format(indicator, variable,self.doc_year)
-                        with open(self.path_doc + ".json", "r") as read_file:
-                            self.docs = json.load(read_file)
-                        try:
-                            self.doc = [x for x in self.docs if x[self.id_variable] == self.doc_id][0]
-                        except:
+                        self.doc = read_results(self.path_doc, [key_name + ".score.novelty", key_name + ".scores_array"],
+                                                filters = [(self.id_variable, "==", self.doc_id)])
+                        if not len(self.doc):
                                 raise Exception("No object with the ID {} or not enough combinations to have a score on entity {} and indicator {}".format(self.doc_id,variable,indicator))
-                        self.line_position.append(self.doc[key_name]["score"]["novelty"])
-                        df_temp = pd.DataFrame(self.doc[key_name]["scores_array"], columns=["Scores"])
+                        self.line_position.append(self.doc[key_name + ".score.novelty"].iloc[0])
+                        df_temp = pd.DataFrame(list(self.doc[key_name + ".scores_array"].iloc[0]), columns=["Scores"])
                         df_temp['Variable'], df_temp['Indicator'] = [variable, indicator]
                         self.df = pd.concat([self.df,df_temp], ignore_index=True)        
         
@@ -474,8 +468,7 @@ class novelty_trend:
     
 
     def get_info_mongo(self):                
-        self.client = pymongo.MongoClient(self.client_name)
-        self.db = self.client[self.db_name]
+        self.db = get_database(self.client_name, self.db_name)
         
         
         
@@ -647,8 +640,7 @@ class novelty_trend:
                 for embedding_entity in self.embedding_entities_shibayama:
                     for year in self.year_range:
                         self.path_doc= "Result/{}/{}".format(indicator, year)
-                        with open(self.path_doc + ".json", "r") as read_file:
-                            docs = json.load(read_file)   
+                        docs = list(iter_docs(self.path_doc))
                         score_list = []
                         for doc in docs:
                             try:
@@ -664,8 +656,7 @@ class novelty_trend:
                 for embedding_entity in self.embedding_entities_authors:
                     for year in self.year_range:
                             self.path_doc= "Result/{}/{}".format(indicator, year)
-                            with open(self.path_doc + ".json", "r") as read_file:
-                                docs = json.load(read_file)   
+                            docs = list(iter_docs(self.path_doc))
                             score_list_intra = []
                             score_list_inter = []
                             for doc in docs:
@@ -688,17 +679,10 @@ class novelty_trend:
                 for variable in self.variables:
                     if indicator == 'wang':
                         for time,reu,perc in zip(self.time_window_cooc,self.n_reutilisation,self.keep_item_percentile):
-                            key_name = variable + "_" + indicator + "_" + str(time) + "_" + str(reu)
+                            key_name = variable + "_" + indicator + "_" + str(time) + "_" + str(reu) + "_restricted" + str(perc)
                             for year in self.year_range:
                                 self.path_doc= "Result/{}/{}/{}".format(indicator, variable + "_" + str(time) + "_" + str(reu)+ "_restricted" + str(perc) , year)
-                                with open(self.path_doc + ".json", "r") as read_file:
-                                    docs = json.load(read_file)
-                                score_list = []
-                                for doc in docs:
-                                    try:
-                                        score_list.append(doc[key_name]["score"]["novelty"])
-                                    except:
-                                        continue
+                                score_list = read_results(self.path_doc, [key_name + ".score.novelty"])[key_name + ".score.novelty"].dropna().tolist()
                                 df_temp = pd.DataFrame([np.mean(score_list)], columns=["Score_mean"])
                                 df_temp['Variable'], df_temp['Indicator'], df_temp['Year'] = [variable, indicator + "_" + str(time) + "_" + str(reu)+ "_restricted" + str(perc), year]
                                 self.df = pd.concat([self.df,df_temp], ignore_index=True)                           
@@ -707,11 +691,7 @@ class novelty_trend:
                         key_name = variable + "_" + indicator
                         for year in self.year_range:
                             self.path_doc= "Result/{}/{}/{}".format(indicator, variable, year)
-                            with open(self.path_doc + ".json", "r") as read_file:
-                                docs = json.load(read_file)
-                            score_list = []
-                            for doc in docs:
-                                score_list.append(doc[key_name]["score"]["novelty"])
+                            score_list = read_results(self.path_doc, [key_name + ".score.novelty"])[key_name + ".score.novelty"].tolist()
                             df_temp = pd.DataFrame([np.mean(np.ma.masked_invalid(score_list))], columns=["Score_mean"])
                             df_temp['Variable'], df_temp['Indicator'], df_temp["Year"] = [variable, indicator, year]
                             self.df = pd.concat([self.df,df_temp], ignore_index=True)        
@@ -939,8 +919,7 @@ class correlation_indicators:
     
     def get_info_mongo(self):
         
-        self.client = pymongo.MongoClient(self.client_name)
-        self.db = self.client[self.db_name]
+        self.db = get_database(self.client_name, self.db_name)
         
         
         
@@ -1123,8 +1102,7 @@ class correlation_indicators:
                 for embedding_entity in self.embedding_entities_shibayama:
                     for year in self.year_range:
                         self.path_doc= "Result/{}/{}".format(indicator, year)
-                        with open(self.path_doc + ".json", "r") as read_file:
-                            docs = json.load(read_file)   
+                        docs = list(iter_docs(self.path_doc))
                         score_list = []
                         for doc in docs:
                             try:
@@ -1138,8 +1116,7 @@ class correlation_indicators:
                 for embedding_entity in self.embedding_entities_authors:
                     for year in self.year_range:
                         self.path_doc= "Result/{}/{}".format(indicator, year)
-                        with open(self.path_doc + ".json", "r") as read_file:
-                            docs = json.load(read_file)   
+                        docs = list(iter_docs(self.path_doc))
                         score_list_intra = []
                         score_list_inter = []
                         for doc in docs:
@@ -1160,8 +1137,7 @@ class correlation_indicators:
                 for measure in self.disruptiveness_measures:
                     for year in self.year_range:
                         self.path_doc= "Result/Disruptiveness/{}".format(year)
-                        with open(self.path_doc + ".json", "r") as read_file:
-                            docs = json.load(read_file)   
+                        docs = list(iter_docs(self.path_doc))
                         score_list = []
                         for doc in docs:
                             try:
@@ -1176,24 +1152,13 @@ class correlation_indicators:
                             key_name = variable + "_" + indicator + "_" + str(time) + "_" + str(reu) + "_restricted" + str(perc)
                             for year in self.year_range:
                                 self.path_doc= "Result/{}/{}/{}".format(indicator, variable + "_" + str(time) + "_" + str(reu) + "_restricted" + str(perc) , year)
-                                with open(self.path_doc + ".json", "r") as read_file:
-                                    docs = json.load(read_file)
-                                score_list = []
-                                for doc in docs:
-                                    try:
-                                        score_list.append(doc[key_name]["score"]["novelty"])
-                                    except:
-                                        continue
+                                score_list = read_results(self.path_doc, [key_name + ".score.novelty"])[key_name + ".score.novelty"].dropna().tolist()
                                 self.corr[year][key_name] = score_list                  
                     else:                        
                         key_name = variable + "_" + indicator
                         for year in self.year_range:
                             self.path_doc= "Result/{}/{}/{}".format(indicator, variable, year)
-                            with open(self.path_doc + ".json", "r") as read_file:
-                                docs = json.load(read_file)
-                            score_list = []
-                            for doc in docs:
-                                score_list.append(doc[key_name]["score"]["novelty"])
+                            score_list = read_results(self.path_doc, [key_name + ".score.novelty"])[key_name + ".score.novelty"].tolist()
                             self.corr[year][key_name] = score_list 
         
         for year in self.year_range:
@@ -2,11 +2,686 @@ import os
 import re
 import tqdm
 import json
+import struct
+import shutil
 import pickle
-import pymongo
+import zipfile
+import hashlib
+import tempfile
 import itertools
 import numpy as np
-from scipy.sparse import lil_matrix
+from concurrent.futures import ProcessPoolExecutor
+from novelpy.utils.io_tools import get_doc_file, prefetch
+from novelpy.utils.backends import get_backend, MongoBackend
+from novelpy.utils.cache import get_artifact_key, is_fresh, load_meta, save_meta
+from scipy.sparse import lil_matrix, coo_matrix, csr_matrix, save_npz, load_npz, triu, diags
+
+# The first year of each pair is accumulated as FIRST_YEAR_BASE - year, so that the earliest year
+# is the largest value whatever the order in which the years are merged (see create_cooc.merge_first_pairs)
+FIRST_YEAR_BASE = 2**40
+
+def get_pairs(lengths):
+    '''
+    Description
+    -----------
+    Enumerate every combination of positions (i,j), i<j, inside each document of a batch
+    whose items have been flattened in a single array, in the order of itertools.combinations.
+
+    Parameters
+    ----------
+    lengths : np.array
+        number of items of each document in the batch
+
+    Returns
+    -------
+    seg : np.array
+        position of the document each pair belongs to
+    left : np.array
+        position in the flat array of the first item of each pair
+    right : np.array
+        position in the flat array of the second item of each pair
+
+    '''
+    lengths = np.asarray(lengths, dtype = np.int64)
+    offsets = np.cumsum(lengths) - lengths
+    n_items = int(lengths.sum())
+    # Number of items after each item in its own document
+    local_position = np.arange(n_items) - np.repeat(offsets, lengths)
+    n_after = np.repeat(lengths, lengths) - 1 - local_position
+    left = np.repeat(np.arange(n_items), n_after)
+    starts = np.cumsum(n_after) - n_after
+    right = left + np.arange(len(left)) - np.repeat(starts, n_after) + 1
+    seg = np.repeat(np.repeat(np.arange(len(lengths)), lengths), n_after)
+    return seg, left, right
+
+def batch_to_coo(indices, lengths, shape, dtype, self_loop):
+    '''
+    Description
+    -----------
+    Create the coocurence matrix of a batch of documents already mapped to integer indices
+
+    Parameters
+    ----------
+    indices : list
+        index of the items of every document in the batch, flattened
+    lengths : list
+        number of items of each document in the batch
+    shape : tuple
+        shape of the coocurence matrix
+    dtype : np.dtype
+        Type of the coocurence matrix
+    self_loop : bool
+        keep the diagonal on the coocurrence matrix
+
+    Returns
+    -------
+    scipy.sparse.coo_matrix
+        upper triangular coocurence matrix of the batch with duplicates summed
+
+    '''
+    indices = np.asarray(indices, dtype = np.int64)
+    _, left, right = get_pairs(lengths)
+    rows = np.minimum(indices[left], indices[right])
+    cols = np.maximum(indices[left], indices[right])
+    if self_loop == False:
+        keep = rows != cols
+        rows, cols = rows[keep], cols[keep]
+    cooc = coo_matrix((np.ones(len(rows), dtype = dtype), (rows, cols)), shape = shape)
+    cooc.sum_duplicates()
+    return cooc
+
+def incidence_from_indices(indices, lengths, n_items, dtype = np.uint32):
+    '''
+    Description
+    -----------
+    Create the incidence matrix X (documents x items) of documents already mapped to integer indices,
+    X[d,i] being the number of times item i is used by document d
+
+    Parameters
+    ----------
+    indices : list
+        index of the items of every document, flattened
+    lengths : list
+        number of items of each document
+    n_items : int
+        size of the vocabulary
+    dtype : np.dtype
+        Type of the incidence matrix
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+
+    '''
+    rows = np.repeat(np.arange(len(lengths)), np.asarray(lengths, dtype = np.int64))
+    cols = np.asarray(indices, dtype = np.int64)
+    return coo_matrix((np.ones(len(cols), dtype = dtype), (rows, cols)), shape = (len(lengths), n_items)).tocsr()
+
+def cooc_from_incidence(X, weighted_network, self_loop):
+    '''
+    Description
+    -----------
+    Compute the coocurence matrix of the documents of an incidence matrix as triu(X'X).
+    The off diagonal cells are the number of pairs of each combination. On the diagonal X'X holds
+    sum(X[d,i]**2) while a document using an item c times makes c(c-1)/2 pairs of this item,
+    so the diagonal is replaced by (diag(X'X) - column sums of X)/2
+
+    Parameters
+    ----------
+    X : scipy.sparse matrix
+        incidence matrix (documents x items) with counts
+    weighted_network : bool
+        allow a given document to make multiple time the same coocurrence. If False X is binarized
+    self_loop : bool
+        keep the diagonal on the coocurrence matrix
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        upper triangular coocurence matrix
+
+    '''
+    X = csr_matrix(X)
+    if weighted_network == False:
+        X = csr_matrix(((X.data != 0).astype(X.dtype), X.indices, X.indptr), shape = X.shape)
+    cooc = triu(X.T.tocsr().dot(X), format = "csr")
+    diagonal = cooc.diagonal()
+    if weighted_network and self_loop:
+        colsum = np.asarray(X.sum(axis = 0), dtype = diagonal.dtype).ravel()
+        # diag - (diag + colsum)/2 = (diag - colsum)/2, without negative values for unsigned types
+        cooc = cooc - diags((diagonal + colsum) // 2, format = "csr", dtype = cooc.dtype)
+    else:
+        cooc = cooc - diags(diagonal, format = "csr", dtype = cooc.dtype)
+    cooc.eliminate_zeros()
+    return cooc
+
+def load_incidence(path, year, n_items = None):
+    '''
+    Description
+    -----------
+    Load the incidence matrix of a year and the ids of its documents saved by create_cooc(incidence = True)
+
+    Parameters
+    ----------
+    path : str
+        folder of the yearly coocurence matrices
+    year : int
+        year to load
+    n_items : int, optional
+        size of the current vocabulary, the missing columns are treated as zeros
+
+    Returns
+    -------
+    X : scipy.sparse.csr_matrix
+        incidence matrix (documents x items)
+    ids : np.array
+        id of the document of each row
+
+    '''
+    X = load_matrix(path + "/incidence/{}".format(year))
+    if n_items and X.shape[1] != n_items:
+        X = X.tocsr()
+        X.resize((X.shape[0], n_items))
+    ids = np.load(path + "/incidence/{}_ids.npy".format(year), allow_pickle = True)
+    return X, ids
+
+def get_min_dtype(max_value, signed = False):
+    '''
+    Description
+    -----------
+    Narrowest integer type holding every value up to max_value (in absolute value if signed)
+
+    Parameters
+    ----------
+    max_value : int
+        largest value to store
+    signed : bool
+        negative values have to be stored too
+
+    Returns
+    -------
+    np.dtype
+
+    '''
+    dtypes = [np.int8, np.int16, np.int32, np.int64] if signed else [np.uint8, np.uint16, np.uint32, np.uint64]
+    for dtype in dtypes:
+        if max_value <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(dtypes[-1])
+
+def compact_matrix(x, float_dtype = None):
+    '''
+    Description
+    -----------
+    Convert a sparse matrix to csr with the narrowest safe types: integer data is stored with the
+    smallest integer type holding its maximum (uint8/uint16/uint32), float data with float_dtype if given,
+    and indices/indptr are int32 whenever the number of non zero values and the shape allow it
+
+    Parameters
+    ----------
+    x : scipy.sparse matrix
+        matrix to compact
+    float_dtype : np.dtype, optional
+        type of float data, e.g np.float32 for score matrices. Float data is left untouched if None
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+
+    '''
+    x = csr_matrix(x)
+    dtype = x.dtype
+    if np.issubdtype(x.dtype, np.integer) or x.dtype == bool:
+        low = int(x.data.min()) if x.nnz else 0
+        high = int(x.data.max()) if x.nnz else 0
+        dtype = get_min_dtype(max(high, -low), signed = low < 0)
+    elif np.issubdtype(x.dtype, np.floating) and float_dtype is not None:
+        dtype = np.dtype(float_dtype)
+    index_max = np.iinfo(np.int32).max
+    index_dtype = np.int32 if x.nnz <= index_max and max(x.shape) <= index_max else np.int64
+    return csr_matrix((x.data.astype(dtype, copy = False),
+                       x.indices.astype(index_dtype, copy = False),
+                       x.indptr.astype(index_dtype, copy = False)),
+                      shape = x.shape, copy = False)
+
+def add_matrices(x, y):
+    '''
+    Description
+    -----------
+    Sum two sparse matrices, promoting integer data to a wider type when the sum could overflow
+    (e.g two uint8 matrices saved with create_cooc(dtype = "auto"))
+
+    Parameters
+    ----------
+    x : scipy.sparse matrix
+    y : scipy.sparse matrix
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+
+    '''
+    dtype = np.promote_types(x.dtype, y.dtype)
+    if np.issubdtype(x.dtype, np.integer) and np.issubdtype(y.dtype, np.integer):
+        if not np.issubdtype(dtype, np.integer):
+            # uint64 and int64 are promoted to float64 by numpy
+            dtype = np.dtype(np.int64)
+        bound = 0
+        for m in [x, y]:
+            if m.nnz:
+                bound += max(abs(int(m.data.min())), abs(int(m.data.max())))
+        signed = np.issubdtype(dtype, np.signedinteger)
+        dtype = np.promote_types(dtype, get_min_dtype(bound, signed = signed))
+    return x.astype(dtype, copy = False).tocsr() + y.astype(dtype, copy = False).tocsr()
+
+def get_matrix_file(file):
+    '''
+    Description
+    -----------
+    Find the file holding a saved matrix whatever its format (.npz is preferred over .p)
+
+    Parameters
+    ----------
+    file : str
+        path to the matrix with or without its extension
+
+    Returns
+    -------
+    str
+        path to the existing file, None if the matrix was never saved
+
+    '''
+    base = re.sub(r'\.(p|npz)$', '', file)
+    for extension in [".npz", ".p"]:
+        if os.path.exists(base + extension):
+            return base + extension
+    return None
+
+def dump_matrix(x, file, matrix_format = "pickle"):
+    '''
+    Description
+    -----------
+    Save a sparse matrix either pickled (.p) or as an uncompressed .npz
+    holding the raw csr arrays, which can be memory mapped when loaded.
+    The file of the other format is removed so that it cannot shadow the new one
+
+    Parameters
+    ----------
+    x : scipy.sparse matrix
+        matrix to save
+    file : str
+        path to the matrix with or without its extension
+    matrix_format : str
+        "pickle" or "npz"
+
+    Returns
+    -------
+
+    '''
+    base = re.sub(r'\.(p|npz)$', '', file)
+    if matrix_format == "npz":
+        save_npz(base + ".npz", csr_matrix(x), compressed = False)
+        stale = base + ".p"
+    elif matrix_format == "pickle":
+        pickle.dump(x, open(base + ".p", "wb"))
+        stale = base + ".npz"
+    else:
+        raise ValueError("matrix_format must be 'pickle' or 'npz'")
+    if os.path.exists(stale):
+        os.remove(stale)
+
+def memmap_npz(file):
+    '''
+    Description
+    -----------
+    Open the arrays of an uncompressed .npz saved by dump_matrix without reading them:
+    each array is a copy-on-write np.memmap on its bytes inside the zip archive.
+    Compressed archives are loaded in memory with scipy.sparse.load_npz
+
+    Parameters
+    ----------
+    file : str
+        path to the .npz file
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+
+    '''
+    arrays = dict()
+    with zipfile.ZipFile(file) as archive, open(file, "rb") as f:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                return load_npz(file).tocsr()
+            key = info.filename[:-len(".npy")]
+            # Skip the local header of the member to reach the .npy file
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack("<HH", f.read(4))
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if key in ["data", "indices", "indptr"] and np.prod(shape) > 0:
+                arrays[key] = np.memmap(f, dtype = dtype, mode = "c", offset = f.tell(),
+                                        shape = shape, order = "F" if fortran_order else "C")
+            else:
+                arrays[key] = np.load(archive.open(info.filename), allow_pickle = False)
+    if arrays["format"].item() not in [b"csr", "csr"]:
+        return load_npz(file).tocsr()
+    return csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]),
+                      shape = tuple(arrays["shape"]), copy = False)
+
+def load_matrix(file, shape = None):
+    '''
+    Description
+    -----------
+    Load a sparse matrix saved by dump_matrix. Uncompressed .npz files are memory mapped
+    so the matrix is not copied in RAM; pickle files are still supported.
+    Matrices saved before the vocabulary was extended (see the append argument of create_cooc)
+    are smaller than the current vocabulary: give the current shape and the missing
+    trailing rows and columns are treated as zeros
+
+    Parameters
+    ----------
+    file : str
+        path to the matrix with or without its extension
+    shape : tuple, optional
+        shape of the current vocabulary
+
+    Returns
+    -------
+    scipy.sparse matrix
+
+    '''
+    found = get_matrix_file(file)
+    if found is None:
+        raise FileNotFoundError("No matrix saved in {}".format(file))
+    if found.endswith(".npz"):
+        x = memmap_npz(found)
+    else:
+        x = pickle.load(open(found, "rb"))
+    if shape and x.shape != shape:
+        x = x.tocsr()
+        x.resize(shape)
+    return x
+
+def dump_csr_parts(file, shape, indptr, data_file, indices_file, source_dtype, data_dtype, index_dtype, chunk_size = 2**22):
+    '''
+    Description
+    -----------
+    Write an uncompressed .npz holding a csr matrix, like dump_matrix(x, file, "npz"), from its indptr
+    and from its data and indices stored in raw binary files (indices as int64). The raw files are copied
+    by chunks so the matrix never has to be held in memory
+
+    Parameters
+    ----------
+    file : str
+        path to the matrix with or without its extension
+    shape : tuple
+        shape of the matrix
+    indptr : np.array
+        indptr of the csr matrix
+    data_file : str
+        raw binary file of the data
+    indices_file : str
+        raw binary file of the indices (int64)
+    source_dtype : np.dtype
+        type of the values in data_file
+    data_dtype : np.dtype
+        type of the saved data
+    index_dtype : np.dtype
+        type of the saved indices and indptr
+    chunk_size : int
+        number of values copied at once
+
+    Returns
+    -------
+
+    '''
+    base = re.sub(r'\.(p|npz)$', '', file)
+    with zipfile.ZipFile(base + ".npz", "w", compression = zipfile.ZIP_STORED, allowZip64 = True) as archive:
+        for key, source, source_type, dtype in [("indices", indices_file, np.int64, index_dtype),
+                                                ("data", data_file, source_dtype, data_dtype)]:
+            count = os.path.getsize(source) // np.dtype(source_type).itemsize
+            with archive.open(key + ".npy", "w", force_zip64 = True) as f, open(source, "rb") as raw:
+                np.lib.format.write_array_header_1_0(f, {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                                                         "fortran_order": False,
+                                                         "shape": (count,)})
+                while True:
+                    chunk = np.fromfile(raw, dtype = source_type, count = chunk_size)
+                    if len(chunk) == 0:
+                        break
+                    f.write(chunk.astype(dtype).tobytes())
+        for key, array in [("indptr", indptr.astype(index_dtype)), ("format", np.array("csr")), ("shape", np.array(shape))]:
+            with archive.open(key + ".npy", "w", force_zip64 = True) as f:
+                np.lib.format.write_array(f, array, allow_pickle = False)
+    if os.path.exists(base + ".p"):
+        os.remove(base + ".p")
+
+def load_matrix_block(file, start, stop, shape = None):
+    '''
+    Description
+    -----------
+    Load the rows start to stop (excluded) of a matrix saved by dump_matrix.
+    With a .npz file only the values of these rows are read from the memory mapped arrays,
+    e.g. to go through a matrix built with create_cooc(block_size) one block at a time
+
+    Parameters
+    ----------
+    file : str
+        path to the matrix with or without its extension
+    start : int
+        first row
+    stop : int
+        row after the last one
+    shape : tuple, optional
+        shape of the current vocabulary
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        matrix of shape (stop - start, number of columns)
+
+    '''
+    x = load_matrix(file)
+    n_cols = shape[1] if shape else x.shape[1]
+    if not shape:
+        stop = min(stop, x.shape[0])
+    block = x[min(start, x.shape[0]):min(stop, x.shape[0])].tocsr()
+    if block.shape != (stop - start, n_cols):
+        block.resize((stop - start, n_cols))
+    return block
+
+def get_cooc_years(path):
+    '''
+    Description
+    -----------
+    Years that have a saved coocurence matrix in a folder
+
+    Parameters
+    ----------
+    path : str
+        folder of the yearly matrices
+
+    Returns
+    -------
+    list
+        sorted years
+
+    '''
+    years = set()
+    for file in os.listdir(path):
+        match = re.match(r'^(-?[0-9]+)\.(p|npz)$', file)
+        if match:
+            years.add(int(match.group(1)))
+    return sorted(years)
+
+def load_window_sum(path, years, shape = None):
+    '''
+    Description
+    -----------
+    Sum of the yearly matrices of a window of years computed from the cumulative
+    matrices C[t] = sum of the years <= t saved by create_cooc(cumulative = True):
+    the sum over [a, b] is C[b] - C[a-1]
+
+    Parameters
+    ----------
+    path : str
+        folder of the yearly matrices
+    years : list
+        consecutive years to sum
+    shape : tuple, optional
+        shape of the current vocabulary
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        sum of the matrices, None if the cumulative matrices are missing, stale or do not cover the window
+
+    '''
+    path_cumulative = path + "/cumulative"
+    if not os.path.exists(path_cumulative + "/years.json"):
+        return None
+    built = json.load(open(path_cumulative + "/years.json", "r"))
+    if built != get_cooc_years(path):
+        return None
+    years = sorted(years)
+    if not years or years[0] not in built or years[-1] not in built:
+        return None
+    first = built.index(years[0])
+    last = built.index(years[-1])
+    if built[first:last+1] != years:
+        return None
+    # A yearly matrix rebuilt after the cumulative matrices makes them stale
+    for year in built[:last+1]:
+        cumulative_file = get_matrix_file(path_cumulative + "/{}".format(year))
+        if cumulative_file is None:
+            return None
+        if os.path.getmtime(get_matrix_file(path + "/{}".format(year))) > os.path.getmtime(cumulative_file):
+            return None
+    cooc = load_matrix(path_cumulative + "/{}".format(built[last]), shape)
+    if first > 0:
+        previous = load_matrix(path_cumulative + "/{}".format(built[first-1]), shape)
+        # C[b] >= C[a-1] everywhere so unsigned data cannot underflow
+        cooc = cooc - previous.astype(np.promote_types(cooc.dtype, previous.dtype), copy = False)
+        cooc.eliminate_zeros()
+    return cooc
+
+def load_first_year(path, shape = None):
+    '''
+    Description
+    -----------
+    Load the matrix of the first year each pair was counted in, saved by create_cooc(first_year = True)
+
+    Parameters
+    ----------
+    path : str
+        folder of the yearly matrices
+    shape : tuple, optional
+        shape of the current vocabulary
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        first year of each pair (upper triangular), None if it is missing or older than a yearly matrix
+
+    '''
+    if not os.path.exists(path + "/first_year.json"):
+        return None
+    built = json.load(open(path + "/first_year.json", "r"))
+    if built != get_cooc_years(path):
+        return None
+    file = get_matrix_file(path + "/first_year_pairs")
+    if file is None:
+        return None
+    for year in built:
+        if os.path.getmtime(get_matrix_file(path + "/{}".format(year))) > os.path.getmtime(file):
+            return None
+    return load_matrix(file, shape)
+
+def load_past_pairs(path, year, shape = None):
+    '''
+    Description
+    -----------
+    Pairs counted in at least one year before year, from the first year of each pair
+    instead of the sum of all the past matrices
+
+    Parameters
+    ----------
+    path : str
+        folder of the yearly matrices
+    year : int
+        pairs first counted in this year or after are left out
+    shape : tuple, optional
+        shape of the current vocabulary
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        1 for the pairs already counted, None if the first years are missing or stale
+
+    '''
+    first = load_first_year(path, shape)
+    if first is None:
+        return None
+    first = first.tocsr()
+    past = csr_matrix(((first.data < year).astype(np.uint8), first.indices, first.indptr), shape = first.shape)
+    past.eliminate_zeros()
+    return past
+
+def init_cooc_worker(params, name2index, signatures = None):
+    '''
+    Description
+    -----------
+    Initialize a worker of the process pool with its own create_cooc instance
+    (and its own MongoDB connection) and the vocabulary broadcast by the parent process
+
+    Parameters
+    ----------
+    params : dict
+        arguments given to create_cooc by the parent process
+    name2index : dict
+        vocabulary built by the parent process
+    signatures : dict, optional
+        signatures of the documents of each year already computed by the parent process
+
+    Returns
+    -------
+
+    '''
+    global cooc_worker
+    cooc_worker = create_cooc(**params)
+    cooc_worker.name2index = name2index
+    cooc_worker.signatures = dict(signatures or dict())
+    cooc_worker.item_list = sorted(name2index, key = name2index.get)
+
+def populate_cooc_year(year):
+    '''
+    Description
+    -----------
+    Create and save the coocurence matrix of a year in a worker of the process pool
+
+    Parameters
+    ----------
+    year : int
+        year to process
+
+    Returns
+    -------
+    int
+        year processed
+    dict
+        with first_year, first year of the pairs of the year in each variant, merged by the parent process
+
+    '''
+    if cooc_worker.first_year:
+        cooc_worker.first_pairs = dict()
+    cooc_worker.create_matrix()
+    cooc_worker.populate_cooc(year)
+    cooc_worker.save_matrix(year)
+    return year, cooc_worker.first_pairs
 
 class create_cooc:
     
@@ -20,7 +695,25 @@ class create_cooc:
                  weighted_network = False,
                  self_loop = False,
                  client_name = None,
-                 db_name = None):
+                 db_name = None,
+                 vectorized = False,
+                 batch_size = 10000,
+                 single_pass = False,
+                 n_jobs = 1,
+                 append = False,
+                 matrix_format = "pickle",
+                 cumulative = False,
+                 variants = None,
+                 item_stats = False,
+                 min_count = None,
+                 max_vocab = None,
+                 rare_item = None,
+                 block_size = None,
+                 first_year = False,
+                 incidence = False,
+                 id_var = None,
+                 prefetch = 0,
+                 full_signature = False):
         '''
         Description
         -----------
@@ -39,8 +732,10 @@ class create_cooc:
             name of the collection where your data is
         time_window: range
             range of year you will work on
-        dtype: np.dtype
-            Type of coocurence matrix, basis is uint16 but can be changed if numbers are to high
+        dtype: np.dtype or str
+            Type of coocurence matrix, basis is uint32 but can be changed if numbers are to high.
+            With "auto" the counts are accumulated as int64 and each matrix is saved with the narrowest
+            type holding its maximum (uint8/uint16/uint32) and int32 indices when possible
         weighted_network : bool
             allow a given document to make multiple time the same coocurrence
         self_loop : bool
@@ -49,6 +744,64 @@ class create_cooc:
             name of the MongoDB client
         db_name : str
             name of the MongoDB where your data is           
+        vectorized : bool
+            map the items of each document to their index once and count the pairs of a batch
+            of documents with numpy arrays instead of updating the matrix one pair at a time
+        batch_size : int
+            number of documents per batch when vectorized is True
+        single_pass : bool
+            read the corpus only once: the vocabulary grows while the pairs are counted (vectorized)
+            and the matrices are remapped to the sorted vocabulary at the end.
+            The vocabulary is then restricted to the items found in time_window
+        n_jobs : int
+            number of processes building the yearly matrices once the vocabulary is known.
+            Not used when single_pass is True
+        append : bool
+            if a vocabulary already exists in the output folder, only build the years of time_window
+            that have no matrix yet or whose input changed since, and give the new items the
+            next free indices. Existing matrices are left untouched and are padded with zeros when loaded
+        matrix_format : str
+            "pickle" or "npz". npz files hold the raw csr arrays uncompressed and are memory mapped when loaded
+        cumulative : bool
+            also save the cumulative matrices C[t] = sum of the years <= t in a "cumulative" folder.
+            The sum of any window of years is then computed with two loads and one subtraction
+        variants : list or str
+            list of (weighted_network, self_loop) tuples, or "all" for the four of them. All the variants
+            are built from the same read of the corpus with a shared vocabulary and each one is saved
+            in its usual folder. weighted_network and self_loop are then ignored and vectorized is forced
+        item_stats : bool
+            also count the occurrences of each item and find the first year it is used in while building
+            the vocabulary. Both are saved in item_stats.p next to name2index.p. Not used when single_pass or append is True
+        min_count : int
+            drop the items used less than min_count times from the vocabulary before indexing
+        max_vocab : int
+            keep only the max_vocab most used items in the vocabulary
+        rare_item : str
+            name of the item replacing the dropped items in the documents. If None the dropped items are skipped.
+            The pruning statistics are saved in pruning.json next to name2index.p.
+            min_count and max_vocab cannot be used with single_pass or append
+        block_size : int
+            out-of-core mode for vocabularies too large for memory: the pairs counted in each batch are spilled
+            to disk by block of block_size rows during the scan, then each block is summed and appended to the saved
+            matrix one at a time. The matrices are saved as npz (memory mapped when loaded, see load_matrix_block
+            to load one block) and vectorized is forced
+        first_year : bool
+            also save the first year each pair was counted in (first_year_pairs, upper triangular sparse matrix)
+            and the first year each item was used in (first_year_items.npy, -1 if never), so that
+            "was this pair used before year t" is a lookup instead of a sum of all the past matrices.
+            Both are accumulated while the documents are read, the items of each year being saved in items_by_year
+        incidence : bool
+            also save the incidence matrix X (documents x items, with counts) of each year in an "incidence" folder,
+            with the id of the document of each row, and compute the coocurence matrices as triu(X'X).
+            Cannot be used with block_size
+        id_var : str
+            field where the id of the document is, needed by incidence
+        prefetch : int
+            number of years whose documents are read ahead by a background thread while the current year is processed.
+            The documents of these years are held in memory. 0 reads each year when it is needed
+        full_signature : bool
+            with a database, sign the documents of each year by the sha1 of their items instead of their number
+            and their largest id, so that the documents updated in place are detected. Each year is then read once more
         '''
         
         self.item_list = []
@@ -57,42 +810,118 @@ class create_cooc:
         self.year_var = year_var
         self.collection_name = collection_name
         self.dtype = dtype
+        # Type used while counting, matrices are compacted when saved if dtype is "auto"
+        self.auto_dtype = isinstance(dtype, str) and dtype == "auto"
+        self.build_dtype = np.int64 if self.auto_dtype else dtype
         self.weighted_network = weighted_network
         self.self_loop = self_loop
         self.client_name = client_name
         self.db_name = db_name
+        self.vectorized = vectorized
+        self.batch_size = batch_size
+        self.single_pass = single_pass
+        self.n_jobs = n_jobs
+        self.append = append
+        self.matrix_format = matrix_format
+        self.cumulative = cumulative
+        self.item_stats = item_stats
+        self.min_count = min_count
+        self.max_vocab = max_vocab
+        self.rare_item = rare_item
+        self.block_size = block_size
+        self.spill_dir = None
+        self.first_year = first_year
+        self.incidence = incidence
+        self.prefetch = prefetch
+        self.id_var = id_var
+        self.full_signature = full_signature
+        if incidence and not id_var:
+            raise ValueError("incidence needs the id of the documents (id_var)")
+        if incidence and block_size:
+            raise ValueError("incidence cannot be used with block_size")
+        if incidence:
+            self.vectorized = True
+        if block_size:
+            self.vectorized = True
+            self.matrix_format = "npz"
+        self.pruned = bool(min_count or max_vocab)
+        if self.pruned and (single_pass or append):
+            raise ValueError("min_count and max_vocab cannot be used with single_pass or append")
+        self.count_items = item_stats or self.pruned
+        self.item_count = dict()
+        self.item_first_year = dict()
+        # Signatures of the documents of each year and hashes of the vocabulary used in the keys of the matrices
+        self.signatures = dict()
+        self.vocabulary_hashes = dict()
+        # With first_year, first year of the pairs of each variant merged by save_matrix (None while they are not recorded),
+        # years merged and indices of the items of the year being read
+        self.first_pairs = None
+        self.first_years = set()
+        self.year_items = None
         
-        type1 = 'weighted_network' if self.weighted_network else 'unweighted_network'
-        type2 = 'self_loop' if self.self_loop else 'no_self_loop'
-        
-        if client_name:
-            self.client = pymongo.MongoClient(self.client_name)
-            self.db = self.client[self.db_name]
-            self.collection = self.db[self.collection_name]
+        if variants == "all":
+            variants = [(True, True), (True, False), (False, True), (False, False)]
+        if variants:
+            self.variants = [(bool(weighted), bool(loop)) for weighted, loop in variants]
+            self.weighted_network, self.self_loop = self.variants[0]
+            if len(self.variants) > 1:
+                self.vectorized = True
         else:
+            self.variants = [(self.weighted_network, self.self_loop)]
+        
+        # MongoDB, SQLite file or JSON files depending on client_name
+        self.backend = get_backend(client_name, db_name, collection_name, id_var, year_var)
+        if isinstance(self.backend, MongoBackend):
+            self.db = self.backend.db
+            self.collection = self.backend.collection
+        if not client_name:
             self.collection_name = collection_name
             self.path_input = "Data/docs/{}".format(self.collection_name)
         
-        self.path_output = "Data/cooc/{}/{}_{}".format(var,type1,type2)
-        if not os.path.exists(self.path_output):
-            os.makedirs(self.path_output)
+        self.paths_output = dict()
+        for weighted, loop in self.variants:
+            type1 = 'weighted_network' if weighted else 'unweighted_network'
+            type2 = 'self_loop' if loop else 'no_self_loop'
+            self.paths_output[(weighted, loop)] = "Data/cooc/{}/{}_{}".format(var,type1,type2)
+            if not os.path.exists(self.paths_output[(weighted, loop)]):
+                os.makedirs(self.paths_output[(weighted, loop)])
+        self.path_output = self.paths_output[self.variants[0]]
         
         if time_window:
             self.time_window = time_window
         else:
-            if client_name:
-                self.time_window = self.db[collection_name].distinct(self.year_var) 
-            else:
-                self.time_window = [int(re.sub('.json','',file)) for file in os.listdir("Data/docs/{}/".format(collection_name))] 
-            
-            
+            self.time_window = self.backend.get_years()
+        
+        # Arguments needed to rebuild the instance in the workers of the process pool
+        self.params = dict(var = var,
+                           sub_var = sub_var,
+                           year_var = year_var,
+                           collection_name = collection_name,
+                           time_window = list(self.time_window),
+                           dtype = dtype,
+                           weighted_network = weighted_network,
+                           self_loop = self_loop,
+                           client_name = client_name,
+                           db_name = db_name,
+                           vectorized = vectorized,
+                           batch_size = batch_size,
+                           matrix_format = matrix_format,
+                           variants = self.variants,
+                           min_count = min_count,
+                           max_vocab = max_vocab,
+                           rare_item = rare_item,
+                           block_size = block_size,
+                           incidence = incidence,
+                           id_var = id_var,
+                           first_year = first_year,
+                           full_signature = full_signature)
             
     def save_matrix(self,year):
         '''
         Description
         -----------
         Convert the sparse lilmatrix to csr (easier to do 2000+2001)
-        and save the sparse matrix to a pickle file
+        and save the sparse matrix of each variant to a pickle or npz file
         
         Parameters
         ----------
@@ -101,16 +930,285 @@ class create_cooc:
         -------
 
         ''' 
-        self.x = self.x.tocsr()
-        pickle.dump( self.x, open( self.path_output + "/{}.p".format(year), "wb" ) )
+        self.save_year_items(year)
+        if self.spill_dir is not None:
+            # Out-of-core mode: the pairs counted by get_combi_vectorized are on disk
+            for variant in self.variants:
+                self.merge_spill(variant, self.paths_output[variant] + "/{}".format(year), year)
+            shutil.rmtree(self.spill_dir)
+            self.spill_dir = None
+            self.save_matrix_meta(year)
+            return
+        if len(self.variants) == 1:
+            self.xs = {self.variants[0]: self.x}
+        for variant in self.variants:
+            if self.auto_dtype:
+                self.xs[variant] = compact_matrix(self.xs[variant])
+            else:
+                self.xs[variant] = self.xs[variant].tocsr()
+            dump_matrix(self.xs[variant], self.paths_output[variant] + "/{}".format(year), self.matrix_format)
+            if self.first_pairs is not None:
+                x = self.xs[variant].tocoo()
+                self.add_first_pairs(variant, year, x.row[x.data != 0], x.col[x.data != 0])
+        self.x = self.xs[self.variants[0]]
+        if self.incidence:
+            self.save_incidence(year)
+        self.save_matrix_meta(year)
+
+    def add_year_items(self, indices):
+        '''
+        Description
+        -----------
+        Keep the indices of items read in the documents of the year, with first_year.
+        The items of the documents with a single item are kept too
+
+        Parameters
+        ----------
+        indices : list
+            indices of the items of some documents
+
+        Returns
+        -------
+
+        '''
+        if self.first_year:
+            self.year_items.append(np.unique(np.asarray(indices, dtype = np.int64)))
+
+    def save_year_items(self, year):
+        '''
+        Description
+        -----------
+        Save the indices of the items used in the year (items_by_year/{year}.npy in each variant) with first_year
+
+        Parameters
+        ----------
+        year : int
+            year of the documents read
+
+        Returns
+        -------
+
+        '''
+        if not self.first_year or self.year_items is None:
+            return
+        items = np.unique(np.concatenate(self.year_items + [np.zeros(0, dtype = np.int64)]))
+        for path_output in self.paths_output.values():
+            if not os.path.exists(path_output + "/items_by_year"):
+                os.makedirs(path_output + "/items_by_year")
+            np.save(path_output + "/items_by_year/{}.npy".format(year), items.astype(np.int32))
+        self.year_items = None
+
+    def add_first_pairs(self, variant, year, rows, cols):
+        '''
+        Description
+        -----------
+        Merge the pairs counted in a year into the first year of each pair of a variant
+
+        Parameters
+        ----------
+        variant : tuple
+            (weighted_network, self_loop)
+        year : int
+            year of the pairs
+        rows : np.array
+        cols : np.array
+            indices of the pairs
+
+        Returns
+        -------
+
+        '''
+        n = len(self.name2index)
+        pairs = csr_matrix((np.full(len(rows), FIRST_YEAR_BASE - year, dtype = np.int64), (rows, cols)), shape = (n, n))
+        # Duplicated pairs are summed by csr_matrix
+        pairs.data[:] = FIRST_YEAR_BASE - year
+        self.merge_first_pairs({variant: pairs})
+        self.first_years.add(year)
+
+    def merge_first_pairs(self, first_pairs):
+        '''
+        Description
+        -----------
+        Merge first years of pairs (FIRST_YEAR_BASE - year) into the ones of this instance, keeping the earliest year
+
+        Parameters
+        ----------
+        first_pairs : dict
+            first years of the pairs of each variant, e.g computed by a worker of the process pool
+
+        Returns
+        -------
+
+        '''
+        n = len(self.name2index)
+        for variant, pairs in first_pairs.items():
+            first = self.first_pairs.get(variant)
+            if pairs.shape != (n, n):
+                # Vocabulary grown since (append)
+                pairs = pairs.copy()
+                pairs.resize((n, n))
+            if first is None:
+                self.first_pairs[variant] = pairs
+                continue
+            if first.shape != (n, n):
+                first.resize((n, n))
+            self.first_pairs[variant] = first.maximum(pairs)
+
+    def get_year_signatures(self, year):
+        '''
+        Description
+        -----------
+        Signature of the documents of a year, computed once and shared by the keys of every variant:
+        the signature of the json file (its sha1 is only computed again if the file was written since the last meta file)
+        or, with a database, the number of documents of the year and their largest id (the sha1 of their items
+        with full_signature), see Backend.get_year_signatures
+        
+        Parameters
+        ----------
+        year : int
+            year of the documents
+
+        Returns
+        -------
+        dict
+            signatures to give to get_artifact_key
+
+        '''
+        if year not in self.signatures:
+            meta = None if self.client_name else load_meta(self.path_output + "/{}".format(year))
+            self.signatures[year] = self.backend.get_year_signatures(year, meta["inputs"] if meta else None,
+                                                                     self.full_signature, {self.var: 1, "_id": 0})
+        return self.signatures[year]
+
+    def get_vocabulary_hash(self, n_items):
+        '''
+        Description
+        -----------
+        sha1 of the first n_items items of the vocabulary in the order of their index.
+        A matrix stays valid when the vocabulary is extended (append) as long as its first n_items items did not move
+        
+        Parameters
+        ----------
+        n_items : int
+            number of items of the vocabulary when the matrix was built
+
+        Returns
+        -------
+        str
+
+        '''
+        if n_items not in self.vocabulary_hashes:
+            names = sorted(self.name2index, key = self.name2index.get)[:n_items]
+            self.vocabulary_hashes[n_items] = hashlib.sha1(json.dumps(names, default = str).encode()).hexdigest()
+        return self.vocabulary_hashes[n_items]
+
+    def get_matrix_key(self, year, variant, n_items = None):
+        '''
+        Description
+        -----------
+        Key of the matrix of a year in a variant: hash of every parameter changing the saved matrix, of the vocabulary
+        and of the documents of the year (see novelpy.utils.cache)
+        
+        Parameters
+        ----------
+        year : int
+            year of the matrix
+        variant : tuple
+            (weighted_network, self_loop)
+        n_items : int, optional
+            size of the vocabulary the matrix was built with, the current one by default
+
+        Returns
+        -------
+        artifact : str
+            path to the matrix without its extension
+        params : dict
+        key : str
+        signatures : dict
+
+        '''
+        artifact = self.paths_output[variant] + "/{}".format(year)
+        if n_items is None:
+            n_items = len(self.name2index)
+        params = dict(var = self.var,
+                      sub_var = self.sub_var,
+                      year_var = self.year_var,
+                      collection_name = self.collection_name,
+                      db_name = self.db_name,
+                      year = year,
+                      weighted_network = variant[0],
+                      self_loop = variant[1],
+                      dtype = "auto" if self.auto_dtype else np.dtype(self.dtype).name,
+                      matrix_format = self.matrix_format,
+                      min_count = self.min_count,
+                      max_vocab = self.max_vocab,
+                      rare_item = self.rare_item,
+                      incidence = self.incidence,
+                      id_var = self.id_var,
+                      n_items = n_items,
+                      vocabulary = self.get_vocabulary_hash(n_items))
+        key, signatures = get_artifact_key(artifact, params, [], self.get_year_signatures(year))
+        return artifact, params, key, signatures
+
+    def save_matrix_meta(self, year):
+        '''
+        Description
+        -----------
+        Save the key of the matrix of the year next to it in each variant
+        
+        Parameters
+        ----------
+        year : int
+            year of the matrix
+
+        Returns
+        -------
+
+        '''
+        for variant in self.variants:
+            artifact, params, key, signatures = self.get_matrix_key(year, variant)
+            save_meta(artifact, get_matrix_file(artifact), key, params, signatures)
+
+    def save_incidence(self, year):
+        '''
+        Description
+        -----------
+        Save the incidence matrix of the year and the ids of its documents in the folder of each variant
+        
+        Parameters
+        ----------
+        year : int
+            year of the documents
+
+        Returns
+        -------
+
+        '''
+        X = compact_matrix(self.X) if self.auto_dtype else self.X
+        for path_output in self.paths_output.values():
+            if not os.path.exists(path_output + "/incidence"):
+                os.makedirs(path_output + "/incidence")
+            dump_matrix(X, path_output + "/incidence/{}".format(year), self.matrix_format)
+            np.save(path_output + "/incidence/{}_ids.npy".format(year), self.doc_ids)
+            json.dump({"var": self.var, "sub_var": self.sub_var, "id_var": self.id_var},
+                      open(path_output + "/incidence/meta.json", "w"))
 
     def get_combi(self, docs):
+        if self.vectorized:
+            self.get_combi_vectorized(docs)
+            return
+        self.year_items = []
+        year_indices = []
         for doc in tqdm.tqdm(docs, desc = "Populate matrix"):
             try:
                 items = doc[self.var]
             except:
                 continue
             items = [item[self.sub_var] for item in items]
+            if self.pruned:
+                items = self.filter_items(items)
+            if self.first_year:
+                year_indices += [self.name2index[item] for item in items]
             if self.weighted_network == False:
                 self.combis = itertools.combinations(set(items), r=2)
             else:
@@ -120,21 +1218,286 @@ class create_cooc:
                 ind_1 = combi[0]
                 ind_2 = combi[1]
                 self.x[ind_1,ind_2] += 1              
+        self.add_year_items(year_indices)
         
         if self.self_loop == False:
             self.x.setdiag(0)
+
+    def get_combi_vectorized(self, docs, grow_vocabulary = False):
+        '''
+        Description
+        -----------
+        Same as get_combi but the pairs of a batch of documents are generated as numpy arrays.
+        Each batch is reduced to a COO matrix and the batches are summed to a CSR matrix once per year.
+        The pairs are generated once for the weighted variants and once for the unweighted ones,
+        and the variants without self loop drop the diagonal of the same pairs (see self.xs).
+        With block_size the batches are spilled to disk instead and merged by save_matrix.
+
+        Parameters
+        ----------
+        docs : iterable
+            documents of the year
+        grow_vocabulary : bool
+            give the next free index to items missing from self.name2index instead of failing
+
+        Returns
+        -------
+
+        '''
+        if self.incidence:
+            self.get_combi_incidence(docs, grow_vocabulary)
+            return
+        self.year_items = []
+        weightings = sorted(set(weighted for weighted, loop in self.variants))
+        # The diagonal is only kept if one of the variants needs it
+        keep_diagonal = {weighted: (weighted, True) in self.variants for weighted in weightings}
+        self.keep_diagonal = keep_diagonal
+        if self.block_size:
+            self.spill_dir = tempfile.mkdtemp(prefix = "spill_", dir = self.path_output)
+        batches = {weighted: [] for weighted in weightings}
+        indices = {weighted: [] for weighted in weightings}
+        lengths = {weighted: [] for weighted in weightings}
+        n_docs = 0
+        for doc in tqdm.tqdm(docs, desc = "Populate matrix"):
+            try:
+                items = doc[self.var]
+            except:
+                continue
+            items = [item[self.sub_var] for item in items]
+            if self.pruned:
+                items = self.filter_items(items)
+            if grow_vocabulary:
+                doc_indices = [self.name2index.setdefault(item, len(self.name2index)) for item in items]
+            else:
+                doc_indices = [self.name2index[item] for item in items]
+            for weighted in weightings:
+                weighted_indices = doc_indices if weighted else list(set(doc_indices))
+                indices[weighted] += weighted_indices
+                lengths[weighted].append(len(weighted_indices))
+            n_docs += 1
+            if n_docs % self.batch_size == 0:
+                self.flush_batches(batches, indices, lengths)
+        shape = (len(self.name2index), len(self.name2index))
+        if n_docs % self.batch_size:
+            self.flush_batches(batches, indices, lengths)
+        if self.block_size:
+            self.xs = None
+            self.x = None
+            return
+
+        self.xs = dict()
+        for weighted in weightings:
+            if batches[weighted]:
+                rows = np.concatenate([batch.row for batch in batches[weighted]])
+                cols = np.concatenate([batch.col for batch in batches[weighted]])
+                data = np.concatenate([batch.data for batch in batches[weighted]])
+            else:
+                rows = cols = np.array([], dtype = np.int64)
+                data = np.array([], dtype = self.build_dtype)
+            for loop in [True, False]:
+                if (weighted, loop) not in self.variants:
+                    continue
+                if loop == False and keep_diagonal[weighted]:
+                    keep = rows != cols
+                    x = coo_matrix((data[keep], (rows[keep], cols[keep])), shape = shape)
+                else:
+                    x = coo_matrix((data, (rows, cols)), shape = shape)
+                self.xs[(weighted, loop)] = x.tocsr()
+        self.x = self.xs[self.variants[0]]
         
-    def populate_cooc(self, year):
+    def get_combi_incidence(self, docs, grow_vocabulary = False):
+        '''
+        Description
+        -----------
+        Build the incidence matrix X of the documents and derive the coocurence matrix of each variant as triu(X'X)
 
-        if self.client_name:
-            docs = self.collection.find({self.year_var:year}, no_cursor_timeout=True)
-        else:
+        Parameters
+        ----------
+        docs : iterable
+            documents of the year
+        grow_vocabulary : bool
+            give the next free index to items missing from self.name2index instead of failing
+
+        Returns
+        -------
+
+        '''
+        indices = []
+        lengths = []
+        ids = []
+        for doc in tqdm.tqdm(docs, desc = "Populate incidence matrix"):
             try:
-                with open(self.path_input + "/{}.json".format(year), 'r') as infile:
-                    docs = json.load(infile)
-            except Exception as e:
-                docs = [] 
-        self.get_combi(docs)
+                items = doc[self.var]
+            except:
+                continue
+            items = [item[self.sub_var] for item in items]
+            if self.pruned:
+                items = self.filter_items(items)
+            if grow_vocabulary:
+                indices += [self.name2index.setdefault(item, len(self.name2index)) for item in items]
+            else:
+                indices += [self.name2index[item] for item in items]
+            lengths.append(len(items))
+            ids.append(doc[self.id_var])
+        self.X = incidence_from_indices(indices, lengths, len(self.name2index), self.build_dtype)
+        self.doc_ids = np.array(ids)
+        self.year_items = []
+        self.add_year_items(indices)
+        self.xs = {variant: cooc_from_incidence(self.X, *variant) for variant in self.variants}
+        self.x = self.xs[self.variants[0]]
+
+    def flush_batches(self, batches, indices, lengths):
+        '''
+        Description
+        -----------
+        Count the pairs of the documents waiting in indices and lengths. The COO matrix of the batch
+        is added to batches, or spilled to disk with block_size, and indices and lengths are emptied
+
+        Parameters
+        ----------
+        batches : dict
+            COO matrices of the previous batches by weighting
+        indices : dict
+            flattened indices of the documents of the batch by weighting
+        lengths : dict
+            number of items of each document of the batch by weighting
+
+        Returns
+        -------
+
+        '''
+        shape = (len(self.name2index), len(self.name2index))
+        # Every item of the batch, including the ones of the documents with a single item
+        self.add_year_items(indices[min(batches)])
+        for weighted in batches:
+            batch = batch_to_coo(indices[weighted], lengths[weighted], shape,
+                                 self.build_dtype, self.keep_diagonal[weighted])
+            if self.block_size:
+                self.spill_batch(weighted, batch)
+            else:
+                batches[weighted].append(batch)
+            indices[weighted] = []
+            lengths[weighted] = []
+
+    def spill_batch(self, weighted, batch):
+        '''
+        Description
+        -----------
+        Append the pairs of a batch to the spill file of the block of their row
+
+        Parameters
+        ----------
+        weighted : bool
+            weighting of the batch
+        batch : scipy.sparse.coo_matrix
+            coocurence matrix of the batch
+
+        Returns
+        -------
+
+        '''
+        spill_dtype = np.dtype([("row", np.int64), ("col", np.int64), ("data", self.build_dtype)])
+        blocks = batch.row // self.block_size
+        order = np.argsort(blocks, kind = "stable")
+        blocks = blocks[order]
+        records = np.empty(len(order), dtype = spill_dtype)
+        records["row"] = batch.row[order]
+        records["col"] = batch.col[order]
+        records["data"] = batch.data[order]
+        starts = np.flatnonzero(np.r_[True, blocks[1:] != blocks[:-1]]) if len(blocks) else []
+        for start, stop in zip(starts, list(starts[1:]) + [len(blocks)]):
+            spill = os.path.join(self.spill_dir, "{}_{}.bin".format(int(weighted), blocks[start]))
+            with open(spill, "ab") as f:
+                records[start:stop].tofile(f)
+
+    def merge_spill(self, variant, file, year = None):
+        '''
+        Description
+        -----------
+        Sum the spilled pairs of each block of rows and write the blocks one after the other
+        to an uncompressed .npz, so that only one block is in memory at a time
+
+        Parameters
+        ----------
+        variant : tuple
+            (weighted_network, self_loop) of the matrix
+        file : str
+            path to the saved matrix
+        year : int, optional
+            year of the matrix, its pairs are merged into the first years of the pairs with first_year
+
+        Returns
+        -------
+
+        '''
+        weighted, loop = variant
+        pair_rows = []
+        pair_cols = []
+        n = len(self.name2index)
+        spill_dtype = np.dtype([("row", np.int64), ("col", np.int64), ("data", self.build_dtype)])
+        drop_diagonal = loop == False and self.keep_diagonal[weighted]
+        indptr = np.zeros(n + 1, dtype = np.int64)
+        nnz = 0
+        high = 0
+        data_file = os.path.join(self.spill_dir, "data.tmp")
+        indices_file = os.path.join(self.spill_dir, "indices.tmp")
+        with open(data_file, "wb") as fd, open(indices_file, "wb") as fi:
+            for start in range(0, n, self.block_size):
+                stop = min(n, start + self.block_size)
+                spill = os.path.join(self.spill_dir, "{}_{}.bin".format(int(weighted), start // self.block_size))
+                if os.path.exists(spill):
+                    records = np.fromfile(spill, dtype = spill_dtype)
+                else:
+                    records = np.empty(0, dtype = spill_dtype)
+                if drop_diagonal:
+                    records = records[records["row"] != records["col"]]
+                block = coo_matrix((records["data"], (records["row"] - start, records["col"])),
+                                   shape = (stop - start, n)).tocsr()
+                block.data.tofile(fd)
+                block.indices.astype(np.int64).tofile(fi)
+                if year is not None and self.first_pairs is not None:
+                    pairs = block.tocoo()
+                    pair_rows.append(pairs.row[pairs.data != 0] + start)
+                    pair_cols.append(pairs.col[pairs.data != 0])
+                indptr[start + 1:stop + 1] = nnz + block.indptr[1:]
+                nnz += block.nnz
+                if block.nnz:
+                    high = max(high, int(block.data.max()))
+        data_dtype = get_min_dtype(high) if self.auto_dtype else np.dtype(self.build_dtype)
+        index_max = np.iinfo(np.int32).max
+        index_dtype = np.int32 if nnz <= index_max and n <= index_max else np.int64
+        dump_csr_parts(file, (n, n), indptr, data_file, indices_file, self.build_dtype, data_dtype, index_dtype)
+        if year is not None and self.first_pairs is not None:
+            self.add_first_pairs(variant, year, np.concatenate(pair_rows + [np.zeros(0, dtype = np.int64)]),
+                                 np.concatenate(pair_cols + [np.zeros(0, dtype = np.int64)]))
+
+    def load_docs(self, year):
+
+        return self.backend.read_year(year, no_cursor_timeout=True)
+
+    def iter_years_docs(self, years):
+        '''
+        Description
+        -----------
+        
+        Yield the documents of each year, the next self.prefetch years being read in the background
+        
+        Parameters
+        ----------
+        years : iterable
+            years to read
+
+        Returns
+        -------
+        generator of (year, docs)
+
+        '''
+        if self.prefetch:
+            return prefetch(years, lambda year: list(self.load_docs(year)), self.prefetch)
+        return ((year, self.load_docs(year)) for year in years)
+
+    def populate_cooc(self, year):
+        self.get_combi(self.load_docs(year))
             
 
     def create_matrix(self):
@@ -151,7 +1514,11 @@ class create_cooc:
         sparse matrix
 
         ''' 
-        self.x = lil_matrix((len(self.item_list), len(self.item_list)), dtype = self.dtype)
+        if self.vectorized:
+            # The matrix is built in one go by get_combi_vectorized
+            self.x = None
+        else:
+            self.x = lil_matrix((len(self.item_list), len(self.item_list)), dtype = self.build_dtype)
     
 
     def get_item_list(self, docs):
@@ -179,18 +1546,81 @@ class create_cooc:
             items = [item[self.sub_var] for item in items]
             for item in items:
                 self.item_list.append(item)
+            if self.count_items:
+                year = doc.get(self.year_var)
+                for item in items:
+                    self.item_count[item] = self.item_count.get(item, 0) + 1
+                    if year is not None and year < self.item_first_year.get(item, year + 1):
+                        self.item_first_year[item] = year
             n_processed += 1
             if n_processed % 10000 == 0:
                 self.item_list = list(set(self.item_list))
         self.item_list = sorted(list(set(self.item_list)))
 
+    def prune_item_list(self):
+        '''
+        Description
+        -----------
+        
+        Drop the items used less than min_count times and keep the max_vocab most used ones,
+        add the rare item if any and save the pruning statistics in pruning.json
+        
+        Parameters
+        ----------
+
+        Returns
+        -------
+
+        '''
+        kept = [item for item in self.item_list if self.item_count.get(item, 0) >= (self.min_count or 0)]
+        if self.max_vocab and len(kept) > self.max_vocab:
+            # Stable sort: ties keep the order of the vocabulary
+            most_used = set(sorted(kept, key = lambda item: -self.item_count[item])[:self.max_vocab])
+            kept = [item for item in self.item_list if item in most_used]
+        n_occurrences = sum(self.item_count.values())
+        n_occurrences_kept = sum(self.item_count.get(item, 0) for item in kept)
+        stats = {"min_count": self.min_count,
+                 "max_vocab": self.max_vocab,
+                 "rare_item": self.rare_item,
+                 "n_items": len(self.item_list),
+                 "n_kept": len(kept),
+                 "n_dropped": len(self.item_list) - len(kept),
+                 "n_occurrences": n_occurrences,
+                 "n_occurrences_dropped": n_occurrences - n_occurrences_kept}
+        self.item_list = kept
+        if self.rare_item is not None and self.rare_item not in kept:
+            self.item_list.append(self.rare_item)
+        for path_output in self.paths_output.values():
+            json.dump(stats, open(path_output + "/pruning.json", "w"))
+
+    def filter_items(self, items):
+        '''
+        Description
+        -----------
+        
+        Replace the items dropped from the vocabulary by the rare item, or skip them if there is none
+        
+        Parameters
+        ----------
+        items : list
+            items of a document
+
+        Returns
+        -------
+        list of items
+
+        '''
+        if self.rare_item is None:
+            return [item for item in items if item in self.name2index]
+        return [item if item in self.name2index else self.rare_item for item in items]
+
     def create_save_index(self):
         '''
         Description
         -----------
         
         Create dicts that transforms the name in the item_list to an index.
-        Save the dicts to a pickle file.
+        Save the dicts to a pickle file in the folder of each variant.
         Necessary to work with a sparse matrix and update this matrix
         
         Parameters
@@ -202,21 +1632,354 @@ class create_cooc:
         ''' 
         self.name2index = {name:index for name,index in zip(self.item_list, range(0,len(self.item_list),1))}
         self.index2name = {index:name for name,index in zip(self.item_list, range(0,len(self.item_list),1))}
-        pickle.dump( self.name2index, open( self.path_output + "/name2index.p", "wb" ) )
-        pickle.dump( self.index2name, open( self.path_output + "/index2name.p", "wb" ) )
+        self.vocabulary_hashes = dict()
+        for path_output in self.paths_output.values():
+            pickle.dump( self.name2index, open( path_output + "/name2index.p", "wb" ) )
+            pickle.dump( self.index2name, open( path_output + "/index2name.p", "wb" ) )
+
+
+    def get_item_pipeline(self):
+        '''
+        Description
+        -----------
+        
+        MongoDB aggregation pipeline returning one document per distinct item (in _id),
+        so that only the items are sent over the network instead of the full documents.
+        With item_stats the number of occurrences (count) and the first year (first_year) are computed too
+        
+        Parameters
+        ----------
+
+        Returns
+        -------
+        list of stages
 
+        '''
+        project = {"_id": 0, "items": "${}.{}".format(self.var, self.sub_var)}
+        group = {"_id": "$items"}
+        if self.count_items:
+            project["year"] = "$" + self.year_var
+            group["count"] = {"$sum": 1}
+            group["first_year"] = {"$min": "$year"}
+        return [{"$match": {self.var: {"$exists": True}}},
+                {"$project": project},
+                {"$unwind": "$items"},
+                {"$group": group}]
 
     def populate_item_list(self):
         
-        if self.client_name:
-            docs = self.collection.find({},no_cursor_timeout=True)
-            self.get_item_list(docs)
+        if self.backend.supports_aggregation:
+            results = self.collection.aggregate(self.get_item_pipeline(), allowDiskUse = True)
+            items = []
+            for result in tqdm.tqdm(results, desc = "Get item list from the aggregation"):
+                items.append(result["_id"])
+                if self.count_items:
+                    self.item_count[result["_id"]] = result["count"]
+                    self.item_first_year[result["_id"]] = result["first_year"]
+            self.item_list = sorted(set(self.item_list + items))
         else:
-            for file in tqdm.tqdm(os.listdir(self.path_input), "for every year"):
-                with open(self.path_input + "/{}".format(file), 'r') as infile:
-                    docs = json.load(infile)   
+            for year in tqdm.tqdm(self.backend.get_years(), "for every year"):
+                docs = self.backend.read_year(year)
                 self.get_item_list(docs)
 
+    def save_item_stats(self):
+        '''
+        Description
+        -----------
+        
+        Save the number of occurrences and the first year of each item in item_stats.p
+        
+        Parameters
+        ----------
+
+        Returns
+        -------
+
+        '''
+        for path_output in self.paths_output.values():
+            pickle.dump({"count": self.item_count, "first_year": self.item_first_year},
+                        open(path_output + "/item_stats.p", "wb"))
+
+    def remap_matrices(self, years):
+        '''
+        Description
+        -----------
+        
+        Sort the vocabulary built during the single pass, save name2index and index2name
+        and move every matrix saved with the provisional indices to the sorted ones
+        
+        Parameters
+        ----------
+        years : list
+            years whose matrix has been saved with the provisional indices
+
+        Returns
+        -------
+
+        '''
+        self.item_list = sorted(self.name2index)
+        new_index = {item:index for index, item in enumerate(self.item_list)}
+        remap = np.empty(len(self.item_list), dtype = np.int64)
+        for item, index in self.name2index.items():
+            remap[index] = new_index[item]
+        self.create_save_index()
+        shape = (len(self.item_list), len(self.item_list))
+        if self.first_year:
+            # The first years of the pairs are merged from the remapped matrices
+            self.first_pairs = dict()
+        for year in tqdm.tqdm(years, desc = "Remap matrices to the sorted vocabulary"):
+            for path_output in self.paths_output.values():
+                file = path_output + "/items_by_year/{}.npy".format(year)
+                if self.first_year and os.path.exists(file):
+                    np.save(file, np.sort(remap[np.load(file)]).astype(np.int32))
+            if self.block_size:
+                self.remap_matrix_blocks(year, remap)
+                continue
+            self.xs = dict()
+            for variant in self.variants:
+                x = load_matrix(self.paths_output[variant] + "/{}".format(year)).tocoo()
+                rows = np.minimum(remap[x.row], remap[x.col])
+                cols = np.maximum(remap[x.row], remap[x.col])
+                self.xs[variant] = coo_matrix((x.data, (rows, cols)), shape = shape)
+            self.x = self.xs[self.variants[0]]
+            if self.incidence:
+                X, self.doc_ids = load_incidence(self.path_output, year)
+                X = X.tocsr()
+                self.X = csr_matrix((X.data, remap[X.indices], X.indptr), shape = (X.shape[0], shape[0]))
+                self.X.sort_indices()
+            self.save_matrix(year)
+
+    def remap_matrix_blocks(self, year, remap):
+        '''
+        Description
+        -----------
+        
+        Same as remap_matrices for one year in the out-of-core mode: each block of block_size rows
+        of the saved matrix is remapped and spilled to the blocks of its new rows, which are then merged
+        by merge_spill, so that the matrix is never held in memory
+        
+        Parameters
+        ----------
+        year : int
+            year whose matrix has been saved with the provisional indices
+        remap : np.array
+            sorted index of each provisional index
+
+        Returns
+        -------
+
+        '''
+        n = len(remap)
+        for variant in self.variants:
+            file = self.paths_output[variant] + "/{}".format(year)
+            self.spill_dir = tempfile.mkdtemp(prefix = "spill_", dir = self.path_output)
+            for start in range(0, n, self.block_size):
+                x = load_matrix_block(file, start, min(n, start + self.block_size), shape = (n, n)).tocoo()
+                rows = remap[x.row + start]
+                cols = remap[x.col]
+                batch = coo_matrix((x.data.astype(self.build_dtype), (np.minimum(rows, cols), np.maximum(rows, cols))),
+                                   shape = (n, n))
+                self.spill_batch(variant[0], batch)
+            # The diagonal was already dropped when the matrix was saved
+            self.keep_diagonal = {variant[0]: False}
+            self.merge_spill(variant, file, year)
+            shutil.rmtree(self.spill_dir)
+        self.spill_dir = None
+        self.save_matrix_meta(year)
+
+    def main_single_pass(self):
+        '''
+        Description
+        -----------
+        
+        Build the vocabulary and the coocurence matrices with a single read of each year
+        
+        Parameters
+        ----------
+
+        Returns
+        -------
+
+        '''
+        self.name2index = dict()
+        years = []
+        for year, docs in tqdm.tqdm(self.iter_years_docs(self.time_window), total = len(self.time_window),
+                                    desc="For each year in range"):
+            self.get_combi_vectorized(docs, grow_vocabulary = True)
+            self.save_matrix(year)
+            years.append(year)
+        self.remap_matrices(years)
+
+    def get_years_to_update(self):
+        '''
+        Description
+        -----------
+        
+        Years of time_window without a matrix in one of the variants or whose key changed since its matrix was saved
+        (documents of the year, parameters or vocabulary, see get_matrix_key). With append a matrix stays valid
+        when new items were added after it, and the json files of matrices saved without key are compared
+        with their modification time. With first_year the years built without it are built again
+        
+        Parameters
+        ----------
+
+        Returns
+        -------
+        list of years
+
+        '''
+        if self.append and not hasattr(self, "name2index") and os.path.exists(self.path_output + "/name2index.p"):
+            # Vocabulary of the existing matrices
+            self.name2index = pickle.load(open(self.path_output + "/name2index.p", "rb"))
+        years = []
+        for year in self.time_window:
+            outputs = [get_matrix_file(self.paths_output[variant] + "/{}".format(year)) for variant in self.variants]
+            if None in outputs:
+                years.append(year)
+                continue
+            if self.first_year and not all(os.path.exists(path_output + "/items_by_year/{}.npy".format(year))
+                                           for path_output in self.paths_output.values()):
+                # Built without first_year, the items of its documents are unknown
+                years.append(year)
+                continue
+            input_ = None if self.client_name else get_doc_file(self.path_input + "/{}".format(year))
+            if not self.client_name and input_ is None:
+                continue
+            metas = [load_meta(self.paths_output[variant] + "/{}".format(year)) for variant in self.variants]
+            if all(meta is not None for meta in metas):
+                for variant, meta in zip(self.variants, metas):
+                    n_items = meta["params"].get("n_items") if self.append else None
+                    artifact, params, key, signatures = self.get_matrix_key(year, variant, n_items)
+                    if not is_fresh(artifact, key):
+                        years.append(year)
+                        break
+            elif not self.append or self.client_name:
+                # Built with an unknown vocabulary or from unknown documents
+                years.append(year)
+            elif os.path.getmtime(input_) > min(map(os.path.getmtime, outputs)):
+                years.append(year)
+        return years
+
+    def main_append(self):
+        '''
+        Description
+        -----------
+        
+        Extend the existing vocabulary with the new items only and build the new or changed years
+        
+        Parameters
+        ----------
+
+        Returns
+        -------
+
+        '''
+        self.name2index = pickle.load(open(self.path_output + "/name2index.p", "rb"))
+        years = self.get_years_to_update()
+        self.updated_years = years
+        for year, docs in tqdm.tqdm(self.iter_years_docs(years), total = len(years), desc="For each new or changed year"):
+            self.get_combi_vectorized(docs, grow_vocabulary = True)
+            self.save_matrix(year)
+        self.item_list = sorted(self.name2index, key = self.name2index.get)
+        self.create_save_index()
+
+    def save_cumulative(self, path_output):
+        '''
+        Description
+        -----------
+        
+        Save the cumulative matrices C[t] = sum of the yearly matrices of the years <= t.
+        Only the years from the first updated one are recomputed when the previous cumulative matrices are still valid
+        
+        Parameters
+        ----------
+        path_output : str
+            folder of the yearly matrices of a variant
+
+        Returns
+        -------
+
+        '''
+        path_cumulative = path_output + "/cumulative"
+        if not os.path.exists(path_cumulative):
+            os.makedirs(path_cumulative)
+        shape = (len(self.name2index), len(self.name2index))
+        built = get_cooc_years(path_output)
+        start = 0
+        if os.path.exists(path_cumulative + "/years.json"):
+            previous = json.load(open(path_cumulative + "/years.json", "r"))
+            updated = [year for year in self.updated_years if year in built]
+            first_updated = built.index(min(updated)) if updated else len(built)
+            if previous[:first_updated] == built[:first_updated]:
+                start = first_updated
+        if start > 0:
+            cooc = load_matrix(path_cumulative + "/{}".format(built[start-1]), shape)
+        for year in tqdm.tqdm(built[start:], desc = "Cumulative matrices"):
+            if year == built[0]:
+                cooc = load_matrix(path_output + "/{}".format(year), shape)
+            else:
+                cooc = add_matrices(cooc, load_matrix(path_output + "/{}".format(year), shape))
+            if self.auto_dtype:
+                cooc = compact_matrix(cooc)
+            dump_matrix(cooc, path_cumulative + "/{}".format(year), self.matrix_format)
+        json.dump(built, open(path_cumulative + "/years.json", "w"))
+
+    def save_first_year(self, variant):
+        '''
+        Description
+        -----------
+        
+        Save the first year each pair was counted in, the first year each item was used in
+        and the years they were computed from (first_year.json). Years are expected to be non zero.
+        The pairs are the ones merged by save_matrix while the documents were read and the items are the ones
+        of items_by_year, so the matrices are not read again. Only when a year built before was built again
+        are the matrices of the years that were not read loaded
+        
+        Parameters
+        ----------
+        variant : tuple
+            (weighted_network, self_loop)
+
+        Returns
+        -------
+
+        '''
+        path_output = self.paths_output[variant]
+        n = len(self.name2index)
+        shape = (n, n)
+        years = get_cooc_years(path_output)
+        not_read = [year for year in years if year not in self.first_years]
+        previous = None
+        if not_read and os.path.exists(path_output + "/first_year.json"):
+            # Still valid if it was computed from exactly the years not read this time and they were not written since
+            file = get_matrix_file(path_output + "/first_year_pairs")
+            if (file is not None and json.load(open(path_output + "/first_year.json", "r")) == not_read and
+                all(os.path.getmtime(get_matrix_file(path_output + "/{}".format(year))) <= os.path.getmtime(file)
+                    for year in not_read)):
+                previous = load_matrix(file, shape).tocsr().astype(np.int64)
+                previous.data = FIRST_YEAR_BASE - previous.data
+                self.merge_first_pairs({variant: previous})
+        if previous is None:
+            for year in tqdm.tqdm(not_read, desc = "First year of the pairs of the years not read"):
+                x = load_matrix(path_output + "/{}".format(year), shape).tocoo()
+                self.add_first_pairs(variant, year, x.row[x.data != 0], x.col[x.data != 0])
+        first = self.first_pairs.get(variant)
+        first = csr_matrix(shape, dtype = np.int64) if first is None else first.tocoo()
+        first = coo_matrix((FIRST_YEAR_BASE - first.data, (first.row, first.col)), shape = shape)
+        items = np.full(n, np.iinfo(np.int64).max, dtype = np.int64)
+        # An item combined in a year was used in it, items_by_year adds the documents with a single item
+        np.minimum.at(items, first.row, first.data)
+        np.minimum.at(items, first.col, first.data)
+        for year in years:
+            file = path_output + "/items_by_year/{}.npy".format(year)
+            if os.path.exists(file):
+                indices = np.load(file)
+                items[indices] = np.minimum(items[indices], year)
+        items[items == np.iinfo(np.int64).max] = -1
+        dump_matrix(compact_matrix(first.tocsr()), path_output + "/first_year_pairs", self.matrix_format)
+        np.save(path_output + "/first_year_items.npy", items.astype(np.int32))
+        json.dump(years, open(path_output + "/first_year.json", "w"))
+
     def main(self):
         '''
         Description
@@ -232,9 +1995,51 @@ class create_cooc:
 
         '''
         
-        self.populate_item_list()
-        self.create_save_index()
-        for year in tqdm.tqdm(self.time_window, desc="For each year in range"):
-            self.create_matrix()
-            self.populate_cooc(year)
-            self.save_matrix(year)
+        self.updated_years = list(self.time_window)
+        if self.first_year and not self.single_pass:
+            # The first years of the pairs are merged by save_matrix, see remap_matrices for single_pass
+            self.first_pairs = dict()
+        if not self.pruned and not self.append:
+            # pruning.json of a previous build would make the indicators drop unknown items
+            for path_output in self.paths_output.values():
+                if os.path.exists(path_output + "/pruning.json"):
+                    os.remove(path_output + "/pruning.json")
+        if self.append and all(os.path.exists(path_output + "/name2index.p") for path_output in self.paths_output.values()):
+            self.main_append()
+        elif self.single_pass:
+            self.main_single_pass()
+        else:
+            self.populate_item_list()
+            if self.pruned:
+                self.prune_item_list()
+            self.create_save_index()
+            if self.item_stats:
+                self.save_item_stats()
+            # The matrices whose key did not change are kept
+            years = self.get_years_to_update()
+            self.updated_years = years
+            if self.n_jobs > 1:
+                # Signed once by the parent instead of once by each worker
+                for year in years:
+                    self.get_year_signatures(year)
+                with ProcessPoolExecutor(max_workers = self.n_jobs,
+                                         initializer = init_cooc_worker,
+                                         initargs = (self.params, self.name2index, self.signatures)) as executor:
+                    for year, first_pairs in tqdm.tqdm(executor.map(populate_cooc_year, years),
+                                                       total = len(years),
+                                                       desc = "For each year in range"):
+                        if first_pairs is not None:
+                            self.merge_first_pairs(first_pairs)
+                            self.first_years.add(year)
+            else:
+                for year, docs in tqdm.tqdm(self.iter_years_docs(years), total = len(years),
+                                            desc="For each year in range"):
+                    self.create_matrix()
+                    self.get_combi(docs)
+                    self.save_matrix(year)
+        if self.cumulative:
+            for path_output in self.paths_output.values():
+                self.save_cumulative(path_output)
+        if self.first_year:
+            for variant in self.variants:
+                self.save_first_year(variant)
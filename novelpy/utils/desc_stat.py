@@ -1,12 +1,12 @@
 import os
 import tqdm
 import json
-import pymongo 
 import numpy as np
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
 from collections import defaultdict
+from novelpy.utils.backends import get_database
 
 class create_author_db():
         
@@ -78,8 +78,7 @@ class create_author_db():
         """
 
         if self.client_name:
-            self.client = pymongo.MongoClient(self.client_name)
-            self.db = self.client[self.db_name]
+            self.db = get_database(self.client_name, self.db_name)
             collection = self.db[self.collection_authors]
             docs = collection.find()
             self.process_docs(docs)
@@ -139,8 +138,7 @@ class get_stats():
         self.year_variable = year_variable
         
         if client_name:
-            self.client = pymongo.MongoClient(client_name)
-            self.db = self.client[db_name]
+            self.db = get_database(client_name, db_name)
         else:
             self.files_path = 'Data/docs'
          
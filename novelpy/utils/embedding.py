@@ -4,7 +4,6 @@ import yaml
 import tqdm
 import json
 import spacy
-import pymongo
 import numpy as np
 import re
 import pandas as pd
@@ -12,6 +11,8 @@ from itertools import chain
 from pymongo import UpdateOne, InsertOne
 from collections import defaultdict
 from joblib import Parallel, delayed
+from novelpy.utils.io_tools import iter_docs, get_doc_years, prefetch
+from novelpy.utils.backends import get_mongo_client, require_mongo
 
 class Embedding:
     
@@ -87,7 +88,9 @@ class Embedding:
         self.abstract_subvariable = abstract_subvariable
         
         if self.client_name:
-            self.client = pymongo.MongoClient(self.client_name)
+            # The documents are read in a session, refreshed while the embeddings are computed
+            require_mongo(self.client_name, "Embedding")
+            self.client = get_mongo_client(self.client_name)
             self.db = self.client[self.db_name]
             self.session = self.client.start_session()
 
@@ -127,7 +130,7 @@ class Embedding:
                 self.collection_embedding = self.db[collection_embedding]
         else:
             if self.time_range == None:
-                self.all_years = [int(re.sub('.json','',file)) for file in os.listdir("Data/docs/{}/".format(collection_articles))] 
+                self.all_years = get_doc_years("Data/docs/{}/".format(collection_articles)) 
             else:
                 self.all_years = self.time_range
         
@@ -154,10 +157,39 @@ class Embedding:
             collection = self.db[collection_articles]
             self.docs = collection.find({self.year_variable:year},no_cursor_timeout  = True, session=self.session)
         else:
-            self.docs = json.load(
-                open("Data/docs/{}/{}.json".format(collection_articles,
-                                                   year)))
+            self.docs = iter_docs("Data/docs/{}/{}".format(collection_articles,
+                                                           year))
             
+    def read_data_centroid(self,
+                           collection_articles,
+                           year):
+        """
+        Description
+        -----------
+        Read all the documents of a year in memory, so that it can be done in the background
+        while the previous year is embedded. The Mongo query does not use the session of the main thread
+        because sessions cannot be shared between threads
+
+        Parameters
+        ----------
+        collection_articles : str
+            collection of the articles
+        year : int
+            year to read
+
+        Returns
+        -------
+        list
+            documents of the year
+
+        """
+        if self.client_name:
+            collection = self.db[collection_articles]
+            return list(collection.find({self.year_variable:year}))
+        else:
+            return list(iter_docs("Data/docs/{}/{}".format(collection_articles,
+                                                           year)))
+
     def get_title_abs(self,
                       doc):
         """
@@ -282,10 +314,10 @@ class Embedding:
         self.init_dbs_centroid(collection_articles,
                       collection_embedding)
         
-        for year in tqdm.tqdm(self.all_years):
-            self.load_data_centroid(collection_articles,
-                           year)
-
+        # The documents of the next year are read while the current one is embedded
+        for year, self.docs in tqdm.tqdm(prefetch(self.all_years,
+                                                  lambda year: self.read_data_centroid(collection_articles, year)),
+                                         total = len(self.all_years)):
             self.list_of_insertion = []
             
             for doc in tqdm.tqdm(self.docs):
@@ -340,9 +372,9 @@ class Embedding:
             self.collection_embedding = self.db[collection_embedding]
         else:
             collection_embedding_acc = []
-            all_years = [int(re.sub('.json','',file)) for file in os.listdir("Data/docs/{}/".format(collection_embedding))]
+            all_years = get_doc_years("Data/docs/{}/".format(collection_embedding))
             for year in all_years:
-                collection_embedding_acc += json.load(open("Data/docs/{}/{}.json".format(collection_embedding,year)))
+                collection_embedding_acc += iter_docs("Data/docs/{}/{}".format(collection_embedding,year))
             self.collection_embedding = {doc[self.id_variable]:{self.id_variable:doc[self.id_variable],
                                                            "title_embedding":doc["title_embedding"],
                                                            "abstract_embedding":doc["abstract_embedding"]} for doc in collection_embedding_acc}  
@@ -463,7 +495,7 @@ class Embedding:
             if self.client_name:
                 docs = self.collection_articles.find({self.year_variable:year},no_cursor_timeout  = True, session=self.session)#.skip(skip_-1).limit(limit_)
             else:
-                docs = json.load(open("Data/docs/{}/{}.json".format(collection_articles,year)))
+                docs = iter_docs("Data/docs/{}/{}".format(collection_articles,year))
 
             self.list_of_insertion = []
             for doc in tqdm.tqdm(docs, total = limit_):
@@ -531,7 +563,7 @@ class Embedding:
                 os.makedirs("Data/docs/{}_year_embedding/".format(self.aut_id_variable))
                             
             self.authors = json.load(open("Data/docs/{}.json".format(collection_authors))) 
-            all_years = [int(re.sub('.json','',file)) for file in os.listdir("Data/docs/{}/".format(collection_embedding))]
+            all_years = get_doc_years("Data/docs/{}/".format(collection_embedding))
             self.embedding = pd.DataFrame()
             for year in all_years:
                 self.embedding = pd.concat(
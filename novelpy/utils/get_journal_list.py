@@ -1,41 +1,39 @@
 import os
 import tqdm
 import json
-import pymongo
-import numpy as np
-from collections import Counter
+from novelpy.utils.run_indicator_tools import Dataset
 
 
 def get_q_journal_list(focal_year, variable, sub_variable, collection_name, year_variable,
                        keep_item_percentile = 50, client_name = None, db_name = None):
-    if client_name:
-        client = pymongo.MongoClient(client_name)
-        db = client[db_name]
-        collection = db[collection_name]    
-        
-    items = []
-    for year in tqdm.tqdm(range(focal_year-3,focal_year)):
-        if client_name:
-            docs = collection.find({
-                variable:{'$exists':'true'},
-                year_variable:year
-                })
-        else:
-            docs = json.load(open("Data/docs/{}/{}.json".format(collection_name,
-                                                                     year)) )
-        for doc in tqdm.tqdm(docs):
-            if variable in doc:
-                for ref in doc[variable]:
-                    items.append(ref[sub_variable])
+    """
+    Description
+    -----------
+    Save in Data/q_journal_list/{focal_year}.json the items kept by Wang2017(keep_item_percentile),
+    using the item counts of each year saved by Dataset.get_item_counts
 
-    count = Counter(items)                
-    nb_cit = [count[item] for item in count]
-    percentile = np.percentile(nb_cit, keep_item_percentile)
-    list_of_items_restricted = [item for item in count if count[item] >= percentile]
+    """
+    dataset = Dataset(client_name = client_name,
+                      db_name = db_name,
+                      collection_name = collection_name,
+                      year_variable = year_variable,
+                      variable = variable,
+                      sub_variable = sub_variable,
+                      focal_year = focal_year,
+                      keep_item_percentile = keep_item_percentile)
+    dataset.indicator = "wang"
+    try:
+        dataset.load_vocabulary()
+    except FileNotFoundError:
+        # Without coocurence matrices every item is counted out of the vocabulary
+        dataset.name2index = dict()
+        dataset.path_input = None
+        dataset.path_item_counts = "Data/item_counts/{}/{}".format(collection_name, variable)
+    dataset.get_q_journal_list()
     if not os.path.exists("Data/q_journal_list/"):
         os.makedirs("Data/q_journal_list/")
     with open("Data/q_journal_list/{}.json".format(focal_year), 'w') as outfile:
-        json.dump(list_of_items_restricted, outfile)   
+        json.dump(dataset.list_of_items_restricted, outfile)   
         
 
 if __name__ == "__main__":
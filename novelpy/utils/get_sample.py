@@ -3,8 +3,8 @@ from tqdm import tqdm
 import shutil
 import io
 import os
-import pymongo
 import json
+from novelpy.utils.backends import get_database
 
 def download_sample(client_name = None):
     
@@ -37,8 +37,7 @@ def download_sample(client_name = None):
         
         if client_name:
             print("Loading to mongo...")
-            Client = pymongo.MongoClient(client_name)
-            db = Client["novelty_sample"]
+            db = get_database(client_name, "novelty_sample")
             collection = db[col]
             collection.create_index([ ("PMID",1) ])
             collection.create_index([ ("year",1) ])
@@ -0,0 +1,728 @@
+import os
+import re
+import tqdm
+import sys
+import json
+import time
+import queue
+import threading
+import pandas as pd
+from pymongo import InsertOne
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # Only needed for the parquet output of the indicators
+    pa = None
+
+# Whitespace allowed between the values of a JSON array
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+# Number of documents per batch sent by Mongo, larger than the default first batch of 101 documents
+MONGO_BATCH_SIZE = 1000
+
+
+def get_doc_file(path):
+    '''
+    Description
+    -----------
+    Find the file holding the documents of a year whatever its format (.jsonl is preferred over .json)
+
+    Parameters
+    ----------
+    path : str
+        path to the year file with or without its extension, e.g Data/docs/{collection}/{year}
+
+    Returns
+    -------
+    str
+        path to the existing file, None if there is no file for this year
+
+    '''
+    base = re.sub(r'\.(json|jsonl)$', '', path)
+    for extension in [".jsonl", ".json"]:
+        if os.path.exists(base + extension):
+            return base + extension
+    return None
+
+def get_doc_years(path):
+    '''
+    Description
+    -----------
+    Years that have a file of documents (.json or .jsonl) in a folder
+
+    Parameters
+    ----------
+    path : str
+        folder of the year files, e.g Data/docs/{collection}
+
+    Returns
+    -------
+    list
+        sorted years
+
+    '''
+    years = set()
+    for file in os.listdir(path):
+        match = re.match(r'^(-?[0-9]+)\.(json|jsonl)$', file)
+        if match:
+            years.add(int(match.group(1)))
+    return sorted(years)
+
+def iter_jsonl(file):
+    '''
+    Description
+    -----------
+    Yield the documents of a JSON Lines file (one document per line) one at a time
+
+    Parameters
+    ----------
+    file : str
+        path to the .jsonl file
+
+    Returns
+    -------
+    generator of dict
+
+    '''
+    with open(file, "r") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def iter_json_array(file, chunk_size = 2**20):
+    '''
+    Description
+    -----------
+    Yield the documents of a file holding a JSON array one at a time.
+    The file is read by chunks and each document is decoded as soon as it is complete,
+    so only the current document and one chunk are held in memory
+
+    Parameters
+    ----------
+    file : str
+        path to the .json file
+    chunk_size : int
+        number of characters read at once
+
+    Returns
+    -------
+    generator of dict
+
+    '''
+    decoder = json.JSONDecoder()
+    with open(file, "r") as f:
+        buffer = ""
+        pos = 0
+        eof = False
+        expected = "["
+        while True:
+            pos = WHITESPACE.match(buffer, pos).end()
+            if pos == len(buffer):
+                if eof:
+                    raise ValueError("Unexpected end of file in {}".format(file))
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer, pos = chunk, 0
+                continue
+            char = buffer[pos]
+            if expected == "[":
+                if char != "[":
+                    raise ValueError("{} does not hold a JSON array".format(file))
+                pos += 1
+                expected = "first"
+                continue
+            if char == "]" and expected in ["first", ","]:
+                return
+            if expected == ",":
+                if char != ",":
+                    raise ValueError("Expected ',' or ']' between the documents of {}".format(file))
+                pos += 1
+                expected = "value"
+                continue
+            # Decode the next document, reading more of the file until it is complete
+            while True:
+                try:
+                    doc, end = decoder.raw_decode(buffer, pos)
+                    # A number at the end of the buffer may be cut
+                    if end < len(buffer) or eof:
+                        break
+                except ValueError:
+                    if eof:
+                        raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+            yield doc
+            pos = end
+            expected = ","
+
+def iter_docs(path, chunk_size = 2**20):
+    '''
+    Description
+    -----------
+    Yield the documents of a year file one at a time, from a JSON Lines file if there is one
+    or from the legacy JSON array otherwise
+
+    Parameters
+    ----------
+    path : str
+        path to the year file with or without its extension, e.g Data/docs/{collection}/{year}
+    chunk_size : int
+        number of characters read at once for JSON arrays
+
+    Returns
+    -------
+    generator of dict
+
+    '''
+    file = get_doc_file(path)
+    if file is None:
+        raise FileNotFoundError("No documents in {}(.json|.jsonl)".format(path))
+    if file.endswith(".jsonl"):
+        return iter_jsonl(file)
+    return iter_json_array(file, chunk_size)
+
+def convert_to_jsonl(path, remove_json = False):
+    '''
+    Description
+    -----------
+    Convert JSON array files to JSON Lines files (one document per line) without loading them.
+    The .jsonl file is written next to the .json file and is used instead of it by iter_docs
+
+    Parameters
+    ----------
+    path : str
+        .json file, or folder whose .json files are converted, e.g Data/docs/{collection}
+    remove_json : bool
+        remove each .json file once converted
+
+    Returns
+    -------
+
+    '''
+    if os.path.isdir(path):
+        files = [os.path.join(path, file) for file in sorted(os.listdir(path)) if file.endswith(".json")]
+    else:
+        files = [path]
+    for file in tqdm.tqdm(files, desc = "Convert to JSON Lines"):
+        output = re.sub(r'\.json$', '', file) + ".jsonl"
+        with open(output + ".tmp", "w") as outfile:
+            for doc in iter_json_array(file):
+                outfile.write(json.dumps(doc) + "\n")
+        os.replace(output + ".tmp", output)
+        if remove_json:
+            os.remove(file)
+
+def prefetch(keys, load, buffer_size = 1):
+    '''
+    Description
+    -----------
+    Yield (key, load(key)) for each key in order while a background thread already loads the next ones,
+    so that reading year t+1 (a file, a matrix or a Mongo query) overlaps with the work done on year t.
+    At most buffer_size loaded values wait to be consumed. Exceptions raised by load are raised again
+    in the consumer when the failing key is reached
+
+    Parameters
+    ----------
+    keys : iterable
+        keys to load, e.g years
+    load : function
+        function returning the value of a key. It should return data already in memory (e.g a list of documents
+        rather than a lazy cursor), otherwise the actual reading still happens in the consumer
+    buffer_size : int
+        number of values loaded ahead. 0 loads each key when it is needed, without thread
+
+    Returns
+    -------
+    generator of (key, value)
+
+    '''
+    if buffer_size < 1:
+        for key in keys:
+            yield key, load(key)
+        return
+    loaded = queue.Queue()
+    slots = threading.Semaphore(buffer_size)
+    stop = threading.Event()
+    end = object()
+
+    def producer():
+        try:
+            for key in keys:
+                while not slots.acquire(timeout = 0.1):
+                    if stop.is_set():
+                        return
+                if stop.is_set():
+                    return
+                try:
+                    loaded.put((key, load(key), None))
+                except Exception as e:
+                    loaded.put((key, None, e))
+                    return
+        except Exception as e:
+            # The iteration of the keys failed
+            loaded.put((None, None, e))
+            return
+        loaded.put((end, None, None))
+
+    thread = threading.Thread(target = producer, daemon = True)
+    thread.start()
+    try:
+        while True:
+            key, value, error = loaded.get()
+            if key is end:
+                return
+            if error is not None:
+                raise error
+            slots.release()
+            yield key, value
+    finally:
+        # Stop the thread if the consumer leaves early
+        stop.set()
+        thread.join()
+
+def find_by_ids(collection,
+                id_variable,
+                ids,
+                query = None,
+                projection = None,
+                chunk_size = 10000,
+                batch_size = MONGO_BATCH_SIZE):
+    '''
+    Description
+    -----------
+    Yield the documents of a Mongo collection whose id is in ids. The ids are sent to the server
+    by chunks of $in queries instead of filtering the whole collection on the client
+
+    Parameters
+    ----------
+    collection : pymongo.collection.Collection
+        collection to read
+    id_variable : str
+        field of the id of the documents
+    ids : iterable
+        ids of the documents to read
+    query : dict, optional
+        other conditions on the documents
+    projection : dict, optional
+        fields to read
+    chunk_size : int
+        number of ids per query
+    batch_size : int
+        number of documents per batch sent by the server
+
+    Returns
+    -------
+    generator of dict
+
+    '''
+    ids = list(ids)
+    for start in range(0, len(ids), chunk_size):
+        chunk_query = dict(query) if query else dict()
+        chunk_query[id_variable] = {"$in": ids[start:start+chunk_size]}
+        for doc in collection.find(chunk_query, projection).batch_size(batch_size):
+            yield doc
+
+def require_pyarrow():
+    '''
+    Description
+    -----------
+    Raise an ImportError if pyarrow, needed to write parquet files, is not installed
+
+    Parameters
+    ----------
+
+    Returns
+    -------
+
+    '''
+    if pa is None:
+        raise ImportError("The parquet output needs pyarrow, install it with pip install pyarrow")
+
+def flatten_doc(doc, prefix = ""):
+    '''
+    Description
+    -----------
+    One level dict of a nested document, the keys of the nested dicts being joined by dots,
+    e.g {"id": 1, "v_lee": {"score": {"novelty": 0.5}}} gives {"id": 1, "v_lee.score.novelty": 0.5}.
+    Lists are kept as values
+
+    Parameters
+    ----------
+    doc : dict
+        document
+    prefix : str
+        prefix of the keys, used by the recursion
+
+    Returns
+    -------
+    dict
+
+    '''
+    flat = dict()
+    for key, value in doc.items():
+        if isinstance(value, dict):
+            flat.update(flatten_doc(value, prefix + key + "."))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+def get_result_file(path):
+    '''
+    Description
+    -----------
+    Find the file holding the results of create_output for a year whatever its format.
+    The files of a previous run in another format are kept, so the last written one is returned
+    (.parquet, then .jsonl, then .json if they were written at the same time)
+
+    Parameters
+    ----------
+    path : str
+        path to the year file without its extension, e.g Result/{indicator}/{variable}/{year}
+
+    Returns
+    -------
+    str
+        path to the existing file, None if there is no file for this year
+
+    '''
+    files = [path + extension for extension in [".parquet", ".jsonl", ".json"] if os.path.exists(path + extension)]
+    if not files:
+        return None
+    return max(files, key = lambda file: os.stat(file).st_mtime_ns)
+
+def read_results(path, columns = None, filters = None):
+    '''
+    Description
+    -----------
+    Results of create_output for a year as a DataFrame with one row per document and one column per field
+    of the flattened documents (see flatten_doc), e.g "Ref_journals_lee.score.novelty".
+    Only the columns asked for are read from a parquet file; JSON files are read whole
+
+    Parameters
+    ----------
+    path : str
+        path to the year file without its extension, e.g Result/{indicator}/{variable}/{year}
+    columns : list, optional
+        columns to return, all the columns if None. Missing columns are filled with NaN
+    filters : list, optional
+        (column, "==", value) conditions on the documents, pushed down to the parquet reader
+
+    Returns
+    -------
+    pd.DataFrame
+
+    '''
+    file = get_result_file(path)
+    if file is None:
+        raise FileNotFoundError("No results in {}(.parquet|.jsonl|.json)".format(path))
+    if file.endswith(".parquet"):
+        require_pyarrow()
+        if columns is not None:
+            available = set(pq.read_schema(file).names)
+            df = pd.read_parquet(file, columns = [column for column in columns if column in available],
+                                 filters = filters or None)
+            return df.reindex(columns = columns)
+        return pd.read_parquet(file, filters = filters or None)
+    docs = iter_jsonl(file) if file.endswith(".jsonl") else iter_json_array(file)
+    df = pd.DataFrame([flatten_doc(doc) for doc in docs])
+    for column, op, value in filters or []:
+        if op not in ["==", "="]:
+            raise ValueError("Only equality filters are supported on JSON results")
+        df = df[df[column] == value] if column in df else df.iloc[0:0]
+    if columns is not None:
+        df = df.reindex(columns = columns)
+    return df.reset_index(drop = True)
+
+def get_peak_rss():
+    '''
+    Description
+    -----------
+    Peak resident memory of the process
+
+    Parameters
+    ----------
+
+    Returns
+    -------
+    float
+        megabytes, None if it cannot be measured on this platform
+
+    '''
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+class ResultWriter:
+
+    def __init__(self, collection = None, file = None, chunk_size = 10000, verbose = True, backend = None):
+        '''
+        Description
+        -----------
+        Write documents as they are produced instead of keeping all of them in memory. They are buffered and flushed
+        every chunk_size documents, by an unordered bulk_write to a Mongo collection, inserted by a backend (see
+        novelpy.utils.backends.get_backend), appended to a JSON array (.json file)
+        or a JSON Lines file (.jsonl file) or, for a .parquet file, written as a row group of one row per document
+        and one typed column per field of the flattened documents (see flatten_doc), lists becoming list columns.
+        The file is written to {file}.tmp and moved to file by close, so an interrupted run does not leave a partial file.
+        The throughput and the peak memory of the process are reported at each flush
+
+        Parameters
+        ----------
+        collection : pymongo.collection.Collection, optional
+            collection the documents are inserted in
+        file : str, optional
+            .json, .jsonl or .parquet file the documents are written in, used if collection and backend are None
+        chunk_size : int
+            number of documents per flush
+        verbose : bool
+            print the statistics of each flush
+        backend : novelpy.utils.backends.Backend, optional
+            backend the documents are inserted in, e.g a collection of a SQLite file
+
+        Returns
+        -------
+
+        '''
+        if collection is None and backend is None and file is None:
+            raise ValueError("ResultWriter needs a collection, a backend or a file")
+        self.collection = collection
+        self.backend = backend
+        self.file = file
+        self.chunk_size = chunk_size
+        self.verbose = verbose
+        self.buffer = []
+        self.n_docs = 0
+        # Statistics of each flush
+        self.stats = []
+        to_file = collection is None and backend is None
+        self.parquet = to_file and file.endswith(".parquet")
+        if self.parquet:
+            require_pyarrow()
+        self.outfile = open(file + ".tmp", "w") if to_file and not self.parquet else None
+        # The documents of a .json file are the items of a single array
+        self.json_array = self.outfile is not None and file.endswith(".json")
+        if self.json_array:
+            self.outfile.write("[")
+        # Created at the first flush of a parquet file, with the schema of the first documents
+        self.parquet_writer = None
+        # Columns of the parquet file without any value so far
+        self.null_columns = set()
+        self.start = self.last = time.perf_counter()
+
+    def write(self, doc):
+        '''
+        Description
+        -----------
+        Add a document, flushing the buffer when it holds chunk_size documents
+
+        Parameters
+        ----------
+        doc : dict
+
+        Returns
+        -------
+
+        '''
+        self.buffer.append(doc)
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        '''
+        Description
+        -----------
+        Write the buffered documents
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+
+        '''
+        if not self.buffer:
+            return
+        start = time.perf_counter()
+        if self.collection is not None:
+            self.collection.bulk_write([InsertOne(doc) for doc in self.buffer], ordered = False)
+        elif self.backend is not None:
+            self.backend.bulk_write(self.buffer)
+        elif self.parquet:
+            self.write_row_group()
+        elif self.json_array:
+            self.outfile.write(("," if self.n_docs else "") + ",\n".join(json.dumps(doc) for doc in self.buffer))
+            self.outfile.flush()
+        else:
+            self.outfile.write("".join(json.dumps(doc) + "\n" for doc in self.buffer))
+            self.outfile.flush()
+        end = time.perf_counter()
+        self.n_docs += len(self.buffer)
+        stats = {"n_docs": len(self.buffer),
+                 "write_seconds": end - start,
+                 "docs_per_second": len(self.buffer) / max(end - self.last, 1e-9),
+                 "peak_rss_mb": get_peak_rss()}
+        self.stats.append(stats)
+        if self.verbose:
+            tqdm.tqdm.write("Flushed {} documents ({} in total): {:.0f} docs/s, write {:.2f}s, peak memory {}".format(
+                stats["n_docs"], self.n_docs, stats["docs_per_second"], stats["write_seconds"],
+                "{:.0f} MB".format(stats["peak_rss_mb"]) if stats["peak_rss_mb"] is not None else "unknown"))
+        self.buffer = []
+        self.last = end
+
+    def write_row_group(self):
+        '''
+        Description
+        -----------
+        Write the buffered documents as a row group of the parquet file. The schema of the file is widened when the
+        documents hold fields not seen before or values that do not fit the type of their column (see merge_schema)
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+
+        '''
+        rows = [flatten_doc(doc) for doc in self.buffer]
+        # Inferred from all the rows, Table.from_pylist only looks at the keys of the first one
+        schema = pa.schema(list(pa.array(rows).type))
+        if self.parquet_writer is None:
+            schema = self.merge_schema(pa.schema([]), schema)
+            self.parquet_writer = pq.ParquetWriter(self.file + ".tmp", schema)
+        else:
+            null_columns = set(self.null_columns)
+            schema = self.merge_schema(self.parquet_writer.schema, schema)
+            if not schema.equals(self.parquet_writer.schema):
+                self.rewrite(schema, null_columns)
+        self.parquet_writer.write_table(pa.Table.from_pylist(rows, schema = self.parquet_writer.schema))
+
+    def merge_schema(self, schema, new_schema):
+        '''
+        Description
+        -----------
+        Schema of the parquet file holding both the documents already written, with the given schema, and new documents.
+        New fields are appended. Columns without any value so far (null, or lists of nulls) are float64 until a value
+        gives them a type, integers and floats are merged into float64. Other conflicts raise a TypeError
+
+        Parameters
+        ----------
+        schema : pyarrow.Schema
+            schema of the file
+        new_schema : pyarrow.Schema
+            schema inferred from the new documents
+
+        Returns
+        -------
+        pyarrow.Schema
+
+        '''
+        def is_null(type_):
+            return pa.types.is_null(type_) or (pa.types.is_list(type_) and pa.types.is_null(type_.value_type))
+
+        def is_number(type_):
+            return pa.types.is_integer(type_) or pa.types.is_floating(type_)
+
+        fields = {field.name: field for field in schema}
+        for field in new_schema:
+            current = fields.get(field.name)
+            if is_null(field.type):
+                if current is None:
+                    self.null_columns.add(field.name)
+                    fields[field.name] = field.with_type(pa.list_(pa.float64()) if pa.types.is_list(field.type) else pa.float64())
+            elif current is None or field.name in self.null_columns:
+                self.null_columns.discard(field.name)
+                fields[field.name] = field
+            elif current.type != field.type:
+                if is_number(current.type) and is_number(field.type):
+                    fields[field.name] = current.with_type(pa.float64())
+                elif (pa.types.is_list(current.type) and pa.types.is_list(field.type)
+                      and is_number(current.type.value_type) and is_number(field.type.value_type)):
+                    fields[field.name] = current.with_type(pa.list_(pa.float64()))
+                else:
+                    raise TypeError("Cannot write {} values in the {} column {} of {}".format(
+                        field.type, current.type, field.name, self.file))
+        return pa.schema(list(fields.values()))
+
+    def rewrite(self, schema, null_columns):
+        '''
+        Description
+        -----------
+        Write the row groups already in the parquet file again with a wider schema, one row group at a time
+
+        Parameters
+        ----------
+        schema : pyarrow.Schema
+            new schema of the file
+        null_columns : set
+            columns without any value in the row groups already written
+
+        Returns
+        -------
+
+        '''
+        self.parquet_writer.close()
+        os.replace(self.file + ".tmp", self.file + ".tmp.old")
+        previous = pq.ParquetFile(self.file + ".tmp.old")
+        self.parquet_writer = pq.ParquetWriter(self.file + ".tmp", schema)
+        for i in range(previous.num_row_groups):
+            table = previous.read_row_group(i)
+            columns = [pa.nulls(len(table), field.type) if field.name in null_columns or field.name not in table.column_names
+                       else table.column(field.name).cast(field.type) for field in schema]
+            self.parquet_writer.write_table(pa.Table.from_arrays(columns, schema = schema))
+        previous.close()
+        os.remove(self.file + ".tmp.old")
+
+    def close(self):
+        '''
+        Description
+        -----------
+        Flush the last documents and move the file to its final name
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+
+        '''
+        self.flush()
+        if self.parquet:
+            if self.parquet_writer is None:
+                # No document, the file is still written
+                pq.write_table(pa.table({}), self.file + ".tmp")
+            else:
+                self.parquet_writer.close()
+                self.parquet_writer = None
+            os.replace(self.file + ".tmp", self.file)
+        elif self.outfile is not None:
+            if self.json_array:
+                self.outfile.write("]")
+            self.outfile.close()
+            self.outfile = None
+            os.replace(self.file + ".tmp", self.file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+            return
+        if self.outfile is not None:
+            self.outfile.close()
+            self.outfile = None
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+            self.parquet_writer = None
+        if self.collection is None and self.backend is None:
+            for file in [self.file + ".tmp", self.file + ".tmp.old"]:
+                if os.path.exists(file):
+                    os.remove(file)
@@ -1,9 +1,9 @@
 import json
-import glob
 import tqdm
 import pickle
-import pymongo
 from collections import defaultdict
+from novelpy.utils.io_tools import iter_docs, get_doc_file, get_doc_years
+from novelpy.utils.backends import get_database
 
 
 
@@ -19,13 +19,13 @@ class create_authors_past():
         self.client_name = client_name
         self.db_name = db_name
         if self.client_name:
-            self.client = pymongo.MongoClient(client_name)
-            self.db = self.client[db_name]
+            self.db = get_database(client_name, db_name)
             self.collection = self.db[collection_name]
             self.collection_new = self.db[self.collection_name+"_cleaned"]
             self.collection_new.create_index([ ("AID",1) ])
         else:
-            self.files = glob.glob('Data/docs/{}/*.json'.format(self.collection_name))
+            self.files = [get_doc_file('Data/docs/{}/{}'.format(self.collection_name, year))
+                          for year in get_doc_years('Data/docs/{}'.format(self.collection_name))]
 
 
 
@@ -40,8 +40,7 @@ class create_authors_past():
                     self.author2paper[author[self.sub_variable]].append(doc[self.id_variable])
         else:
             for file in self.files:
-                with open(file, 'r') as f:
-                    docs = json.load(f)
+                docs = iter_docs(file)
                 for doc in tqdm.tqdm(docs):
                     for author in doc[self.variable]:
                         self.author2paper[author[self.sub_variable]].append(doc[self.id_variable])
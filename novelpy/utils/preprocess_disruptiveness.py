@@ -1,9 +1,9 @@
 import json
-import glob
 import tqdm
 import pickle
-import pymongo
 from collections import defaultdict
+from novelpy.utils.io_tools import iter_docs, get_doc_file, get_doc_years
+from novelpy.utils.backends import get_database
 
 
 
@@ -20,13 +20,13 @@ class create_citation_network():
         self.year_variable = year_variable
 
         if self.client_name:
-            self.client = pymongo.MongoClient(client_name)
-            self.db = self.client[db_name]
+            self.db = get_database(client_name, db_name)
             self.collection = self.db[collection_name]
             self.collection_new = self.db[self.collection_name+"_cleaned"]
             self.collection_new.create_index([ (self.id_variable,1) ])
         else:
-            self.files = glob.glob('Data/docs/{}/*.json'.format(self.collection_name))
+            self.files = [get_doc_file('Data/docs/{}/{}'.format(self.collection_name, year))
+                          for year in get_doc_years('Data/docs/{}'.format(self.collection_name))]
 
 
         
@@ -40,8 +40,7 @@ class create_citation_network():
                     self.pmid2citedby[ref].append(doc[self.id_variable])
         else:
             for file in self.files:
-                with open(file, 'r') as f:
-                    docs = json.load(f)
+                docs = iter_docs(file)
                 for doc in tqdm.tqdm(docs):
                     for ref in doc[self.variable]:
                         self.pmid2citedby[ref].append(doc[self.id_variable])
@@ -66,8 +65,7 @@ class create_citation_network():
         else:
             gros_dict = {}
             for file in self.files:
-                with open(file, 'r') as f:
-                    docs = json.load(f)
+                docs = iter_docs(file)
                 for doc in tqdm.tqdm(docs):
                     gros_dict[doc[self.id_variable]] = {}
                     gros_dict[doc[self.id_variable]][self.year_variable] = doc[self.year_variable]
@@ -0,0 +1,370 @@
+import numpy as np
+from array import array
+
+
+class RaggedItems:
+
+    def __init__(self, ids, offsets, indices, years = None):
+        '''
+        Description
+        -----------
+        Items of a set of documents stored as flat arrays instead of a dict of lists.
+        The items of the i-th document are indices[offsets[i]:offsets[i+1]], already mapped to the
+        index of the item in the coocurence matrices (name2index)
+
+        Parameters
+        ----------
+        ids : np.array
+            id of each document (int64)
+        offsets : np.array
+            start of the items of each document in indices, followed by the total number of items (int64)
+        indices : np.array
+            index of the items (int32)
+        years : np.array, optional
+            year of each item (int32), used by Uzzi et al. [2013]
+
+        Returns
+        -------
+
+        '''
+        self.ids = ids
+        self.offsets = offsets
+        self.indices = indices
+        self.years = years
+
+    @classmethod
+    def from_docs(cls,
+                  docs,
+                  id_variable,
+                  variable,
+                  sub_variable,
+                  name2index,
+                  map_item = None,
+                  with_years = False,
+                  list_ids = None):
+        '''
+        Description
+        -----------
+        Build the arrays while reading the documents, without keeping the documents or lists of names in memory.
+        Items for which map_item returns None are dropped, other items missing from name2index raise a KeyError
+
+        Parameters
+        ----------
+        docs : iterable
+            documents
+        id_variable : str
+            field of the id of the documents, converted to int
+        variable : str
+            field of the list of items
+        sub_variable : str
+            key of the name of an item when the items are dicts, None if they are names
+        name2index : dict
+            index of each item in the coocurence matrices
+        map_item : function, optional
+            applied to the name of each item first, e.g Dataset.map_item for a pruned vocabulary.
+            Returns None for the items to drop
+        with_years : bool
+            keep the year of each item (item['year']), the items without year are dropped
+        list_ids : set, optional
+            only keep these documents
+
+        Returns
+        -------
+        RaggedItems
+
+        '''
+        ids = array('q')
+        offsets = array('q', [0])
+        indices = array('i')
+        years = array('i') if with_years else None
+        for doc in docs:
+            if list_ids and doc[id_variable] not in list_ids:
+                continue
+            for item in doc[variable]:
+                if with_years and 'year' not in item:
+                    continue
+                name = item[sub_variable] if sub_variable else item
+                if map_item:
+                    name = map_item(name)
+                if not name:
+                    # Dropped by map_item, like the empty items by Dataset.get_item_paper
+                    continue
+                try:
+                    index = name2index[name]
+                except KeyError:
+                    raise KeyError("Item {} of document {} is not in name2index".format(name, doc[id_variable]))
+                indices.append(index)
+                if with_years:
+                    years.append(item['year'])
+            ids.append(int(doc[id_variable]))
+            offsets.append(len(indices))
+        return cls(np.frombuffer(ids, dtype = np.int64),
+                   np.frombuffer(offsets, dtype = np.int64),
+                   np.frombuffer(indices, dtype = np.int32),
+                   np.frombuffer(years, dtype = np.int32) if with_years else None)
+
+    @classmethod
+    def from_incidence(cls, X, ids):
+        '''
+        Description
+        -----------
+        Build the arrays from an incidence matrix (documents x items) saved by create_cooc(incidence = True),
+        an item used c times by a document being repeated c times
+
+        Parameters
+        ----------
+        X : scipy.sparse.csr_matrix
+            incidence matrix
+        ids : np.array
+            id of the document of each row
+
+        Returns
+        -------
+        RaggedItems
+
+        '''
+        counts = X.data.astype(np.int64)
+        indices = np.repeat(X.indices.astype(np.int32), counts)
+        # Number of items before each row
+        offsets = np.concatenate([[0], np.cumsum(counts)])[X.indptr].astype(np.int64)
+        return cls(np.asarray(ids).astype(np.int64), offsets, indices)
+
+    def save(self, file):
+        '''
+        Description
+        -----------
+        Save the arrays in an uncompressed .npz file
+
+        Parameters
+        ----------
+        file : str
+            path to the .npz file
+
+        Returns
+        -------
+
+        '''
+        arrays = dict(ids = self.ids, offsets = self.offsets, indices = self.indices)
+        if self.years is not None:
+            arrays["years"] = self.years
+        # np.savez adds .npz to a path without it
+        with open(file, "wb") as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, file):
+        '''
+        Description
+        -----------
+        Load the arrays saved by save
+
+        Parameters
+        ----------
+        file : str
+            path to the .npz file
+
+        Returns
+        -------
+        RaggedItems
+
+        '''
+        with np.load(file) as arrays:
+            return cls(arrays["ids"], arrays["offsets"], arrays["indices"],
+                       arrays["years"] if "years" in arrays.files else None)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        return self.indices[self.offsets[i]:self.offsets[i+1]]
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def slice(self, start, end):
+        '''
+        Description
+        -----------
+        Documents start to end (excluded), sharing the arrays of this RaggedItems
+
+        Parameters
+        ----------
+        start : int
+            first document
+        end : int
+            last document (excluded)
+
+        Returns
+        -------
+        RaggedItems
+
+        '''
+        first, last = self.offsets[start], self.offsets[end]
+        return RaggedItems(self.ids[start:end],
+                           self.offsets[start:end+1] - first,
+                           self.indices[first:last],
+                           self.years[first:last] if self.years is not None else None)
+
+    def subset(self, mask):
+        '''
+        Description
+        -----------
+        Keep the documents of a boolean mask
+
+        Parameters
+        ----------
+        mask : np.array
+            boolean, one value per document
+
+        Returns
+        -------
+        RaggedItems
+
+        '''
+        lengths = self.lengths[mask]
+        offsets = np.zeros(len(lengths) + 1, dtype = np.int64)
+        offsets[1:] = np.cumsum(lengths)
+        item_mask = np.repeat(mask, self.lengths)
+        return RaggedItems(self.ids[mask],
+                           offsets,
+                           self.indices[item_mask],
+                           self.years[item_mask] if self.years is not None else None)
+
+    def to_dict(self, index2name):
+        '''
+        Description
+        -----------
+        Dict of lists of names used by the rest of the indicators ({"item":name, "year":year} when there are years)
+
+        Parameters
+        ----------
+        index2name : dict
+            name of each index
+
+        Returns
+        -------
+        dict
+
+        '''
+        papers_items = dict()
+        for i, id_ in enumerate(self.ids):
+            start, end = self.offsets[i], self.offsets[i+1]
+            if self.years is not None:
+                papers_items[int(id_)] = [{'item': index2name[index], 'year': int(year)}
+                                          for index, year in zip(self.indices[start:end], self.years[start:end])]
+            else:
+                papers_items[int(id_)] = [index2name[index] for index in self.indices[start:end]]
+        return papers_items
+
+    @property
+    def nbytes(self):
+        return sum(values.nbytes for values in [self.ids, self.offsets, self.indices, self.years] if values is not None)
+
+
+def segment_quantile(values, seg, n_segments, q):
+    '''
+    Description
+    -----------
+    q-th quantile of the values of each segment, with the linear interpolation of np.quantile.
+    A segment holding a NaN gets NaN, an empty segment gets NaN
+
+    Parameters
+    ----------
+    values : np.array
+        values of every segment, flattened
+    seg : np.array
+        segment of each value
+    n_segments : int
+        number of segments
+    q : float
+        quantile between 0 and 1
+
+    Returns
+    -------
+    np.array
+        one value per segment
+
+    '''
+    values = np.asarray(values, dtype = np.float64)
+    sorted_values, starts, counts, has_nan = sort_segments(values, seg, n_segments)
+    result = np.full(n_segments, np.nan)
+    filled = counts > 0
+    virtual = (counts[filled] - 1) * np.float64(q)
+    previous = np.floor(virtual).astype(np.int64)
+    following = np.minimum(previous + 1, counts[filled] - 1)
+    gamma = virtual - previous
+    a = sorted_values[starts[filled] + previous]
+    b = sorted_values[starts[filled] + following]
+    # Same interpolation as numpy's _lerp
+    diff = b - a
+    lerp = a + diff * gamma
+    lerp = np.where(gamma >= 0.5, b - diff * (1 - gamma), lerp)
+    result[filled] = lerp
+    result[has_nan] = np.nan
+    return result
+
+def segment_median(values, seg, n_segments):
+    '''
+    Description
+    -----------
+    Median of the values of each segment, the mean of the two middle values for an even number of values as np.median.
+    A segment holding a NaN gets NaN, an empty segment gets NaN
+
+    Parameters
+    ----------
+    values : np.array
+        values of every segment, flattened
+    seg : np.array
+        segment of each value
+    n_segments : int
+        number of segments
+
+    Returns
+    -------
+    np.array
+        one value per segment
+
+    '''
+    values = np.asarray(values, dtype = np.float64)
+    sorted_values, starts, counts, has_nan = sort_segments(values, seg, n_segments)
+    result = np.full(n_segments, np.nan)
+    filled = counts > 0
+    a = sorted_values[starts[filled] + (counts[filled] - 1) // 2]
+    b = sorted_values[starts[filled] + counts[filled] // 2]
+    result[filled] = (a + b) / 2
+    result[has_nan] = np.nan
+    return result
+
+def sort_segments(values, seg, n_segments):
+    '''
+    Description
+    -----------
+    Sort the values inside each segment
+
+    Parameters
+    ----------
+    values : np.array
+        values of every segment, flattened
+    seg : np.array
+        segment of each value
+    n_segments : int
+        number of segments
+
+    Returns
+    -------
+    sorted_values : np.array
+        values sorted by segment then by value
+    starts : np.array
+        position of the first value of each segment in sorted_values
+    counts : np.array
+        number of values of each segment
+    has_nan : np.array
+        True for the segments holding a NaN
+
+    '''
+    order = np.lexsort((values, seg))
+    counts = np.bincount(seg, minlength = n_segments)
+    starts = np.cumsum(counts) - counts
+    has_nan = np.bincount(seg, weights = np.isnan(values), minlength = n_segments) > 0
+    return values[order], starts, counts, has_nan
@@ -1,16 +1,15 @@
-import pymongo
 import pandas as pd
 import wosfile
 import glob
 import tqdm
 import numpy as np
 import re
+from novelpy.utils.backends import get_database
 
 class Reference_cleaner:
     
     def __init__(self,client_name,db_name,collection_name,IS_WOS):
-        self.client = pymongo.MongoClient(client_name)
-        self.db = self.client[db_name]
+        self.db = get_database(client_name, db_name)
         self.collection = self.db[collection_name]
         self.mesh_col = self.db['meshterms']
         self.IS_WOS = IS_WOS
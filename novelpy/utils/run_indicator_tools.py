@@ -1,12 +1,190 @@
 import os
-import glob
 import json
 import tqdm
 import pickle
-import pymongo
+import tempfile
 import numpy as np
 from collections import Counter
-from itertools import combinations
+from scipy.sparse import issparse, csr_matrix
+from concurrent.futures import ProcessPoolExecutor
+from novelpy.utils.io_tools import get_doc_file, prefetch, ResultWriter, require_pyarrow
+from novelpy.utils.backends import get_backend, MongoBackend
+from novelpy.utils.cache import get_artifact_key, get_signatures, is_fresh, load_meta, save_meta, hash_ids
+from novelpy.utils.ragged import RaggedItems, segment_quantile, segment_median
+from novelpy.utils.cooc_utils import get_pairs, load_matrix, dump_matrix, get_matrix_file, get_cooc_years, load_window_sum, add_matrices, load_past_pairs, load_incidence
+
+class WindowCache:
+
+    def __init__(self, max_sums = 4):
+        """
+        Description
+        -----------
+        State shared by the indicators of successive focal years (see run_indicator_years): the vocabulary
+        of each coocurence folder and the last sums of coocurence matrices. A sum over a window overlapping
+        a cached one is obtained by adding the entering years and subtracting the leaving ones
+
+        Parameters
+        ----------
+        max_sums : int
+            number of sums kept, the least recently used one is dropped first
+
+        Returns
+        -------
+        None.
+
+        """
+        self.max_sums = max_sums
+        self.vocabularies = dict()
+        self.sums = []
+
+    def get_name2index(self, path):
+        """
+        Description
+        -----------
+        name2index of a coocurence folder, loaded again only if the file changed
+
+        Parameters
+        ----------
+        path : str
+            folder of the coocurence matrices
+
+        Returns
+        -------
+        dict
+
+        """
+        file = path + "/name2index.p"
+        mtime = os.path.getmtime(file)
+        if path not in self.vocabularies or self.vocabularies[path][0] != mtime:
+            self.vocabularies[path] = (mtime, pickle.load(open(file, "rb")))
+        return self.vocabularies[path][1]
+
+    def get_sum(self, path, years, shape, load_sum):
+        """
+        Description
+        -----------
+        Sum of the coocurence matrices of years, updated from the closest cached sum when it needs fewer matrices
+
+        Parameters
+        ----------
+        path : str
+            folder of the coocurence matrices
+        years : list
+            years to sum
+        shape : tuple
+            shape of the matrices
+        load_sum : function
+            load_sum(years, shape) returns the sum of the matrices of years read from the disk
+
+        Returns
+        -------
+        scipy.sparse.csr_matrix
+            a copy that can be modified by the indicator
+
+        """
+        years = set(years)
+        best = None
+        for entry in self.sums:
+            cached_path, cached_shape, cached_years, matrix = entry
+            if cached_path != path or cached_shape != shape:
+                continue
+            cost = len(years - cached_years) + len(cached_years - years)
+            if cost < len(years) and (best is None or cost < best[0]):
+                best = (cost, entry)
+        if best is None:
+            cooc = load_sum(sorted(years), shape)
+        else:
+            entry = best[1]
+            self.sums.remove(entry)
+            self.sums.append(entry)
+            cached_years, cooc = entry[2], entry[3]
+            if years == cached_years:
+                return cooc.copy()
+            entering = sorted(years - cached_years)
+            leaving = sorted(cached_years - years)
+            if entering:
+                cooc = add_matrices(cooc, load_sum(entering, shape))
+            if leaving:
+                cooc = csr_matrix(cooc - load_sum(leaving, shape))
+                cooc.eliminate_zeros()
+        self.sums.append((path, shape, years, cooc))
+        if len(self.sums) > self.max_sums:
+            self.sums.pop(0)
+        return cooc.copy()
+
+
+def run_indicator_years(indicator, focal_years, **kwargs):
+    """
+    Description
+    -----------
+    Run an indicator for several focal years sharing a WindowCache, so that the vocabularies are loaded once
+    and the windows of coocurence matrices are updated from one year to the next instead of summed again.
+    The outputs are the same as running the indicator for each year
+
+    Parameters
+    ----------
+    indicator : class
+        Lee2015, Uzzi2013, Foster2015 or Wang2017
+    focal_years : iterable
+        focal years, in increasing order to reuse the most
+    **kwargs : keyword arguments
+        arguments of the indicator except focal_year
+
+    Returns
+    -------
+    None.
+
+    """
+    window_cache = WindowCache()
+    for focal_year in focal_years:
+        instance = indicator(focal_year = focal_year, **kwargs)
+        instance.window_cache = window_cache
+        instance.get_indicator()
+
+
+def init_score_worker(state, file):
+    """
+    Description
+    -----------
+    Initialize a worker of the process pool of create_output.iter_batch_scores. The score matrix is memory mapped
+    from an uncompressed npz file, so that its arrays are shared by the workers instead of being copied in each of them
+
+    Parameters
+    ----------
+    state : dict
+        attributes of the create_output used by get_batch_scores
+    file : str
+        npz file of the score matrix
+
+    Returns
+    -------
+    None.
+
+    """
+    global score_worker
+    score_worker = create_output.__new__(create_output)
+    score_worker.__dict__.update(state)
+    comb_scores = load_matrix(file)
+    score_worker.comb_scores = comb_scores.tocsr() if issparse(comb_scores) else comb_scores
+
+def score_batch(papers):
+    """
+    Description
+    -----------
+    Scores of a batch of documents in a worker of the process pool
+
+    Parameters
+    ----------
+    papers : novelpy.utils.ragged.RaggedItems
+        documents with more than 2 items
+
+    Returns
+    -------
+    list
+        doc_infos of each document
+
+    """
+    return score_worker.get_batch_scores(papers)
 
 class Dataset:
     
@@ -25,7 +203,11 @@ class Dataset:
              new_infos = None,
              density = False,
              keep_item_percentile = None,
-             list_ids = None):
+             list_ids = None,
+             score_dtype = None,
+             ragged = False,
+             n_jobs = 1,
+             output_format = "json"):
         """
         Description
         -----------
@@ -56,6 +238,18 @@ class Dataset:
             Sum the coocurence between the t-time_window_cooc and t+time_window_cooc
         density: bool
             Store scores' density 
+        score_dtype: np.dtype, optional
+            Type of the saved score matrices, e.g np.float32 to halve their size. The default is None (float64).
+        ragged: bool
+            Store the items of the documents as integer arrays (papers_ragged, see RaggedItems) instead of
+            the dict of lists of names papers_items. The default is False.
+        n_jobs: int
+            Number of processes scoring the documents, each one reading the score matrix from a shared memory mapped file.
+            The default is 1.
+        output_format: str
+            "json" to save the results of a year in Result/.../{year}.json, or "parquet" to save them in
+            Result/.../{year}.parquet with one row per document and one column per score (needs pyarrow).
+            Not used with MongoDB. The default is "json".
         Returns
         -------
         None.
@@ -78,35 +272,157 @@ class Dataset:
         self.density  = density
         self.keep_item_percentile = keep_item_percentile
         self.list_ids = list_ids
+        self.score_dtype = score_dtype
+        self.ragged = ragged
+        self.papers_ragged = None
+        # Set by get_q_journal_list, True for the items of list_of_items_restricted
+        self.restricted_mask = None
+        self.path_item_counts = None
+        self.name2index = None
+        self.n_jobs = n_jobs
+        if output_format not in ["json", "parquet"]:
+            raise ValueError("output_format must be 'json' or 'parquet'")
+        if output_format == "parquet" and not client_name:
+            require_pyarrow()
+        self.output_format = output_format
+        # Number of pairs scored at once by create_output.get_batch_scores
+        self.batch_pairs = 5*10**6
+        # Number of documents written at once by populate_list
+        self.flush_size = 10000
+        # npz file of the score matrix loaded by populate_list, memory mapped by the workers when n_jobs > 1
+        self.comb_scores_file = None
+        # Set by run_indicator_years
+        self.window_cache = None
+        # Set by check_score, True if the score matrix of focal_year is up to date and get_cooc does not load the matrices
+        self.score_fresh = False
         
-        if self.client_name:
-            self.client = pymongo.MongoClient(client_name)
-            self.db = self.client[db_name]
-            self.collection = self.db[collection_name]
+        # MongoDB, SQLite file or JSON files depending on client_name
+        self.backend = get_backend(client_name, db_name, collection_name, id_variable, year_variable)
+        if isinstance(self.backend, MongoBackend):
+            self.client = self.backend.client
+            self.db = self.backend.db
+            self.collection = self.backend.collection
 
         self.restricted = '_restricted{}'.format(self.keep_item_percentile) 
+        self.matrix_format = "pickle"
+        # Set by get_cooc if the vocabulary was pruned by create_cooc(min_count, max_vocab)
+        self.pruned = False
+        self.rare_item = None
     
 
+    def get_item_counts(self, year):
+        """
+        
+        Description
+        -----------        
+        Number of times each item is used by the documents of a year. The counts are saved in path_item_counts
+        (item_counts in the coocurence folder by default) and read again while the key of the documents
+        and of the vocabulary does not change (see novelpy.utils.cache and Backend.get_year_signatures)
+
+        Parameters
+        ----------
+        year : int
+            year of the documents
+
+        Returns
+        -------
+        counts : np.array
+            count of each item of name2index
+        oov_counts : dict
+            count of the items missing from name2index
+
+        """
+        path = self.path_item_counts or self.path_input + "/item_counts"
+        artifact = path + "/{}".format(year)
+        oov_file = artifact + "_oov.json"
+        params = dict(collection_name = self.collection_name,
+                      variable = self.variable,
+                      sub_variable = self.sub_variable,
+                      year = year,
+                      n_items = len(self.name2index))
+        meta = load_meta(artifact)
+        previous = meta["inputs"] if meta else None
+        # Documents of the year (file or database) and vocabulary
+        signatures = self.backend.get_year_signatures(year, previous)
+        signatures.update(get_signatures([self.path_input + "/name2index.p" if self.path_input else None], previous))
+        key, signatures = get_artifact_key(artifact, params, list(signatures), signatures)
+        if is_fresh(artifact, key) and os.path.exists(oov_file):
+            return np.load(artifact + ".npy"), json.load(open(oov_file, "r"))
+
+        docs = self.backend.read_year(year,
+                                      {self.variable:{'$exists':'true'}},
+                                      {self.variable + "." + self.sub_variable:1, "_id":0})
+        indices = []
+        oov_counts = Counter()
+        for doc in docs:
+            if self.variable in doc:
+                for ref in doc[self.variable]:
+                    item = ref[self.sub_variable]
+                    index = self.name2index.get(item)
+                    if index is None:
+                        oov_counts[item] += 1
+                    else:
+                        indices.append(index)
+        counts = np.bincount(np.array(indices, dtype = np.int64), minlength = len(self.name2index))
+        if not os.path.exists(path):
+            os.makedirs(path)
+        json.dump(oov_counts, open(oov_file, "w"))
+        np.save(artifact + ".npy", counts)
+        save_meta(artifact, artifact + ".npy", key, params, signatures)
+        return counts, dict(oov_counts)
+
     def get_q_journal_list(self):
-        items = []
+        """
+        
+        Description
+        -----------        
+        Items used at least as much as the keep_item_percentile percentile of the items used in the 3 years
+        before focal_year, from the item counts of each year (see get_item_counts)
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        None.
+
+        """
+        if self.name2index is None:
+            self.load_vocabulary()
+        counts = np.zeros(len(self.name2index), dtype = np.int64)
+        oov_counts = Counter()
         for year in tqdm.tqdm(range(self.focal_year-3,self.focal_year)):
-            if self.client_name:
-                self.docs = self.collection.find({
-                    self.variable:{'$exists':'true'},
-                    self.year_variable:year
-                    })
-            else:
-                self.docs = json.load(open("Data/docs/{}/{}.json".format(self.collection_name,
-                                                                         year)) )
-            for doc in self.docs:
-                if self.variable in doc:
-                    for ref in doc[self.variable]:
-                        items.append(ref[self.sub_variable])
-
-        count = Counter(items)                
-        nb_cit = [count[item] for item in count]
+            year_counts, year_oov_counts = self.get_item_counts(year)
+            counts += year_counts
+            oov_counts.update(year_oov_counts)
+
+        nb_cit = np.concatenate([counts[counts > 0], np.array(list(oov_counts.values()), dtype = np.int64)])
         percentile = np.percentile(nb_cit,self.keep_item_percentile)
-        self.list_of_items_restricted = [item for item in count if count[item] >= percentile]
+        self.restricted_mask = (counts > 0) & (counts >= percentile)
+        index2name = {index: name for name, index in self.name2index.items()}
+        self.list_of_items_restricted = [index2name[index] for index in np.flatnonzero(self.restricted_mask)]
+        self.list_of_items_restricted += [item for item in oov_counts if oov_counts[item] >= percentile]
+
+    def get_restricted_mask(self):
+        """
+        
+        Description
+        -----------        
+        Boolean mask over the item indices of list_of_items_restricted
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        np.array
+
+        """
+        if self.restricted_mask is None:
+            self.restricted_mask = np.zeros(len(self.name2index), dtype = bool)
+            self.restricted_mask[[self.name2index[item] for item in self.list_of_items_restricted
+                                  if item in self.name2index]] = True
+        return self.restricted_mask
 
     def get_item_infos(self,
                        item):
@@ -134,12 +450,41 @@ class Dataset:
             if 'year' in item.keys():
                 doc_item = {'item':item[self.sub_variable],
                                   'year':item['year']}
+                if self.pruned:
+                    doc_item['item'] = self.map_item(doc_item['item'])
+                    if doc_item['item'] is None:
+                        doc_item = None
         elif self.indicator == 'kscores': 
             doc_item = item
         else:
             doc_item = item[self.sub_variable]
+            if self.pruned:
+                doc_item = self.map_item(doc_item)
         
         return  doc_item
+
+    def map_item(self, item):
+        """
+   
+        Description
+        -----------        
+        Item used in the coocurence matrices for an item of a document: itself,
+        or the rare item if it was dropped from the vocabulary by create_cooc(min_count, max_vocab)
+
+        Parameters
+        ----------
+        item : str
+            item from a document list of items.
+
+        Returns
+        -------
+        str
+            None if the item was dropped and there is no rare item.
+
+        """
+        if item in self.name2index:
+            return item
+        return self.rare_item
         
     
     def get_item_paper(self):
@@ -161,54 +506,193 @@ class Dataset:
 
         """
         
+        if self.indicator in ['lee','foster','wang'] and self.get_item_paper_from_incidence():
+            return
+
+        if self.ragged and not self.client_name and self.load_papers_ragged():
+            return
+
+        list_ids = set(self.list_ids) if self.list_ids else None
         # Get docs where variable of interest exists and published in focal_year
-        if self.client_name:
-            self.docs = self.collection.find({
-                self.variable:{'$exists':'true'},
-                self.year_variable:self.focal_year
-                })
+        query = {self.variable:{'$exists':'true'}}
+        # Only the id and the items are read
+        projection = {self.id_variable:1, self.variable:1, "_id":0}
+        if list_ids:
+            query[self.year_variable] = self.focal_year
+            self.docs = self.backend.read_by_ids(list_ids, query, projection)
         else:
-            self.docs = json.load(open("Data/docs/{}/{}.json".format(self.collection_name,self.focal_year)) )
+            self.docs = self.backend.read_year(self.focal_year, query, projection)
         
+        if self.ragged:
+            # The items are mapped to their index while reading the documents
+            self.papers_ragged = RaggedItems.from_docs(tqdm.tqdm(self.docs, desc = "get_papers_item"),
+                                                       self.id_variable,
+                                                       self.variable,
+                                                       self.sub_variable,
+                                                       self.name2index,
+                                                       map_item = self.map_item if self.pruned else None,
+                                                       with_years = self.indicator == 'uzzi',
+                                                       list_ids = list_ids)
+            self.papers_items = None
+            if not self.client_name:
+                self.save_papers_ragged()
+            return
+
         # dict of every docs. Each one contains doc_items
         self.papers_items = dict()
 
 
         for doc in tqdm.tqdm(self.docs, desc = "get_papers_item"):
-            if self.list_ids:
-                if doc[self.id_variable] in self.list_ids:
-                    if self.sub_variable:
-                        doc_items = list()
-                        for item in doc[self.variable]:
-                            doc_item = self.get_item_infos(item)
-                            if doc_item:
-                                doc_items.append(doc_item)
-        
-                        self.papers_items.update({int(doc[self.id_variable]):doc_items})  
-                    else:
-                        self.papers_items.update({int(doc[self.id_variable]):doc[self.variable]})
+            if list_ids and doc[self.id_variable] not in list_ids:
+                continue
+            if self.sub_variable:
+                doc_items = list()
+                for item in doc[self.variable]:
+                    doc_item = self.get_item_infos(item)
+                    if doc_item:
+                        doc_items.append(doc_item)
+
+                self.papers_items.update({int(doc[self.id_variable]):doc_items})  
             else:
-                if self.sub_variable:
-                    doc_items = list()
-                    for item in doc[self.variable]:
-                        doc_item = self.get_item_infos(item)
-                        if doc_item:
-                            doc_items.append(doc_item)
-    
-                    self.papers_items.update({int(doc[self.id_variable]):doc_items})  
-                else:
-                    self.papers_items.update({int(doc[self.id_variable]):doc[self.variable]})                    
+                self.papers_items.update({int(doc[self.id_variable]):doc[self.variable]})
+
+    def get_papers_artifact(self):
+        """
+        
+        Description
+        -----------        
+        Path to the papers_ragged of focal_year saved by save_papers_ragged, without its extension,
+        and the parameters and files it depends on
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        artifact : str
+            Data/papers_items/{collection_name}/{variable}/{focal_year}, followed by _years for Uzzi et al. [2013]
+        params : dict
+        inputs : list
+
+        """
+        with_years = self.indicator == 'uzzi'
+        path = "Data/papers_items/{}/{}".format(self.collection_name, self.variable)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        artifact = path + "/{}{}".format(self.focal_year, "_years" if with_years else "")
+        params = dict(id_variable = self.id_variable,
+                      variable = self.variable,
+                      sub_variable = self.sub_variable,
+                      with_years = with_years,
+                      list_ids = hash_ids(self.list_ids))
+        inputs = [get_doc_file("Data/docs/{}/{}".format(self.collection_name,self.focal_year)),
+                  self.path_input + "/name2index.p",
+                  self.path_input + "/pruning.json"]
+        return artifact, params, inputs
+
+    def load_papers_ragged(self):
+        """
+        
+        Description
+        -----------        
+        Load papers_ragged from the file saved by save_papers_ragged if it is up to date
+        with the documents, the vocabulary and the parameters (see novelpy.utils.cache)
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        bool
+            False if papers_ragged has to be built from the documents
+
+        """
+        artifact, params, inputs = self.get_papers_artifact()
+        self.papers_key, self.papers_signatures = get_artifact_key(artifact, params, inputs)
+        if not is_fresh(artifact, self.papers_key):
+            return False
+        self.papers_ragged = RaggedItems.load(artifact + ".npz")
+        self.papers_items = None
+        return True
+
+    def save_papers_ragged(self):
+        """
+        
+        Description
+        -----------        
+        Save papers_ragged with the key given by load_papers_ragged
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        None.
+
+        """
+        artifact, params, inputs = self.get_papers_artifact()
+        self.papers_ragged.save(artifact + ".npz")
+        save_meta(artifact, artifact + ".npz", self.papers_key, params, self.papers_signatures)
+
+    def get_item_paper_from_incidence(self):
+        """
+        
+        Description
+        -----------        
+        Get the items of the documents of focal_year from the incidence matrix saved by create_cooc(incidence = True)
+        instead of reading the documents again. The items of a document come in the order of the vocabulary
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        bool
+            False if there is no incidence matrix of focal_year built with the same id_variable
+
+        """
+        meta_file = self.path_input + "/incidence/meta.json"
+        if not os.path.exists(meta_file) or get_matrix_file(self.path_input + "/incidence/{}".format(self.focal_year)) is None:
+            return False
+        meta = json.load(open(meta_file, "r"))
+        if meta["id_var"] != self.id_variable or meta["sub_var"] != self.sub_variable:
+            return False
+        X, ids = load_incidence(self.path_input, self.focal_year)
+        X = X.tocsr()
+        if self.ragged:
+            self.papers_ragged = RaggedItems.from_incidence(X, ids)
+            if self.list_ids:
+                self.papers_ragged = self.papers_ragged.subset(np.isin(ids, list(self.list_ids)))
+            self.papers_items = None
+            return True
+        index2name = {index: name for name, index in self.name2index.items()}
+        list_ids = set(self.list_ids) if self.list_ids else None
+        self.papers_items = dict()
+        for row, id_ in enumerate(tqdm.tqdm(ids, desc = "get_papers_item")):
+            if list_ids and id_ not in list_ids:
+                continue
+            start, end = X.indptr[row], X.indptr[row+1]
+            doc_items = []
+            for index, count in zip(X.indices[start:end], X.data[start:end]):
+                name = index2name[index]
+                if name:
+                    doc_items += [name] * int(count)
+            self.papers_items[int(id_)] = doc_items
+        return True
 
     def sum_cooc_matrix(self, window = None):
         """
         
     
+        Description
+        -----------
+        Sum the coocurence matrices of the years in window, or of every year before focal_year.
+        The cumulative matrices saved by create_cooc are used when they are available.
+
         Parameters
         ----------
-        time_window : int
-            time window to compute the difficulty in the past and the reutilisation in the futur.
-        path : str
-            path to adjacency matrices.
+        window : range
+            years to sum. If None every year before focal_year
     
         Returns
         -------
@@ -218,37 +702,85 @@ class Dataset:
         """
         
         
-        i = 0
+        shape = (len(self.name2index), len(self.name2index))
         if window:
-            for year in window:
-                if i == 0:
-                    cooc = pickle.load(open( self.path_input + "/{}.p".format(year), "rb" ))
-                    i += 1
-                else:
-                    cooc += pickle.load(open( self.path_input + "/{}.p".format(year), "rb" ))
-        else: 
-            files = glob.glob(self.path_input+ "/*")
-            files = [file for file in files if file.split("\\")[-1].split(".")[0] not in ["index2name","name2index"]]
-            files = [file for file in files if file.split("/")[-1].split(".")[0] not in ["index2name","name2index"]]
-            try:
-                files = [file for file in files if int(file.split("\\")[-1].split(".")[0])<self.focal_year]
-            except:
-                files = [file for file in files if int(file.split("/")[-1].split(".")[0])<self.focal_year]
-            for file in tqdm.tqdm(files,desc="Summing cooc"):
-                if i == 0:
-                    cooc = pickle.load(open( file, "rb" ))
-                    i += 1
-                else:
-                    cooc += pickle.load(open( file, "rb" ))                
+            years = list(window)
+        else:
+            years = [year for year in get_cooc_years(self.path_input) if year < self.focal_year]
+        if self.window_cache is not None:
+            return self.window_cache.get_sum(self.path_input, years, shape, self.load_cooc_sum)
+        return self.load_cooc_sum(years, shape, progress = not window)
+
+    def load_cooc_sum(self, years, shape, progress = False):
+        """
+        
+    
+        Description
+        -----------
+        Sum the coocurence matrices of years read from the disk
+
+        Parameters
+        ----------
+        years : list
+            years to sum
+        shape : tuple
+            shape of the matrices
+        progress : bool
+            show a progress bar
+    
+        Returns
+        -------
+        matrix : scipy.sparse.csr.csr_matrix
+            sum of considered matrices.
+    
+        """
+        cooc = load_window_sum(self.path_input, years, shape)
+        if cooc is not None:
+            return cooc
+
+        # The matrix of the next year is read while the current one is added
+        files = [self.path_input + "/{}".format(year) for year in years]
+        loaded = prefetch(files, lambda file: load_matrix(file, shape))
+        if progress:
+            loaded = tqdm.tqdm(loaded, total = len(files), desc="Summing cooc")
+        i = 0
+        for file, matrix in loaded:
+            if i == 0:
+                cooc = matrix
+                i += 1
+            else:
+                cooc = add_matrices(cooc, matrix)
         return cooc
 
-    def get_cooc(self):
+    def set_path_input(self):
         
         unw = ['wang']
         type1 = 'unweighted_network' if self.indicator in unw else 'weighted_network'
         type2 = 'no_self_loop' if self.indicator in unw else 'self_loop'
         self.path_input = "Data/cooc/{}/{}_{}".format(self.variable,type1,type2)
-        self.name2index = pickle.load(open(self.path_input + "/name2index.p", "rb" ))
+
+    def load_vocabulary(self):
+        
+        self.set_path_input()
+        if self.window_cache is not None:
+            self.name2index = self.window_cache.get_name2index(self.path_input)
+        else:
+            self.name2index = pickle.load(open(self.path_input + "/name2index.p", "rb" ))
+
+    def get_cooc(self):
+        
+        self.load_vocabulary()
+        if os.path.exists(self.path_input + "/pruning.json"):
+            self.pruned = True
+            self.rare_item = json.load(open(self.path_input + "/pruning.json", "r"))["rare_item"]
+        # Matrices derived from the coocurence matrices are saved in the same format
+        if get_matrix_file(self.path_input + "/{}".format(self.focal_year)) == self.path_input + "/{}.npz".format(self.focal_year):
+            self.matrix_format = "npz"
+        else:
+            self.matrix_format = "pickle"
+        if self.score_fresh:
+            # The score matrix does not need to be computed again
+            return
         
         if self.indicator == "foster":
             if self.starting_year:
@@ -261,16 +793,126 @@ class Dataset:
             if self.starting_year:
                 self.past_adj = self.sum_cooc_matrix( window = range(self.starting_year, self.focal_year))
             else:
-                self.past_adj = self.sum_cooc_matrix()
+                # Only the pairs already used matter, they are given by create_cooc(first_year = True) if available
+                self.past_adj = load_past_pairs(self.path_input, self.focal_year,
+                                                (len(self.name2index), len(self.name2index)))
+                if self.past_adj is None:
+                    self.past_adj = self.sum_cooc_matrix()
             print('Calculate futur matrix for Wang et al.(2017)')
             self.futur_adj = self.sum_cooc_matrix(window = range(self.focal_year+1, self.focal_year+self.time_window_cooc+1))
 
             print('Calculate difficulty matrix for Wang et al.(2017)')
             self.difficulty_adj = self.sum_cooc_matrix(window = range(self.focal_year-self.time_window_cooc,self.focal_year))
         else:
-            self.current_adj =  pickle.load( open(self.path_input+'/{}.p'.format(self.focal_year), "rb" )) 
+            self.current_adj = load_matrix(self.path_input + '/{}'.format(self.focal_year),
+                                           (len(self.name2index), len(self.name2index)))
         
 
+    def get_score_artifact(self):
+        """
+        Description
+        -----------
+        Path to the score matrix of focal_year without its extension
+
+        Returns
+        -------
+        str
+
+        """
+        return os.path.join(self.path_score, str(self.focal_year))
+
+    def get_score_params(self):
+        """
+        Description
+        -----------
+        Parameters the score matrix of focal_year depends on
+
+        Returns
+        -------
+        dict
+
+        """
+        return dict(indicator = self.indicator,
+                    variable = self.variable,
+                    focal_year = self.focal_year,
+                    starting_year = self.starting_year,
+                    time_window_cooc = self.time_window_cooc,
+                    n_reutilisation = self.n_reutilisation,
+                    keep_item_percentile = self.keep_item_percentile,
+                    score_dtype = np.dtype(self.score_dtype).name if self.score_dtype else None,
+                    community_algorithm = getattr(self, "community_algorithm", None),
+                    nb_sample = getattr(self, "nb_sample", None),
+                    seed = getattr(self, "seed", None))
+
+    def get_score_inputs(self):
+        """
+        Description
+        -----------
+        Files the score matrix of focal_year is computed from: the vocabulary, the coocurence matrices
+        of the years used by the indicator and the samples of Uzzi et al. [2013]
+
+        Returns
+        -------
+        list
+
+        """
+        if self.indicator == "foster":
+            if self.starting_year:
+                years = list(range(self.starting_year, self.focal_year))
+            else:
+                years = [year for year in get_cooc_years(self.path_input) if year < self.focal_year]
+        elif self.indicator == "wang":
+            if self.starting_year:
+                years = list(range(self.starting_year, self.focal_year))
+            else:
+                years = [year for year in get_cooc_years(self.path_input) if year < self.focal_year]
+            years += list(range(self.focal_year+1, self.focal_year+self.time_window_cooc+1))
+            years += list(range(self.focal_year-self.time_window_cooc,self.focal_year))
+        else:
+            years = [self.focal_year]
+        inputs = [self.path_input + "/name2index.p"]
+        inputs += [get_matrix_file(self.path_input + "/{}".format(year)) for year in sorted(set(years))]
+        if self.indicator == "uzzi":
+            inputs += [get_matrix_file(self.path_sample + "sample_{}_{}".format(i, self.focal_year))
+                       for i in range(self.nb_sample)]
+        return inputs
+
+    def check_score(self):
+        """
+        Description
+        -----------
+        Compare the key of the score matrix of focal_year with the one saved with it (see novelpy.utils.cache).
+        If they match the score matrix is not computed again and get_cooc does not load the coocurence matrices
+
+        Returns
+        -------
+        bool
+            True if the score matrix is up to date
+
+        """
+        self.set_path_input()
+        artifact = self.get_score_artifact()
+        self.score_meta = load_meta(artifact)
+        self.score_key, self.score_signatures = get_artifact_key(artifact, self.get_score_params(), self.get_score_inputs())
+        self.score_fresh = is_fresh(artifact, self.score_key)
+        if self.score_fresh:
+            print("The score matrix of {} is up to date, it is not computed again".format(self.focal_year))
+        return self.score_fresh
+
+    def save_score_meta(self):
+        """
+        Description
+        -----------
+        Save the key given by check_score next to the score matrix once it is written
+
+        Returns
+        -------
+        None.
+
+        """
+        artifact = self.get_score_artifact()
+        save_meta(artifact, get_matrix_file(artifact), self.score_key, self.get_score_params(), self.score_signatures)
+
     def get_data(self):
         
         if self.indicator in ['uzzi','wang','lee',"foster"]:
@@ -286,83 +928,147 @@ class Dataset:
 
 class create_output(Dataset):
 
-    def get_paper_score(self):
+    def get_score_key(self):
+        key = self.variable + '_' + self.indicator
+        if self.n_reutilisation and self.time_window_cooc:
+            key = key +'_'+str(self.time_window_cooc)+'_'+str(self.n_reutilisation)+self.restricted
+        elif self.time_window_cooc:
+            key = key +'_'+str(self.time_window_cooc)+self.restricted
+        return key
+
+    def papers_to_ragged(self):
         """
     
         Description
         -----------
-        Compute scores for a document and store indicators scores in a dict
+        RaggedItems of the documents of papers_items
     
         Parameters
         ----------
-        kwargs : keyword arguments
-            More argument for novelty as time_window or n_reutilisation
     
         Returns
         -------
-        dict
-            scores and indicators infos.
+        novelpy.utils.ragged.RaggedItems
     
         """
+        if self.ragged:
+            return self.papers_ragged
+        docs = ({'id': idx, 'items': items} for idx, items in self.papers_items.items())
+        return RaggedItems.from_docs(docs, 'id', 'items',
+                                     'item' if self.indicator == 'uzzi' else None,
+                                     self.name2index)
 
-
-
-        if self.unique_pairwise and self.keep_diag:
-            combis = [(i,j) for i,j in combinations(set(self.current_items),2)]
-        elif self.unique_pairwise == False and self.keep_diag == False:
-            combis = [(i,j) for i,j in combinations(self.current_items,2) if i != j]
-        elif self.unique_pairwise and self.keep_diag == False:
-            combis = [(i,j) for i,j in combinations(set(self.current_items),2) if i != j]
+    def get_batch_scores(self, papers):
+        """
+    
+        Description
+        -----------
+        Scores of a batch of documents at once: the pairs of every document are
+        generated as arrays, their scores are read from comb_scores in one lookup and reduced by document
+    
+        Parameters
+        ----------
+        papers : novelpy.utils.ragged.RaggedItems
+            documents with more than 2 items
+    
+        Returns
+        -------
+        list
+            doc_infos of each document
+    
+        """
+        n_papers = len(papers)
+        indices = papers.indices
+        lengths = papers.lengths
+        if self.indicator == 'wang':
+            # Unique items of each document (unique_pairwise), in increasing order
+            doc = np.repeat(np.arange(n_papers), lengths)
+            order = np.lexsort((indices, doc))
+            doc, indices = doc[order], indices[order]
+            keep = np.r_[True, (doc[1:] != doc[:-1]) | (indices[1:] != indices[:-1])]
+            doc, indices = doc[keep], indices[keep]
+            lengths = np.bincount(doc, minlength = n_papers)
+        seg, left, right = get_pairs(lengths)
+        rows = np.minimum(indices[left], indices[right])
+        cols = np.maximum(indices[left], indices[right])
+        if self.indicator == 'wang':
+            # Only the pairs of restricted items are scored, none if no item is restricted (novelty 0)
+            restricted = self.get_restricted_mask()
+            keep = restricted[rows] & restricted[cols]
+            seg, rows, cols = seg[keep], rows[keep], cols[keep]
+        if len(rows):
+            scores = np.asarray(self.comb_scores[rows, cols], dtype = np.float64).ravel()
         else:
-            combis = [(i,j) for i,j in combinations(self.current_items,2)]
-        
-        scores_list = []
-        for combi in combis:
-            if self.indicator == 'wang':
-                if self.list_of_items_restricted:
-                    if combi[0] in self.list_of_items_restricted and combi[1] in self.list_of_items_restricted: 
-                        combi = sorted( (self.name2index[combi[0]], self.name2index[combi[1]]) )
-                        scores_list.append(float(self.comb_scores[combi[0], combi[1]]))
-            else:
-                combi = sorted( (self.name2index[combi[0]], self.name2index[combi[1]]) )
-                scores_list.append(float(self.comb_scores[combi[0], combi[1]]))
-            """
-            comb_infos.append({"item1" : combi[0],
-                          "item2" : combi[1],
-                          "score" : float(self.comb_scores[combi[0], combi[1]]) })
-            """
-        self.scores_array = np.array(scores_list)
-        
-        key = self.variable + '_' + self.indicator
-        if self.n_reutilisation and self.time_window_cooc:
-            key = key +'_'+str(self.time_window_cooc)+'_'+str(self.n_reutilisation)+self.restricted
-        elif self.time_window_cooc:
-            key = key +'_'+str(self.time_window_cooc)+self.restricted
-           
+            scores = np.zeros(0)
+
         if self.indicator == 'wang':
-            score = {'novelty':sum(self.scores_array)}
-            
+            novelty = np.bincount(seg, weights = scores, minlength = n_papers)
+            scores_by_paper = {'novelty': novelty}
         elif self.indicator == 'uzzi':
-            score = {'conventionality': np.median(self.scores_array),
-                     'novelty': np.quantile(self.scores_array,0.1)}
-            
+            scores_by_paper = {'conventionality': segment_median(scores, seg, n_papers),
+                               'novelty': segment_quantile(scores, seg, n_papers, 0.1)}
         elif self.indicator == 'lee':
-            score = {'novelty': -np.log(np.quantile(self.scores_array,0.1))}
-        
+            with np.errstate(divide = 'ignore'):
+                scores_by_paper = {'novelty': -np.log(segment_quantile(scores, seg, n_papers, 0.1))}
         elif self.indicator == 'foster':
-            scores_list = [1-i for i in self.scores_array]
-            score = {'novelty': float(np.mean(scores_list))}
+            scores = 1 - scores
+            counts = np.bincount(seg, minlength = n_papers)
+            scores_by_paper = {'novelty': np.bincount(seg, weights = scores, minlength = n_papers) / counts}
 
         if self.density:
-            doc_infos = {"scores_array": scores_list,
-                         'score':score}
-        else:
-            doc_infos = {'score':score}
+            bounds = np.cumsum(np.bincount(seg, minlength = n_papers))[:-1]
+            scores_arrays = [values.tolist() for values in np.split(scores, bounds)]
+        all_doc_infos = []
+        for i in range(n_papers):
+            score = {name: float(values[i]) for name, values in scores_by_paper.items()}
+            if self.density:
+                doc_infos = {"scores_array": scores_arrays[i],
+                             'score':score}
+            else:
+                doc_infos = {'score':score}
+            all_doc_infos.append(doc_infos)
+        return all_doc_infos
 
-        self.key = key
-        self.doc_infos = doc_infos
-        return {key:doc_infos}
+    def iter_batch_scores(self, batches):
+        """
+    
+        Description
+        -----------
+        Yield get_batch_scores of each batch in order. With n_jobs > 1 the batches are scored by a process pool:
+        the workers memory map the score matrix (the npz file it was loaded from, or a temporary copy of it) and receive
+        the documents as integer arrays, so neither name2index nor the matrix is pickled to them
+    
+        Parameters
+        ----------
+        batches : list
+            RaggedItems of documents with more than 2 items
+    
+        Returns
+        -------
+        generator of list
+            doc_infos of the documents of each batch
     
+        """
+        if self.n_jobs <= 1 or len(batches) <= 1:
+            for batch in tqdm.tqdm(batches, desc='start'):
+                yield self.get_batch_scores(batch)
+            return
+        state = dict(indicator = self.indicator, density = self.density)
+        if self.indicator == 'wang':
+            state['list_of_items_restricted'] = self.list_of_items_restricted
+            state['restricted_mask'] = self.get_restricted_mask()
+        with tempfile.TemporaryDirectory() as tmp:
+            file = self.comb_scores_file
+            if file is None or not file.endswith(".npz"):
+                file = os.path.join(tmp, "comb_scores")
+                dump_matrix(self.comb_scores, file, "npz")
+                file += ".npz"
+            with ProcessPoolExecutor(max_workers = self.n_jobs,
+                                     initializer = init_score_worker,
+                                     initargs = (state, file)) as executor:
+                for all_doc_infos in tqdm.tqdm(executor.map(score_batch, batches), total = len(batches), desc='start'):
+                    yield all_doc_infos
+
     def populate_list(self):
         """
         Description
@@ -378,61 +1084,51 @@ class create_output(Dataset):
         
         # Load the score of pairs given by the indicator
         if self.indicator == 'wang':
-            self.comb_scores = pickle.load(
-                    open(
-                        'Data/score/{}/{}/{}.p'.format(
+            score_file = 'Data/score/{}/{}/{}'.format(
                             self.indicator,
                             self.variable+'_'+str(self.time_window_cooc)+'_'+str(self.n_reutilisation)+self.restricted,
-                             self.focal_year),
-                        "rb" ))       
+                             self.focal_year)
         else:
-            self.comb_scores = pickle.load(
-                    open(
-                        'Data/score/{}/{}/{}.p'.format(
-                            self.indicator,self.variable,self.focal_year),
-                        "rb" ))  
+            score_file = 'Data/score/{}/{}/{}'.format(
+                            self.indicator,self.variable,self.focal_year)
+        self.comb_scores = load_matrix(score_file)
+        self.comb_scores_file = get_matrix_file(score_file)
         
-        # Iterate over every docs 
-        list_of_insertion = []
-        for idx in tqdm.tqdm(list(self.papers_items),desc='start'):
+        # The results are written by chunks as the documents are scored
+        if self.client_name:
+            writer = ResultWriter(backend = self.output_backend, chunk_size = self.flush_size)
+        else:
+            extension = ".parquet" if self.output_format == "parquet" else ".json"
+            writer = ResultWriter(file = self.path_output + "/{}{}".format(self.focal_year, extension), chunk_size = self.flush_size)
         
+        # Iterate over every docs 
+        with writer:
             if self.indicator in ['uzzi','wang','lee','foster']:
+                if issparse(self.comb_scores):
+                    self.comb_scores = self.comb_scores.tocsr()
+                papers = self.papers_to_ragged()
                 # Check that you have more than 2 item (1 combi) else no combination and no novelty 
-                if len(self.papers_items[idx])>2:
-                    self.current_items = self.papers_items[idx]
-                    
-                    if self.indicator == 'uzzi':
-                        self.current_items = [item["item"] for item in self.current_items]
-                    
-                    if self.indicator != 'wang':
-                        self.unique_pairwise = False
-                        self.keep_diag=True
-                    else:
-                        self.unique_pairwise = True
-                        self.keep_diag=False
-                                   
-                    # Use novelty score of combination + Matrix of combi of papers to have novelty score of the paper with id_variable = idx
-                    self.get_paper_score()
-                else:
-                    continue
-            
-            elif self.new_infos:
-                self.doc_infos = self.new_infos
-            
-            
-            if self.client_name:
-                list_of_insertion.append({self.id_variable: int(idx),
-                                          self.key: self.doc_infos,
-                                          self.year_variable:self.focal_year})
+                papers = papers.subset(papers.lengths > 2)
+                self.key = self.get_score_key()
+                # Batches of documents holding about batch_pairs pairs
+                n_pairs = np.cumsum(papers.lengths * (papers.lengths - 1) // 2)
+                batch_pairs = self.batch_pairs
+                if self.n_jobs > 1 and len(papers):
+                    # About 4 batches per process so that they stay busy until the end
+                    batch_pairs = max(min(batch_pairs, int(n_pairs[-1]) // (4 * self.n_jobs)), 1)
+                bounds = np.searchsorted(n_pairs, np.arange(batch_pairs, n_pairs[-1], batch_pairs)) if len(papers) else []
+                bounds = np.unique(np.r_[0, bounds, len(papers)])
+                batches = [papers.slice(start, end) for start, end in zip(bounds[:-1], bounds[1:])]
+                for batch, all_doc_infos in zip(batches, self.iter_batch_scores(batches)):
+                    for idx, doc_infos in zip(batch.ids, all_doc_infos):
+                        writer.write({self.id_variable: int(idx),
+                                      self.key: doc_infos,
+                                      self.year_variable:self.focal_year})
             else:
-                list_of_insertion.append({self.id_variable: int(idx),self.key: self.doc_infos, self.year_variable:self.focal_year})
-
-        
-        if self.client_name:
-            self.collection_output.insert_many(list_of_insertion)
-        else:
-            with open(self.path_output + "/{}.json".format(self.focal_year), 'w') as outfile:
-                json.dump(list_of_insertion, outfile)        
+                for idx in tqdm.tqdm(list(self.papers_items),desc='start'):
+                    if self.new_infos:
+                        self.doc_infos = self.new_infos
+                    writer.write({self.id_variable: int(idx),self.key: self.doc_infos, self.year_variable:self.focal_year})
     
     def update_paper_values(self, **kwargs):
         """
@@ -455,11 +1151,11 @@ class create_output(Dataset):
                 self.collection_output_name = "output_" + self.indicator + "_" + self.variable
                 if self.indicator == "wang":
                     self.collection_output_name = "output_" + self.indicator + "_" + self.variable + "_" + str(self.time_window_cooc) + "_" + str(self.n_reutilisation)+self.restricted
-                self.collection_output = self.db[self.collection_output_name]
-                if self.collection_output_name not in self.db.list_collection_names():
-                    print("Init output collection with index on id_variable ...")
-                    self.collection_output.create_index([ (self.id_variable,1) ])
-                    self.collection_output.create_index([ (self.year_variable,1) ])
+                self.output_backend = get_backend(self.client_name, self.db_name, self.collection_output_name,
+                                                  self.id_variable, self.year_variable)
+                # Does nothing if the indexes already exist
+                self.output_backend.create_index(self.id_variable)
+                self.output_backend.create_index(self.year_variable)
         else:
             if self.indicator == "wang":
                 self.path_output = "Result/{}/{}".format(self.indicator, self.variable+ "_" + str(self.time_window_cooc) + "_" + str(self.n_reutilisation)+self.restricted)
@@ -473,6 +1169,7 @@ class create_output(Dataset):
         else:
             print('''indicator must be in 'uzzi', 'foster', 'lee', 'wang' ''')
         if self.client_name:
-            print("Results are saved in the collection named '{}' in MongoDB".format(self.collection_output_name))
+            print("Results are saved in the collection named '{}' in {}".format(
+                self.collection_output_name, "MongoDB" if isinstance(self.output_backend, MongoBackend) else "SQLite"))
         else:
             print("Results are in {}".format(self.path_output))